@@ -5,28 +5,50 @@
 # - run_all 內部會呼叫 ingest_channel_daily、fetch_videos、top_videos、update_playlists，
 #   並經由 run_pipeline_and_notify 負責統一的重試與通知。
 
+import re
 import sys
+import threading
 import time, random
 import typer
 from rich.console import Console
-from typing import Optional
+from typing import List, Optional
 
 # 載入專案設定（.env 等）
 from scripts.utils.env import load_settings
-# 頻道日更 ingestion 與頻道 ID 辨識工具
-from scripts.ingestion.channel_daily import ingest_channel_daily, _resolve_channel_id
 # 清空終端畫面的小工具（純顯示用途）
 from scripts.utils.terminal import clear_terminal
-# 影片抓取與熱門影片分析服務
-from scripts.services.video_ingestion import run_fetch_videos, run_top_videos
-# 播放清單維護服務
-from scripts.services.playlist_update import run_update_playlists
-# Pipeline 執行與通知（含重試、彙整結果、發送通知）
-from scripts.notifications.runner import run_pipeline_and_notify
-# 備註：notify_all 目前在此檔未使用，若未被其他模組引用，可移除以避免未使用 import 的警告
-from scripts.notifications.senders import notify_all  # noqa: F401
-from scripts.db.db import get_engine
-from scripts.channel.ensure import ensure_dim_channel_exists
+
+# 備註：各子命令的服務模組（DB、YouTube API、通知等）改於函式內延遲匯入，
+# 只有實際執行該子命令時才載入，讓 --help 與其他子命令的啟動不必載入整棵相依樹。
+
+# run_all 重試判定用的錯誤訊息樣式（模組載入時編譯一次，每次判定只掃描訊息一遍）
+# - 授權/配額等用戶側錯誤（403、其他 4xx、quota），不重試
+_NONRETRY_RE = re.compile(r"403|http 4| 4xx|quota")
+# - 暫時性錯誤：逾時、連線中斷、5xx、429、部分 Windows 網路錯誤等
+_TRANSIENT_RE = re.compile(
+    r"timeout|timed out|time-out"
+    r"|connection reset|connection aborted|connection refused"
+    r"|temporarily unavailable|try again|unavailable"
+    r"|server error|http 5| 5xx"
+    r"|rate limit|too many requests|429"
+    r"|winerror"
+)
+
+# 啟動時於背景預熱 DB 連線池的執行緒（僅 __main__ 一鍵執行時建立）
+_warmup_thread: Optional[threading.Thread] = None
+
+def _warm_up_engine() -> None:
+    """
+    背景預熱：建立 Engine 並實際借出/歸還一條連線，讓 DNS、TCP 與認證提前完成。
+    - 失敗時僅略過，真正的錯誤留待 run_all 第一次使用 DB 時回報。
+    """
+    try:
+        from scripts.db.db import get_engine
+        with get_engine().connect():
+            pass
+    except Exception:
+        pass
+
 # 建立 Typer 應用程式，並提供全域 help 描述
 app = typer.Typer(help="YouTube Data Pipeline CLI", invoke_without_command=True)
 
@@ -50,6 +72,9 @@ def cmd_update_playlists(
       - 清單1/2 僅做差異 insert/delete，避免調整順序以節省日額
       - 清單3 清空並依排序重建（需要順序）
     """
+    from scripts.ingestion.channel_daily import _resolve_channel_id
+    from scripts.services.playlist_update import run_update_playlists
+
     # 讀取 .env 與其他設定
     cfg = load_settings()
     # 若使用者未提供 --channel-id，則以設定檔預設值解析
@@ -78,6 +103,9 @@ def cmd_top_videos(
     top_n: int = typer.Option(10, "--top", "-n", min=1, max=500, help="取前 N 名"),
     include_revenue: bool = typer.Option(False, "--include-revenue", help="若有授權，可嘗試包含 estimatedRevenue"),
 ):
+    from scripts.ingestion.channel_daily import _resolve_channel_id
+    from scripts.services.video_ingestion import run_top_videos
+
     # 讀取設定與解析頻道 ID
     cfg = load_settings()
     cid = _resolve_channel_id(channel_id, cfg)
@@ -110,6 +138,9 @@ def cmd_fetch_videos(
       - videos.list 批次抓取詳情（最多 50/批）
       - 依 shorts_check 規則 upsert 到 dim_video
     """
+    from scripts.ingestion.channel_daily import _resolve_channel_id
+    from scripts.services.video_ingestion import run_fetch_videos
+
     # 讀取設定與解析頻道 ID
     cfg = load_settings()
     cid = _resolve_channel_id(channel_id, cfg)
@@ -135,6 +166,8 @@ def cmd_ingest_channel_daily(
       2) 抓取 day × channel 指標並寫入 fact_yta_channel_daily
          範圍：上次抓取日+1 或 頻道建立日 到 today-0
     """
+    from scripts.ingestion.channel_daily import ingest_channel_daily, _resolve_channel_id
+
     # 讀取設定與解析頻道 ID
     settings = load_settings()
     cid = _resolve_channel_id(channel_id, settings)
@@ -143,8 +176,30 @@ def cmd_ingest_channel_daily(
     # 執行頻道日更流程
     ingest_channel_daily(cid, settings)
 
+# 子命令：ingest_channels_daily
+# 功能：多頻道版本的 ingest_channel_daily，YA 查詢並行、DB 寫入單執行緒
+@app.command("ingest_channels_daily")
+def cmd_ingest_channels_daily(
+    channel_ids: Optional[List[str]] = typer.Option(None, "--channel-id", "-c", help="YouTube channel id，可重複指定；預設讀取 .env CHANNEL_ID"),
+):
+    """
+    多頻道一次匯入日指標：
+      1) 逐一更新/建立 dim_channel 並計算各頻道抓取範圍
+      2) 並行抓取 day × channel 指標，統一寫入 fact_yta_channel_daily
+         設定 .env YAAO_CONTENT_OWNER_ID 時，多頻道改以單一 channel,day 報表查詢取回
+    """
+    from scripts.ingestion.channel_daily import ingest_channels_daily
+
+    # 讀取設定；未指定 --channel-id 時回退至 .env CHANNEL_ID，並去除重複頻道
+    settings = load_settings()
+    cids = list(dict.fromkeys(channel_ids or [settings["CHANNEL_ID"]]))
+
+    # 執行多頻道日更流程
+    total = ingest_channels_daily(cids, settings)
+    print(f"[ingest_channels_daily] {len(cids)} 個頻道，共寫入 {total} 列")
+
 # 子命令：run_all（預設主流程）
-# 功能：以統一的重試與通知機制，依序執行四個步驟：ingest_channel_daily → fetch_videos → top_videos → update_playlists
+# 功能：以統一的重試與通知機制分階段執行：ingest_channel_daily → (top_videos ∥ update_playlists)
 @app.command("run_all")
 def cmd_run_all(
     channel_id: Optional[str] = typer.Option(None, "--channel-id", "-c", help="YouTube channel id；預設讀取 .env CHANNEL_ID"),
@@ -171,13 +226,18 @@ def cmd_run_all(
     backoff_max: float = typer.Option(30.0, "--backoff-max", help="單次重試最大等待秒數"),
 ):
     """
-    依序執行四個步驟（任一步驟失敗則中止）並具備重試機制：
+    分階段執行步驟（任一步驟失敗則中止後續階段）並具備重試機制：
       1) ingest_channel_daily
-      2) fetch_videos
-      3) top_videos
-      4) update_playlists
+      2) top_videos 與 update_playlists（互不相依，同階段並行）
     遇到 403（例如配額用盡）或其他明確 4xx 錯誤時不重試，直接中止。
     """
+    from scripts.ingestion.channel_daily import ingest_channel_daily, _resolve_channel_id
+    from scripts.services.video_ingestion import run_top_videos
+    from scripts.services.playlist_update import run_update_playlists
+    from scripts.notifications.runner import run_pipeline_and_notify
+    from scripts.db.db import get_engine, get_connection
+    from scripts.channel.ensure import ensure_dim_channel_exists
+
     # 美化輸出（分隔線、標題等）
     console = Console()
 
@@ -186,32 +246,14 @@ def cmd_run_all(
     cid = _resolve_channel_id(channel_id, cfg)
     console.rule(f"Run All Pipeline for 頻道ID={cid}")
 
-    # 初始化 DB 與確保頻道存在（若無則建立 dim_channel 基本資料）
-    engine = get_engine()
-    ch_payload = ensure_dim_channel_exists(engine, cid)
-    name = (ch_payload or {}).get("channel_name")
-    console.rule(f"Run All Pipeline for 頻道名稱={name}")
-
     # 判斷是否值得重試的錯誤類型（依訊息字串判定）
     def _should_retry(exc: Exception) -> bool:
         msg = str(exc).lower()
         # 授權/配額等用戶側錯誤，不重試
-        if "403" in msg or "http 403" in msg or "quota" in msg:
-            return False
-        if "http 4" in msg or " 4xx" in msg:
+        if _NONRETRY_RE.search(msg):
             return False
-        # 部分 Windows 網路錯誤可重試
-        if "winerror" in msg:
-            return True
-        # 常見暫時性錯誤關鍵字：逾時、連線中斷、5xx、429 等
-        transient_keywords = [
-            "timeout", "timed out", "time-out",
-            "connection reset", "connection aborted", "connection refused",
-            "temporarily unavailable", "try again", "unavailable",
-            "server error", "http 5", " 5xx",
-            "rate limit", "too many requests", "429",
-        ]
-        return any(k in msg for k in transient_keywords)
+        # 常見暫時性錯誤（含 Windows 網路錯誤）才重試
+        return bool(_TRANSIENT_RE.search(msg))
 
     # 計算每次重試的等待秒數，含抖動（jitter）
     def _sleep_for_retry(attempt_idx: int):
@@ -221,111 +263,102 @@ def cmd_run_all(
         time.sleep(jitter)
         return jitter
 
-    # 將四個步驟以統一規格描述，交由 runner 處理重試與序列執行
-    steps_spec = [
-        {
-            "name": "ingest_channel_daily",
-            "fn": ingest_channel_daily,  # 直接呼叫目標函數
-            "args": [cid, cfg],          # 位置參數
-            "kwargs": {},                # 關鍵字參數
-        },
-        {
-            "name": "top_videos",
-            "fn": run_top_videos,
-            "args": [],
-            "kwargs": {
-                "channel_id": cid,
-                "start_date": tv_start_date,
-                "end_date": tv_end_date,
-                "from_offset": tv_from_offset,
-                "to_offset": tv_to_offset,
-                "metric": tv_metric,
-                "top_n": tv_top_n,
-                "include_revenue": tv_include_revenue,
-                "settings": cfg,
-            },
-        },
-        {
-            "name": "update_playlists",
-            "fn": run_update_playlists,
-            "args": [],
-            "kwargs": {
-                "channel_id": cid,
-                "dry_run": up_dry_run,
-                "window_start": up_window_start,
-                "window_end": up_window_end,
-                "max_changes_per_playlist": up_max_changes,
-                "settings": cfg,
+    # 若啟動時已在背景預熱連線池，先等它完成（最多 5 秒），避免重複建立連線
+    if _warmup_thread is not None:
+        _warmup_thread.join(timeout=5)
+
+    # 初始化 DB，並為整個 run_all 借出一條共用連線（各步驟沿用，避免反覆 pool checkout / pre-ping）
+    engine = get_engine()
+    with get_connection(engine) as conn:
+        # 確保頻道存在（若無則建立 dim_channel 基本資料）
+        ch_payload = ensure_dim_channel_exists(conn, cid)
+        name = (ch_payload or {}).get("channel_name")
+        console.rule(f"Run All Pipeline for 頻道名稱={name}")
+
+        # 將步驟以統一規格描述，交由 runner 處理重試與逐階段執行：
+        # - 第一階段 ingest_channel_daily；
+        # - 第二階段 top_videos 與 update_playlists 互不依賴彼此輸出，以 list 表示同階段並行
+        #   （top_videos 使用自己的 engine，update_playlists 沿用共用連線，兩者不共用同一條 Connection）
+        steps_spec = [
+            {
+                "name": "ingest_channel_daily",
+                "fn": ingest_channel_daily,  # 直接呼叫目標函數
+                "args": [cid, cfg],          # 位置參數
+                "kwargs": {"conn": conn},    # 關鍵字參數（沿用共用連線）
             },
-        },
-    ]
-
-    # 統一交給 runner 執行（內含：序列執行、錯誤攔截、是否重試、通知彙整）
-    exit_code = run_pipeline_and_notify(
-        cfg=cfg,
-        console=console,
-        steps_spec=steps_spec,
-        should_retry=_should_retry,
-        sleep_for_retry=_sleep_for_retry,
-        max_retries=max_retries,
-    )
+            [
+                {
+                    "name": "top_videos",
+                    "fn": run_top_videos,
+                    "args": [],
+                    "kwargs": {
+                        "channel_id": cid,
+                        "start_date": tv_start_date,
+                        "end_date": tv_end_date,
+                        "from_offset": tv_from_offset,
+                        "to_offset": tv_to_offset,
+                        "metric": tv_metric,
+                        "top_n": tv_top_n,
+                        "include_revenue": tv_include_revenue,
+                        "settings": cfg,
+                    },
+                },
+                {
+                    "name": "update_playlists",
+                    "fn": run_update_playlists,
+                    "args": [],
+                    "kwargs": {
+                        "channel_id": cid,
+                        "dry_run": up_dry_run,
+                        "window_start": up_window_start,
+                        "window_end": up_window_end,
+                        "max_changes_per_playlist": up_max_changes,
+                        "settings": cfg,
+                        "conn": conn,
+                    },
+                },
+            ],
+        ]
+
+        # 統一交給 runner 執行（內含：逐階段執行（同階段並行）、錯誤攔截、是否重試、通知彙整）
+        exit_code = run_pipeline_and_notify(
+            cfg=cfg,
+            console=console,
+            steps_spec=steps_spec,
+            should_retry=_should_retry,
+            sleep_for_retry=_sleep_for_retry,
+            max_retries=max_retries,
+        )
 
     # 輸出結束線與狀態
     console.rule("All done" + (" (success)" if exit_code == 0 else " (failed)"))
     # 以 exit code 結束，提供給外部（shell/CI）判斷成功或失敗
     raise typer.Exit(code=exit_code)
 
-# main：當作預設子命令的包裝器
-# - 讓沒有經過 Typer 的情況下也能直接執行 run_all（例如 __main__ 分支在無參數時）
-def main():
-    # 直接當作「預設子命令」執行 run_all
-    return cmd_run_all(
-        channel_id=None,
-
-        # top_videos 相關參數
-        tv_start_date=None,
-        tv_end_date=None,
-        tv_from_offset=3,
-        tv_to_offset=2,
-        tv_metric="views",
-        tv_top_n=10,
-        tv_include_revenue=False,
-
-        # update_playlists 相關參數
-        up_dry_run=False,
-        up_window_start=None,
-        up_window_end=None,
-        up_max_changes=None,
-
-        # 重試設定（run_all 全域）
-        max_retries=3,
-        backoff_base=2.0,
-        backoff_initial=1.0,
-        backoff_max=30.0,
-        )
-
 # 入口點
 if __name__ == "__main__":
     # 清空終端畫面，讓輸出更乾淨
     clear_terminal()    
 
     # 行為說明：
-    # - 若「沒有帶任何子命令或參數」，則視為想要一鍵執行完整管線 → 呼叫 main()（即 run_all）
-    # - 否則，交由 Typer 分派對應的子命令（run_all / fetch_videos / top_videos / update_playlists / ingest_channel_daily）
+    # - 若「沒有帶任何子命令或參數」，則視為想要一鍵執行完整管線 → 先跑探針，再補上 run_all 子命令
+    # - 一律交由 Typer 分派對應的子命令（run_all / fetch_videos / top_videos / update_playlists / ingest_channel_daily / ingest_channels_daily），
+    #   run_all 的預設值只定義在 cmd_run_all 的 Option 上，不另行複製
     if len(sys.argv) <= 1:
         # 例如：python -m scripts.cli
-        try:
-            from scripts.run_probe import run_probe
-            run_probe()
-            code = main()
-            # 註：cmd_run_all 內部最後會 raise typer.Exit，通常不會回傳到這行
-        except typer.Exit as e:
-            # 將 Typer 的 Exit 統一轉成系統退出碼
-            raise SystemExit(e.exit_code)
-    else:
-        # 例如：
-        # - python -m scripts.cli run_all --tv-top 20
-        # - python -m scripts.cli fetch_videos --max-results 10
-        # - python -m scripts.cli update_playlists --dry-run
-        # - python -m scripts.cli ingest_channel_daily
-        app()
\ No newline at end of file
+        from scripts.run_probe import run_probe
+        # 探針執行期間，同步於背景預熱 DB 連線池；啟動耗時約為兩者取大而非相加
+        # 探針仍在前景執行（OAuth console 授權需要 stdin，且探針結果應先於管線輸出）
+        _warmup_thread = threading.Thread(target=_warm_up_engine, daemon=True)
+        _warmup_thread.start()
+        run_probe()
+        sys.argv.insert(1, "run_all")
+
+    # 例如：
+    # - python -m scripts.cli run_all --tv-top 20
+    # - python -m scripts.cli fetch_videos --max-results 10
+    # - python -m scripts.cli update_playlists --dry-run
+    # - python -m scripts.cli ingest_channel_daily
+    # - python -m scripts.cli ingest_channels_daily -c UCxxx -c UCyyy
+    # 註：cmd_run_all 最後 raise typer.Exit，由 Typer 轉為系統退出碼
+    app()
@@ -5,48 +5,84 @@
 # - 封裝 SQLAlchemy 常用操作（連線、查詢、交易）以簡化上層 ingestion 程式碼維護。
 from __future__ import annotations
 
+import os
+import threading
 from contextlib import contextmanager
-from typing import Any, Iterable, Mapping, Optional, Sequence, Dict, List
+from itertools import chain, islice
+from typing import Any, Iterable, Iterator, Mapping, NamedTuple, Optional, Sequence, Dict, List, Union
 
-from sqlalchemy import create_engine, text
-from sqlalchemy.engine import Engine, Result
+from sqlalchemy import bindparam, create_engine, text
+from sqlalchemy.engine import Connection, Engine, Result
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql.elements import TextClause
 
 from scripts.utils.env import load_settings
+from scripts.models.fact_yta_channel_daily import METRIC_COLS as FACT_CHANNEL_DAILY_METRIC_COLS
 
 # ------------------------
 # Engine / Session 工廠
 # ------------------------
 
 _engine_singleton: Optional[Engine] = None
+_engine_lock = threading.Lock()
+
+# 連線池預設值（可由 .env 的 DB_POOL_SIZE / DB_MAX_OVERFLOW / DB_POOL_TIMEOUT 覆寫）
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_OVERFLOW = 20
+DEFAULT_POOL_TIMEOUT = 30
 
 def get_engine() -> Engine:
     """
     以 .env/環境變數中的 DB_URL 建立並快取全域 Engine。
     - 優先回傳已建立的單例 Engine，避免重複建立連線池。
     - 若尚未建立，透過 load_settings() 取得 DB_URL，呼叫 make_engine() 建立並快取。
+    - 以雙重檢查鎖保護初始化，避免多執行緒同時建立多個 Engine（與各自的連線池）。
     """
     global _engine_singleton
-    if _engine_singleton is not None:
-        return _engine_singleton
-    cfg = load_settings()
-    db_url = cfg["DB_URL"]
-    _engine_singleton = make_engine(db_url)
+    if _engine_singleton is None:
+        with _engine_lock:
+            if _engine_singleton is None:
+                cfg = load_settings()
+                _engine_singleton = make_engine(cfg["DB_URL"], cfg)
     return _engine_singleton
 
 
-def make_engine(db_url: str) -> Engine:
+def _int_setting(cfg: Mapping[str, Any], key: str, default: int) -> int:
+    """
+    從設定字典安全取得整數值；缺省、空字串或非數字時回傳 default。
+    """
+    raw = cfg.get(key)
+    if raw is None or str(raw).strip() == "":
+        return default
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        return default
+
+
+def make_engine(db_url: str, settings: Optional[Mapping[str, Any]] = None) -> Engine:
     """
     建立 SQLAlchemy Engine。
     - pool_pre_ping: 啟用連線前 ping，避免死連線造成錯誤。
-    - pool_recycle: 連線回收秒數，降低長連線被中斷的風險。
+    - pool_recycle: 連線回收秒數（1800），低於 MySQL wait_timeout 以降低長連線被中斷的風險。
+    - pool_size / max_overflow / pool_timeout: 連線池大小，讀取 DB_POOL_SIZE / DB_MAX_OVERFLOW / DB_POOL_TIMEOUT
+      （預設 10 / 20 / 30），避免 run_all 多步驟交錯存取時等待連線。
+    - pool_use_lifo: 優先重用最近歸還的連線，讓閒置連線自然回收、熱連線保持可用。
+    - 批次寫入：PyMySQL/mysqlclient 的 executemany 會將 INSERT ... VALUES 改寫為多列 VALUES 一次送出，
+      因此上層 upsert 傳入 list[dict] 即為批次寫入；每批列數由 UPSERT_CHUNK_SIZE（或各 upsert 的 chunk_size）控制。
     - future=True: 使用 2.0 風格 API。
+    - settings: 可選的設定字典；未提供時透過 load_settings() 讀取。
     """
+    cfg = settings if settings is not None else load_settings()
     return create_engine(
         db_url,
         pool_pre_ping=True,
-        pool_recycle=3600,
+        pool_recycle=1800,
+        pool_size=_int_setting(cfg, "DB_POOL_SIZE", DEFAULT_POOL_SIZE),
+        max_overflow=_int_setting(cfg, "DB_MAX_OVERFLOW", DEFAULT_MAX_OVERFLOW),
+        pool_timeout=_int_setting(cfg, "DB_POOL_TIMEOUT", DEFAULT_POOL_TIMEOUT),
+        pool_use_lifo=True,
         future=True,
     )
 
@@ -61,14 +97,21 @@ def make_session_factory(engine: Engine):
     return sessionmaker(bind=engine, autoflush=False, autocommit=False, expire_on_commit=False)
 
 
+# 以 Engine 身分（id）快取 sessionmaker，避免每次 get_session 重新建立設定
+_session_factory_cache: Dict[int, sessionmaker] = {}
+
+
 @contextmanager
 def get_session(engine: Engine):
     """
     提供 with 區塊使用的 Session 交易管理器。
     - 進入時建立 Session；離開時成功自動 commit、例外自動 rollback；最後關閉資源。
     - 適合需要多次 ORM 操作的情境。
+    - sessionmaker 依 engine 快取重用，每次僅建立新的 Session。
     """
-    SessionFactory = make_session_factory(engine)
+    SessionFactory = _session_factory_cache.get(id(engine)) or _session_factory_cache.setdefault(
+        id(engine), make_session_factory(engine)
+    )
     session: Session = SessionFactory()
     try:
         yield session
@@ -80,39 +123,81 @@ def get_session(engine: Engine):
         session.close()
 
 
+@contextmanager
+def get_connection(engine: Optional[Engine] = None):
+    """
+    借出一條於整個 with 區塊內共用的 Connection（例如整個 run_all 執行期間）。
+    - 只做一次 pool checkout 與 pool_pre_ping，之後各 helper 直接沿用此連線。
+    - 未指定 engine 時使用 get_engine() 的單例。
+    """
+    with (engine or get_engine()).connect() as conn:
+        yield conn
+
+
+@contextmanager
+def use_connection(bind: Union[Engine, Connection]):
+    """
+    helper 共用的連線取得方式：bind 可為 Engine 或 Connection。
+    - Engine：照舊以 engine.connect() 開啟短連線，離開時關閉。
+    - Connection：直接沿用（不關閉）；離開時若 helper 留下隱式交易則 commit，
+      讓下一個 helper 能在同一連線上再次 conn.begin()；發生例外則 rollback 後拋出。
+    """
+    if isinstance(bind, Connection):
+        try:
+            yield bind
+        except Exception:
+            if bind.in_transaction():
+                bind.rollback()
+            raise
+        if bind.in_transaction():
+            bind.commit()
+    else:
+        with bind.connect() as conn:
+            yield conn
+
+
 # ------------------------
 # 通用查詢
 # ------------------------
 
-def fetch_scalar(engine: Engine, sql: str, params: Optional[Mapping[str, Any]] = None) -> Any:
+def _as_stmt(sql: Union[str, TextClause]) -> TextClause:
+    """
+    將 SQL 字串包成 TextClause；已是預先編譯的 text() 物件則原樣回傳。
+    - 固定 SQL 請於模組層級以 text() 建立常數（_SQL_*），避免每次呼叫重新解析具名參數。
+    """
+    return text(sql) if isinstance(sql, str) else sql
+
+
+def fetch_scalar(engine: Union[Engine, Connection], sql: Union[str, TextClause], params: Optional[Mapping[str, Any]] = None) -> Any:
     """
     執行查詢並回傳第一列第一欄的純量值。
     - 適合用於 COUNT、MAX、存在性檢查等。
     - params 預設為空 dict，請使用具名參數以避免 SQL 注入。
+    - engine 亦可傳入 get_connection() 借出的 Connection，省去每次 checkout。
     """
-    with engine.connect() as conn:
-        r: Result = conn.execute(text(sql), params or {})
+    with use_connection(engine) as conn:
+        r: Result = conn.execute(_as_stmt(sql), params or {})
         return r.scalar()
 
 
-def fetch_one(engine: Engine, sql: str, params: Optional[Mapping[str, Any]] = None) -> Optional[Mapping[str, Any]]:
+def fetch_one(engine: Union[Engine, Connection], sql: Union[str, TextClause], params: Optional[Mapping[str, Any]] = None) -> Optional[Mapping[str, Any]]:
     """
     執行查詢並回傳單筆映射結果（dict），找不到回傳 None。
     - 使用 mappings().first() 取得鍵值對形式。
     """
-    with engine.connect() as conn:
-        r: Result = conn.execute(text(sql), params or {})
+    with use_connection(engine) as conn:
+        r: Result = conn.execute(_as_stmt(sql), params or {})
         row = r.mappings().first()
         return dict(row) if row else None
 
 
-def fetch_all(engine: Engine, sql: str, params: Optional[Mapping[str, Any]] = None) -> Sequence[Mapping[str, Any]]:
+def fetch_all(engine: Union[Engine, Connection], sql: Union[str, TextClause], params: Optional[Mapping[str, Any]] = None) -> Sequence[Mapping[str, Any]]:
     """
     執行查詢並回傳多筆映射結果（list[dict]）。
     - 適合查詢清單；仍建議以具名參數傳值。
     """
-    with engine.connect() as conn:
-        r: Result = conn.execute(text(sql), params or {})
+    with use_connection(engine) as conn:
+        r: Result = conn.execute(_as_stmt(sql), params or {})
         return [dict(row) for row in r.mappings().all()]
 
 
@@ -120,60 +205,64 @@ def fetch_all(engine: Engine, sql: str, params: Optional[Mapping[str, Any]] = No
 # 專用查詢（dates 用）
 # ------------------------
 
+_SQL_LAST_DAY = text("SELECT MAX(day) FROM fact_yta_channel_daily WHERE channel_id = :cid")
+
 def get_last_ingested_day(engine: Engine, channel_id: str):
     """
     取得指定頻道最後一次成功寫入 fact_yta_channel_daily 的日期（MAX(day)）。
     - 用於計算下一次抓取的起始日。
     """
-    sql = "SELECT MAX(day) FROM fact_yta_channel_daily WHERE channel_id = :cid"
-    return fetch_scalar(engine, sql, {"cid": channel_id})
-
-
-def get_channel_started_day(engine: Engine, channel_id: str):
-    """
-    取得 dim_channel 中頻道建立日（started_on）。
-    - 若查詢過程拋出 SQLAlchemyError，回傳 None（容錯避免影響主流程）。
-    """
-    sql = "SELECT started_on FROM dim_channel WHERE channel_id = :cid"
-    try:
-        return fetch_scalar(engine, sql, {"cid": channel_id})
-    except SQLAlchemyError:
-        return None
+    return fetch_scalar(engine, _SQL_LAST_DAY, {"cid": channel_id})
 
 
 # ------------------------
 # dim_video 存取（供 video_ingestion 使用）
 # ------------------------
 
-def get_existing_videos(engine: Engine, video_ids: List[str]) -> Dict[str, Dict[str, Any]]:
-    """
-    查詢 dim_video 中既有的影片，回傳 dict: { video_id: { ...row } }
-    - 動態組裝 IN 子句的具名參數，避免 SQL 注入。
-    - 當 video_ids 為空時，直接回傳空 dict。
-    """
-    if not video_ids:
-        return {}
-    placeholders = ", ".join([f":v{i}" for i in range(len(video_ids))])
-    params = {f"v{i}": vid for i, vid in enumerate(video_ids)}
+# IN 子句每批 video_id 數量（避免單一語句過長或超過 max_allowed_packet）
+IN_CLAUSE_CHUNK_SIZE = 500
 
-    sql = f"""
+# 僅取比對所需欄位（shorts_check 分流 + 統計舊值），不載入標題等 meta，降低每列記憶體與傳輸量
+_SQL_EXISTING_VIDEOS = text("""
     SELECT
       video_id,
-      channel_id,
-      video_title,
-      published_at,
-      duration_sec,
-      is_short,
       shorts_check,
-      video_type,
       view_count,
       like_count,
       comment_count
     FROM dim_video
-    WHERE video_id IN ({placeholders})
+    WHERE video_id IN :vids
+    """).bindparams(bindparam("vids", expanding=True))
+
+class ExistingVideo(NamedTuple):
+    """
+    既有影片的比對狀態（tuple 結構，無每列 dict 的額外開銷；NULL 已正規化為 0）。
+    """
+    shorts_check: int
+    view_count: int
+    like_count: int
+    comment_count: int
+
+# 新影片（dim_video 無資料）的預設狀態：統計舊值視為 0
+NEW_VIDEO_STATE = ExistingVideo(0, 0, 0, 0)
+
+def get_existing_videos(engine: Engine, video_ids: List[str]) -> Dict[str, ExistingVideo]:
+    """
+    查詢 dim_video 中既有的影片，回傳 dict: { video_id: ExistingVideo(shorts_check, view_count, like_count, comment_count) }
+    - 使用 expanding bindparam 展開 IN 子句，避免手動組裝佔位字串與 SQL 注入。
+    - 以 IN_CLAUSE_CHUNK_SIZE 分批查詢，同一連線重用同一個已編譯語句。
+    - 當 video_ids 為空時，直接回傳空 dict。
     """
-    rows = fetch_all(engine, sql, params)
-    return {row["video_id"]: row for row in rows}
+    if not video_ids:
+        return {}
+
+    out: Dict[str, ExistingVideo] = {}
+    with engine.connect() as conn:
+        for i in range(0, len(video_ids), IN_CLAUSE_CHUNK_SIZE):
+            chunk = video_ids[i : i + IN_CLAUSE_CHUNK_SIZE]
+            for vid, shorts_check, views, likes, comments in conn.execute(_SQL_EXISTING_VIDEOS, {"vids": chunk}):
+                out[vid] = ExistingVideo(int(shorts_check or 0), int(views or 0), int(likes or 0), int(comments or 0))
+    return out
 
 # dim_video upsert 相關之必備欄位集合（用於輕量驗證）
 REQUIRED_FULL_FIELDS = {
@@ -199,14 +288,70 @@ REQUIRED_STATS_FIELDS = {
 
 def _validate_fields(rows_list, required_fields, label: str):
     """
-    輕量驗證：確保每一列資料包含必要欄位。
+    輕量驗證：確保資料列包含必要欄位。
+    - 上游產生的 rows 皆為同一形狀的 dict，預設僅檢查第一列（O(1)），不逐列計算差集。
+    - 設定環境變數 VALIDATE_ALL=1 時改為逐列檢查，便於除錯來源資料。
     - 僅檢查欄位存在，不檢查值的型別或非空；實際 schema 應由 DB 約束保護。
     - 失敗時拋出 ValueError 並指名缺少欄位與索引。
     """
-    for i, r in enumerate(rows_list):
-        missing = required_fields - set(r.keys())
-        if missing:
-            raise ValueError(f"{label} rows[{i}] 缺少必備欄位: {sorted(missing)}")
+    if not rows_list:
+        return
+    if __debug__ and os.environ.get("VALIDATE_ALL"):
+        for i, r in enumerate(rows_list):
+            missing = required_fields - r.keys()
+            if missing:
+                raise ValueError(f"{label} rows[{i}] 缺少必備欄位: {sorted(missing)}")
+        return
+    missing = required_fields - rows_list[0].keys()
+    if missing:
+        raise ValueError(f"{label} rows[0] 缺少必備欄位: {sorted(missing)}")
+
+# upsert 每批送出的列數：串流分批寫入，避免一次將全部 rows 實體化於記憶體，也較不易超過 max_allowed_packet
+UPSERT_CHUNK_SIZE = 5000
+
+def _iter_chunks(rows: Iterable[Mapping[str, Any]], size: int = UPSERT_CHUNK_SIZE) -> Iterator[List[Mapping[str, Any]]]:
+    """
+    以 itertools.islice 將 rows（可為 generator）切成每批最多 size 筆的 list 依序產出。
+    - 記憶體用量為 O(size)，而非 O(N)。
+    """
+    it = iter(rows)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+def _normalize_short_type(rows_list: List[Mapping[str, Any]]) -> List[Mapping[str, Any]]:
+    """
+    正規化影片型別：is_short = 1 的列一律寫入 video_type = 'shorts'。
+    - 讓 query_top_shorts 只需比對 video_type，可直接使用 idx_dim_video_type_views 索引。
+    """
+    return [
+        {**r, "video_type": "shorts"} if r.get("is_short") == 1 and r.get("video_type") != "shorts" else r
+        for r in rows_list
+    ]
+
+_SQL_UPSERT_DIM_VIDEO_FULL = text("""
+INSERT INTO dim_video (
+    video_id, channel_id, video_title, published_at, duration_sec,
+    is_short, shorts_check, video_type, view_count, like_count, comment_count
+) VALUES (
+    :video_id, :channel_id, :video_title, :published_at, :duration_sec,
+    :is_short, :shorts_check, :video_type, :view_count, :like_count, :comment_count
+)
+ON DUPLICATE KEY UPDATE
+    channel_id    = VALUES(channel_id),
+    video_title   = VALUES(video_title),
+    published_at  = VALUES(published_at),
+    duration_sec  = VALUES(duration_sec),
+    is_short      = VALUES(is_short),
+    shorts_check  = VALUES(shorts_check),
+    video_type    = VALUES(video_type),
+    view_count    = VALUES(view_count),
+    like_count    = VALUES(like_count),
+    comment_count = VALUES(comment_count),
+    updated_at    = CURRENT_TIMESTAMP
+""")
 
 def upsert_dim_video_full(engine: Engine, rows: Iterable[Mapping[str, Any]]) -> int:
     """
@@ -220,43 +365,42 @@ def upsert_dim_video_full(engine: Engine, rows: Iterable[Mapping[str, Any]]) ->
 
     交易：
       使用 conn.begin() 明確包一個交易區塊，成功自動 commit、失敗自動 rollback。
+
+    批次：
+      VALUES 子句僅含 :name 具名參數（updated_at 由欄位預設值填入、更新時於 UPDATE 子句設定），
+      讓 PyMySQL 的 executemany 能改寫為多列 VALUES 一次送出，而非逐列執行。
+      rows 以 UPSERT_CHUNK_SIZE 串流分批送出（同一交易），不先整批實體化；回傳各批 rowcount 加總。
     """
-    rows_list = list(rows)
-    if not rows_list:
+    chunks = _iter_chunks(rows)
+    first = next(chunks, None)
+    if first is None:
         return 0
 
-    _validate_fields(rows_list, REQUIRED_FULL_FIELDS, "upsert_dim_video_full")
-
-    sql = text("""
-    INSERT INTO dim_video (
-        video_id, channel_id, video_title, published_at, duration_sec,
-        is_short, shorts_check, video_type, view_count, like_count, comment_count, updated_at
-    ) VALUES (
-        :video_id, :channel_id, :video_title, :published_at, :duration_sec,
-        :is_short, :shorts_check, :video_type, :view_count, :like_count, :comment_count, CURRENT_TIMESTAMP
-    )
-    ON DUPLICATE KEY UPDATE
-        channel_id    = VALUES(channel_id),
-        video_title   = VALUES(video_title),
-        published_at  = VALUES(published_at),
-        duration_sec  = VALUES(duration_sec),
-        is_short      = VALUES(is_short),
-        shorts_check  = VALUES(shorts_check),
-        video_type    = VALUES(video_type),
-        view_count    = VALUES(view_count),
-        like_count    = VALUES(like_count),
-        comment_count = VALUES(comment_count),
-        updated_at    = CURRENT_TIMESTAMP
-    """)
-
+    total = 0
     try:
         with engine.begin() as conn:# 自動 commit/rollback
-            result = conn.execute(sql, rows_list)  # rows_list: list[dict]
-            return result.rowcount
+            for chunk in chain([first], chunks):
+                _validate_fields(chunk, REQUIRED_FULL_FIELDS, "upsert_dim_video_full")
+                result = conn.execute(_SQL_UPSERT_DIM_VIDEO_FULL, _normalize_short_type(chunk))  # chunk: list[dict]
+                total += result.rowcount
+        return total
     except SQLAlchemyError as e:
         # 保留完整錯誤資訊與堆疊，方便上層記錄與告警
         raise RuntimeError(f"upsert_dim_video_full 失敗: {e}") from e
 
+_SQL_UPDATE_DIM_VIDEO_FULL = text("""
+UPDATE dim_video
+SET
+    is_short      = :is_short,
+    shorts_check  = :shorts_check,
+    video_type    = :video_type,
+    view_count = :view_count,
+    like_count = :like_count,
+    comment_count = :comment_count,
+    updated_at = CURRENT_TIMESTAMP
+WHERE video_id = :video_id
+""")
+
 def upsert_dim_video_full_update(engine: Engine, rows: Iterable[Mapping[str, Any]]) -> int:
     """
     對 dim_video 進行完整 upsert（INSERT ... ON DUPLICATE KEY UPDATE）。
@@ -275,28 +419,26 @@ def upsert_dim_video_full_update(engine: Engine, rows: Iterable[Mapping[str, Any
         return 0
 
     _validate_fields(rows_list, REQUIRED_STATS_FIELDS, "upsert_dim_video_stats_only")
-
-    sql = """
-    UPDATE dim_video
-    SET
-        is_short      = :is_short,
-        shorts_check  = :shorts_check,
-        video_type    = :video_type,
-        view_count = :view_count,
-        like_count = :like_count,
-        comment_count = :comment_count,
-        updated_at = CURRENT_TIMESTAMP
-    WHERE video_id = :video_id
-    """
+    rows_list = _normalize_short_type(rows_list)
 
     try:
         with engine.connect() as conn:
             with conn.begin():
-                result = conn.execute(text(sql), rows_list)
+                result = conn.execute(_SQL_UPDATE_DIM_VIDEO_FULL, rows_list)
                 return result.rowcount
     except SQLAlchemyError as e:
         raise RuntimeError(f"upsert_dim_video_stats_only 失敗: {e}") from e
 
+_SQL_UPDATE_DIM_VIDEO_STATS = text("""
+UPDATE dim_video
+SET
+  view_count = :view_count,
+  like_count = :like_count,
+  comment_count = :comment_count,
+  updated_at = CURRENT_TIMESTAMP
+WHERE video_id = :video_id
+""")
+
 def upsert_dim_video_stats_only(engine: Engine, rows: Iterable[Mapping[str, Any]]) -> int:
     """
     僅更新 dim_video 的 view_count / like_count / comment_count 三欄。
@@ -312,78 +454,120 @@ def upsert_dim_video_stats_only(engine: Engine, rows: Iterable[Mapping[str, Any]
 
     _validate_fields(rows_list, REQUIRED_STATS_FIELDS, "upsert_dim_video_stats_only")
 
-    sql = """
-    UPDATE dim_video
-    SET
-      view_count = :view_count,
-      like_count = :like_count,
-      comment_count = :comment_count,
-      updated_at = CURRENT_TIMESTAMP
-    WHERE video_id = :video_id
-    """
-
     try:
         with engine.connect() as conn:
             with conn.begin():
-                result = conn.execute(text(sql), rows_list)
+                result = conn.execute(_SQL_UPDATE_DIM_VIDEO_STATS, rows_list)
                 return result.rowcount
     except SQLAlchemyError as e:
         raise RuntimeError(f"upsert_dim_video_stats_only 失敗: {e}") from e
+
+# 僅統計列未提供的 meta 欄位（以 NULL 代表「保留既有值」）
+DIM_VIDEO_META_FIELDS = REQUIRED_FULL_FIELDS - REQUIRED_STATS_FIELDS
+
+_SQL_UPSERT_DIM_VIDEO_SMART = text("""
+INSERT INTO dim_video (
+    video_id, channel_id, video_title, published_at, duration_sec,
+    is_short, shorts_check, video_type, view_count, like_count, comment_count
+) VALUES (
+    :video_id, :channel_id, :video_title, :published_at, :duration_sec,
+    :is_short, :shorts_check, :video_type, :view_count, :like_count, :comment_count
+)
+ON DUPLICATE KEY UPDATE
+    channel_id    = COALESCE(VALUES(channel_id), channel_id),
+    video_title   = COALESCE(VALUES(video_title), video_title),
+    published_at  = COALESCE(VALUES(published_at), published_at),
+    duration_sec  = COALESCE(VALUES(duration_sec), duration_sec),
+    is_short      = COALESCE(VALUES(is_short), is_short),
+    shorts_check  = COALESCE(VALUES(shorts_check), shorts_check),
+    video_type    = COALESCE(VALUES(video_type), video_type),
+    view_count    = VALUES(view_count),
+    like_count    = VALUES(like_count),
+    comment_count = VALUES(comment_count),
+    updated_at    = CURRENT_TIMESTAMP
+""")
+
+def upsert_dim_video_smart(engine: Engine, rows: Iterable[Mapping[str, Any]]) -> int:
+    """
+    以單一 INSERT ... ON DUPLICATE KEY UPDATE 寫入混合列（完整列 + 僅統計列）。
+    - 完整列：欄位同 upsert_dim_video_full，新影片插入、既有影片覆寫 meta 與統計。
+    - 僅統計列：只需 REQUIRED_STATS_FIELDS；缺少的 meta 欄位補 NULL，
+      UPDATE 子句以 COALESCE(VALUES(col), col) 保留既有值，只更新統計欄位。
+    - 注意：僅統計列必須已存在於 dim_video（由 get_existing_videos 判定），否則會插入不完整的列。
+    - 取代「先分流再分別呼叫 full / stats_only」的兩次往返，於同一交易一次完成。
+    - VALUES 子句僅含具名參數，executemany 可改寫為多列 VALUES（同 upsert_dim_video_full）。
+
+    - rows 以 UPSERT_CHUNK_SIZE 串流分批送出（同一交易），不先整批實體化。
+
+    回傳：
+      各批 result.rowcount 加總（ON DUPLICATE KEY UPDATE 下與實際 upsert 筆數可能不同）
+    """
+    chunks = _iter_chunks(rows)
+    first = next(chunks, None)
+    if first is None:
+        return 0
+
+    total = 0
+    try:
+        with engine.begin() as conn:
+            for chunk in chain([first], chunks):
+                _validate_fields(chunk, REQUIRED_STATS_FIELDS, "upsert_dim_video_smart")
+                chunk = _normalize_short_type(
+                    [{**{k: None for k in DIM_VIDEO_META_FIELDS}, **r} for r in chunk]
+                )
+                result = conn.execute(_SQL_UPSERT_DIM_VIDEO_SMART, chunk)
+                total += result.rowcount
+        return total
+    except SQLAlchemyError as e:
+        raise RuntimeError(f"upsert_dim_video_smart 失敗: {e}") from e
     
 # ------------------------
 # 既有：fact_yta_channel_daily
 # ------------------------
 
-def upsert_fact_channel_daily(engine: Engine, rows: Iterable[Mapping[str, Any]]):
+# 欄位清單由 FactYtaChannelDaily 的 METRIC_COLS 推導，與 YA 查詢、ETL 列組裝共用同一來源
+# updated_at 交由欄位的 ON UPDATE CURRENT_TIMESTAMP 維護：值完全相同的重跑不會改寫資料列
+_SQL_UPSERT_FACT_CHANNEL_DAILY = text(
+    "INSERT INTO fact_yta_channel_daily (channel_id, day, "
+    + ", ".join(FACT_CHANNEL_DAILY_METRIC_COLS)
+    + ") VALUES (:channel_id, :day, "
+    + ", ".join(f":{c}" for c in FACT_CHANNEL_DAILY_METRIC_COLS)
+    + ") ON DUPLICATE KEY UPDATE "
+    + ", ".join(f"{c}=VALUES({c})" for c in FACT_CHANNEL_DAILY_METRIC_COLS)
+)
+
+
+def upsert_fact_channel_daily(
+    engine: Union[Engine, Connection],
+    rows: Iterable[Mapping[str, Any]],
+    chunk_size: int = UPSERT_CHUNK_SIZE,
+):
     """
     寫入/更新 fact_yta_channel_daily（日次頻道指標）：
     - 以 INSERT ... ON DUPLICATE KEY UPDATE 實現 upsert，主鍵通常為 (channel_id, day)。
-    - rows 可為多筆，會在單一交易中執行。
+    - rows 可為多筆（可為 generator），以 chunk_size 串流分批，每批一次 executemany
+      （VALUES 僅含具名參數，PyMySQL 會改寫為單一多列 VALUES 語句）。
+    - 每批各自一個交易並提交：upsert 具冪等性，長時間回補中途失敗時已提交的批次可保留，重跑即可補齊。
+    - subscribers_net 為資料庫生成欄位（見 migrations/002），不在 INSERT 欄位中。
     
     回傳：
-    - result.rowcount（受影響列數；ON DUPLICATE 情境下與實際筆數可能不同）
-    """
-    sql = """
-    INSERT INTO fact_yta_channel_daily (
-      channel_id, day, views, estimatedMinutesWatched, averageViewDuration, averageViewPercentage,
-      likes, dislikes, comments, shares, playlistStarts, viewsPerPlaylistStart, cardClicks, cardTeaserClicks,
-      subscribersGained, subscribersLost, subscribers_net
-    ) VALUES (
-      :channel_id, :day, :views, :estimatedMinutesWatched, :averageViewDuration, :averageViewPercentage,
-      :likes, :dislikes, :comments, :shares, :playlistStarts, :viewsPerPlaylistStart, :cardClicks, :cardTeaserClicks,
-      :subscribersGained, :subscribersLost, :subscribers_net
-    )
-    ON DUPLICATE KEY UPDATE
-      views=VALUES(views),
-      estimatedMinutesWatched=VALUES(estimatedMinutesWatched),
-      averageViewDuration=VALUES(averageViewDuration),
-      averageViewPercentage=VALUES(averageViewPercentage),
-      likes=VALUES(likes),
-      dislikes=VALUES(dislikes),
-      comments=VALUES(comments),
-      shares=VALUES(shares),
-      playlistStarts=VALUES(playlistStarts),
-      viewsPerPlaylistStart=VALUES(viewsPerPlaylistStart),
-      cardClicks=VALUES(cardClicks),
-      cardTeaserClicks=VALUES(cardTeaserClicks),
-      subscribersGained=VALUES(subscribersGained),
-      subscribersLost=VALUES(subscribersLost),
-      subscribers_net=VALUES(subscribers_net),
-      updated_at=CURRENT_TIMESTAMP
+    - 各批 result.rowcount 加總（受影響列數；ON DUPLICATE 情境下與實際筆數可能不同）
     """
-    rows_list = list(rows)
-    if not rows_list:
+    chunks = _iter_chunks(rows, chunk_size)
+    first = next(chunks, None)
+    if first is None:
         return 0
 
-    with engine.connect() as conn:
-        trans = conn.begin()
-        try:
-            result = conn.execute(text(sql), rows_list)
-            trans.commit()
-            return result.rowcount
-        except SQLAlchemyError:
-            trans.rollback()
-            raise
+    total = 0
+    try:
+        with use_connection(engine) as conn:
+            for chunk in chain([first], chunks):
+                with conn.begin():  # 每批自動 commit/rollback
+                    result = conn.execute(_SQL_UPSERT_FACT_CHANNEL_DAILY, chunk)
+                total += result.rowcount
+        return total
+    except SQLAlchemyError as e:
+        raise RuntimeError(f"upsert_fact_channel_daily 失敗: {e}") from e
 
 def get_raw_cursor(conn):
     """
@@ -395,119 +579,137 @@ def get_raw_cursor(conn):
 
 # ============playlist_update use=======================
 
-def query_top_shorts(channel_id: str, limit: int = 20, engine: Optional[Engine] = None) -> List[str]:
+_SQL_TOP_SHORTS = text("""
+SELECT video_id
+FROM dim_video
+WHERE channel_id = :channel_id
+  AND video_type = 'shorts'
+ORDER BY view_count DESC, published_at DESC
+LIMIT :limit
+""")
+
+def query_top_shorts(channel_id: str, limit: int = 20, engine: Optional[Union[Engine, Connection]] = None) -> List[str]:
     """
     回傳指定頻道的 shorts 影片，依 view_count DESC、published_at DESC 排序的前 N 名 video_id。
-    - 過濾條件：video_type = 'shorts' 或 is_short = 1（依 schema 適用其一或並存）。
+    - 過濾條件：video_type = 'shorts'（寫入時已將 is_short = 1 正規化為 shorts，見 _normalize_short_type）。
+    - 使用 idx_dim_video_type_views 索引（scripts/db/migrations/001_dim_video_type_views_idx.sql）。
     - 預設 N=20；可透過參數調整。
     """
     engine = engine or get_engine()
-    sql = """
-    SELECT video_id
-    FROM dim_video
-    WHERE channel_id = :channel_id
-      AND (video_type = 'shorts' OR is_short = 1)
-    ORDER BY view_count DESC, published_at DESC
-    LIMIT :limit
-    """
-    rows = fetch_all(engine, sql, {"channel_id": channel_id, "limit": limit})
+    rows = fetch_all(engine, _SQL_TOP_SHORTS, {"channel_id": channel_id, "limit": limit})
     return [r["video_id"] for r in rows]
 
-def query_top_vods(channel_id: str, limit: int = 10, engine: Optional[Engine] = None) -> List[str]:
+_SQL_TOP_VODS = text("""
+SELECT video_id
+FROM dim_video
+WHERE channel_id = :channel_id
+  AND video_type = 'vod'
+ORDER BY view_count DESC, published_at DESC
+LIMIT :limit
+""")
+
+def query_top_vods(channel_id: str, limit: int = 10, engine: Optional[Union[Engine, Connection]] = None) -> List[str]:
     """
     回傳指定頻道的 VOD（長影片），依 view_count DESC、published_at DESC 排序的前 N 名 video_id。
     - 過濾條件：video_type = 'vod'
+    - 使用 idx_dim_video_type_views 索引（scripts/db/migrations/001_dim_video_type_views_idx.sql）。
     - 預設 N=10；可透過參數調整。
     """
     engine = engine or get_engine()
-    sql = """
-    SELECT video_id
-    FROM dim_video
-    WHERE channel_id = :channel_id
-      AND (video_type = 'vod')
-    ORDER BY view_count DESC, published_at DESC
-    LIMIT :limit
-    """
-    rows = fetch_all(engine, sql, {"channel_id": channel_id, "limit": limit})
+    rows = fetch_all(engine, _SQL_TOP_VODS, {"channel_id": channel_id, "limit": limit})
     return [r["video_id"] for r in rows]
 
-def query_new_vods(channel_id: str, limit: int = 10, engine: Optional[Engine] = None) -> List[str]:
+_SQL_NEW_VODS = text("""
+SELECT video_id
+FROM dim_video
+WHERE channel_id = :channel_id
+  AND (video_type = 'vod')
+ORDER BY published_at DESC
+LIMIT :limit
+""")
+
+def query_new_vods(channel_id: str, limit: int = 10, engine: Optional[Union[Engine, Connection]] = None) -> List[str]:
     """
     回傳指定頻道的 VOD（長影片），依 view_count DESC、published_at DESC 排序的前 N 名 video_id。
     - 過濾條件：video_type = 'vod'
     - 預設 N=10；可透過參數調整。
     """
     engine = engine or get_engine()
-    sql = """
-    SELECT video_id
-    FROM dim_video
-    WHERE channel_id = :channel_id
-      AND (video_type = 'vod')
-    ORDER BY published_at DESC
-    LIMIT :limit
-    """
-    rows = fetch_all(engine, sql, {"channel_id": channel_id, "limit": limit})
+    rows = fetch_all(engine, _SQL_NEW_VODS, {"channel_id": channel_id, "limit": limit})
     return [r["video_id"] for r in rows]
 
-def query_poe327(channel_id: str, engine: Optional[Engine] = None) -> List[str]:
+_SQL_POE327 = text("""
+SELECT video_id
+FROM dim_video
+WHERE channel_id = :channel_id
+  AND video_title LIKE '%《流亡黯道：黯焰看守者》%'
+""")
+
+def query_poe327(channel_id: str, engine: Optional[Union[Engine, Connection]] = None) -> List[str]:
     """
     回傳指定頻道的 VOD（長影片），依 view_count DESC、published_at DESC 排序的前 N 名 video_id。
     - 過濾條件：video_type = 'vod'
     - 預設 N=10；可透過參數調整。
     """
     engine = engine or get_engine()
-    sql = """
-    SELECT video_id
-    FROM dim_video
-    WHERE channel_id = :channel_id
-      AND video_title LIKE '%《流亡黯道：黯焰看守者》%'
-    """
-    rows = fetch_all(engine, sql, {"channel_id": channel_id})
+    rows = fetch_all(engine, _SQL_POE327, {"channel_id": channel_id})
     return [r["video_id"] for r in rows]
 
-def query_hot_videos(channel_id: str, limit: int = 10, engine: Optional[Engine] = None) -> List[str]:
+_SQL_HOT_VIDEOS = text("""
+SELECT video_id
+FROM fact_video_velocity
+WHERE created_at >= NOW() - INTERVAL 3 DAY
+GROUP BY 
+    video_id
+ORDER BY 
+    SUM(delta_views) DESC
+LIMIT :limit
+""")
+
+def query_hot_videos(channel_id: str, limit: int = 10, engine: Optional[Union[Engine, Connection]] = None) -> List[str]:
     """
     回傳指定頻道的 VOD（長影片），依 view_count DESC、published_at DESC 排序的前 N 名 video_id。
     - 過濾條件：video_type = 'vod'
     - 預設 N=10；可透過參數調整。
     """
     engine = engine or get_engine()
-    sql = """
-    SELECT video_id
-    FROM fact_video_velocity
-    WHERE created_at >= NOW() - INTERVAL 3 DAY
-    GROUP BY 
-        video_id
-    ORDER BY 
-        SUM(delta_views) DESC
-    LIMIT :limit
-    """
-    rows = fetch_all(engine, sql, {"channel_id": channel_id, "limit": limit})
+    rows = fetch_all(engine, _SQL_HOT_VIDEOS, {"channel_id": channel_id, "limit": limit})
     return [r["video_id"] for r in rows]
 
+# 原生 cursor executemany 用（pyformat 佔位符）：VALUES 僅含佔位符，PyMySQL 會改寫為單一多列 INSERT
+_SQL_INSERT_VIDEO_VELOCITY = """
+INSERT INTO fact_video_velocity (
+    video_id, captured_at, delta_views, delta_likes, delta_comments
+) VALUES (
+    %(video_id)s, %(captured_at)s, %(delta_views)s, %(delta_likes)s, %(delta_comments)s
+)
+"""
+
 def insert_fact_video_velocity(engine: Engine, rows: Iterable[Mapping[str, Any]]) -> int:
     """
     批次寫入 fact_video_velocity (高頻數據追蹤)。
     欄位：video_id, captured_at, delta_views, delta_likes, delta_comments
+    批次：同一交易內重用原生 cursor，每 UPSERT_CHUNK_SIZE 筆 executemany 一次（一批一個多列 INSERT 往返）。
     """
-    rows_list = list(rows)
-    if not rows_list:
+    chunks = _iter_chunks(rows)
+    first = next(chunks, None)
+    if first is None:
         return 0
 
     # 這裡不做過多欄位檢查，假設上層邏輯已處理好 int 轉型與預設值
-    sql = """
-    INSERT INTO fact_video_velocity (
-        video_id, captured_at, delta_views, delta_likes, delta_comments
-    ) VALUES (
-        :video_id, :captured_at, :delta_views, :delta_likes, :delta_comments
-    )
-    """
 
+    total = 0
     try:
         with engine.begin() as conn:
-            result = conn.execute(text(sql), rows_list)
-            return result.rowcount
-    except SQLAlchemyError as e:
+            cur = get_raw_cursor(conn)
+            try:
+                for chunk in chain([first], chunks):
+                    cur.executemany(_SQL_INSERT_VIDEO_VELOCITY, chunk)
+                    total += cur.rowcount
+            finally:
+                cur.close()
+            return total
+    except (SQLAlchemyError, engine.dialect.dbapi.Error) as e:
         # 這裡選擇只印出錯誤但不中斷程式，因為 Velocity 數據丟失一筆通常不影響主流程
         # 若您希望嚴格控管，可改為 raise
         print(f"[warning] insert_fact_video_velocity 寫入失敗: {e}")
@@ -515,7 +717,9 @@ def insert_fact_video_velocity(engine: Engine, rows: Iterable[Mapping[str, Any]]
     
 # 本程式作用摘要：
 # - get_engine / make_engine / get_session：建立並管理資料庫連線與交易生命週期。
+# - get_connection / use_connection：整段流程共用單一連線；各 helper 可傳 Engine 或 Connection。
 # - fetch_scalar / fetch_one / fetch_all：通用查詢輔助，簡化 SQL 執行與結果轉換。
-# - get_last_ingested_day / get_channel_started_day：提供日期視窗計算所需的專用查詢。
+# - get_last_ingested_day：提供日期視窗計算所需的專用查詢。
 # - get_existing_videos / upsert_dim_video_full / upsert_dim_video_stats_only：影片維度查詢與 upsert。
+# - upsert_dim_video_smart：混合列（完整 + 僅統計）單次 upsert，meta 欄位以 COALESCE 保留既有值。
 # - upsert_fact_channel_daily：日次頻道指標 upsert；query_top_shorts / query_top_vods：熱門影片清單。
\ No newline at end of file
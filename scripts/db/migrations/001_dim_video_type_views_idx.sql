@@ -0,0 +1,14 @@
+-- scripts/db/migrations/001_dim_video_type_views_idx.sql
+-- 總覽：
+-- - 為 query_top_shorts / query_top_vods 建立 (channel_id, video_type, view_count DESC, published_at DESC) 複合索引，
+--   讓「指定頻道 + 型別 + 依觀看數排序 LIMIT N」走索引範圍掃描，不需 filesort。
+-- - 先將 is_short = 1 的舊資料正規化為 video_type = 'shorts'，查詢端即可移除 OR is_short = 1 分支。
+-- - 需 MySQL 8.0+（支援降冪索引）；執行一次即可。
+
+UPDATE dim_video
+SET video_type = 'shorts'
+WHERE is_short = 1
+  AND (video_type IS NULL OR video_type <> 'shorts');
+
+CREATE INDEX idx_dim_video_type_views
+    ON dim_video (channel_id, video_type, view_count DESC, published_at DESC);
@@ -0,0 +1,10 @@
+-- scripts/db/migrations/002_fact_channel_daily_subscribers_net_generated.sql
+-- 總覽：
+-- - 將 fact_yta_channel_daily.subscribers_net 改為 STORED 生成欄位（subscribersGained - subscribersLost），
+--   由資料庫保證一致，ETL 的 upsert 不再傳送此欄位（對應 FactYtaChannelDaily 的 Computed 定義）。
+-- - 既有資料會在 ALTER 時依公式重新計算；任一來源欄位為 NULL 時結果為 NULL。
+-- - 需 MySQL 5.7+；須在部署新版 upsert 前後立即執行（舊版 upsert 寫入生成欄位會報錯）。
+
+ALTER TABLE fact_yta_channel_daily
+    MODIFY COLUMN subscribers_net BIGINT
+        GENERATED ALWAYS AS (subscribersGained - subscribersLost) STORED;
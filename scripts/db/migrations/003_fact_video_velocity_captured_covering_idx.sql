@@ -0,0 +1,11 @@
+-- scripts/db/migrations/003_fact_video_velocity_captured_covering_idx.sql
+-- 總覽：
+-- - 為 ranking_dashboard.get_ranking_data 建立 (captured_at, video_id, delta_views, delta_likes, delta_comments) 覆蓋索引，
+--   「captured_at 區間 + 依 video_id 彙總 delta_*」只讀索引即可完成，不需回表取列。
+-- - 同一索引以 captured_at 為首欄，也供 15min 榜「最新兩個 captured_at」查詢反向走索引、讀到兩個相異值即停止。
+-- - 亦供 velocity_service.generate_leaderboard_report 各時段「captured_at 區間彙總 + LIMIT 5」子查詢只掃該時段的索引範圍。
+-- - 驗證：EXPLAIN 該查詢的 fact_video_velocity 列應出現 key = idx_fvv_captured_video 與 Extra = Using index。
+-- - 執行一次即可。
+
+CREATE INDEX idx_fvv_captured_video
+    ON fact_video_velocity (captured_at, video_id, delta_views, delta_likes, delta_comments);
@@ -0,0 +1,10 @@
+-- scripts/db/migrations/004_meta_kv.sql
+-- 總覽：
+-- - 建立 meta_kv 鍵值表，存放少量程式狀態（例：velocity_service 的 Discord 訊息 ID，鍵名 discord_msg_id），
+--   取代本地 discord_state.json：寫入為單一 upsert，程序中途結束也不會留下寫一半的狀態。
+-- - 執行一次即可；既有 discord_state.json 的 message_id 會於 velocity_service 首次執行時自動寫入 meta_kv 沿用。
+
+CREATE TABLE IF NOT EXISTS meta_kv (
+    k     VARCHAR(64) NOT NULL PRIMARY KEY,
+    value TEXT NULL
+);
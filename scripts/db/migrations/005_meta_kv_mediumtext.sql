@@ -0,0 +1,7 @@
+-- scripts/db/migrations/005_meta_kv_mediumtext.sql
+-- 總覽：
+-- - meta_kv.value 改為 MEDIUMTEXT：velocity_service 會把頻道影片 ID 清單快照（JSON，鍵名 video_ids:<channel_id>）
+--   存於此表，供下一次排程執行沿用；上萬支影片的清單會超過 TEXT 的 64KB 上限。
+-- - 需先執行 004_meta_kv.sql；重複執行無副作用。
+
+ALTER TABLE meta_kv MODIFY value MEDIUMTEXT NULL;
@@ -4,11 +4,35 @@
 # - 流程：確保 dim_channel 存在 → 計算抓取視窗 → 呼叫 YA API 取數 → 整理並 upsert 至 fact_yta_channel_daily。
 # - 提供 CLI/設定檔雙來源的頻道 ID 解析，並以 env 參數建立 DB/YA client 等相依資源。
 
-from typing import Dict, Any, List
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import Dict, Any, List, Optional, Tuple
+from sqlalchemy.engine import Connection
 from scripts.db.db import make_engine, upsert_fact_channel_daily
 from scripts.utils.dates import compute_window
-from scripts.ingestion.dim_channel import ensure_dim_channel
-from scripts.ingestion.ya_api import build_ya_client, query_channel_daily
+from scripts.ingestion.ya_api import build_ya_client, iter_channel_daily, query_channel_daily, query_channels_daily
+from scripts.models.fact_yta_channel_daily import METRIC_COLS
+
+# 狀態輸出走 logging（%s 延遲格式化；等級由 LOG_LEVEL 控制，見 scripts/utils/log.py）
+logger = logging.getLogger(__name__)
+
+# 寫入 fact_yta_channel_daily 時每批（每次 executemany / commit）的列數；多頻道、多年回補時可減少往返與交易數
+FACT_CHANNEL_DAILY_CHUNK_SIZE = 10_000
+
+# 多頻道匯入時並行查詢 YA 的執行緒上限（I/O 為主；上限用於保護 API 配額與速率）
+YA_MAX_WORKERS = 8
+
+def _to_fact_row(channel_id: str, r: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    將單筆 YA 日資料轉為 fact_yta_channel_daily 的 upsert 列。
+    - 依 METRIC_COLS 原樣帶入指標值，不再逐欄 int()/float() 強轉；缺值為 None，
+      不會與真正的 0 混淆（事實表指標欄位皆可為 NULL）。
+    - subscribers_net（淨訂閱數）由資料庫生成欄位計算，這裡不再產生。
+    """
+    # YA 回傳欄位與事實表欄位同名；YA 的 INTEGER/FLOAT 指標已是 int/float，原樣帶入，缺值保留 None（寫入 NULL）
+    get = r.get
+    return {"channel_id": channel_id, "day": r["day"], **{c: get(c) for c in METRIC_COLS}}
 
 def _resolve_channel_id(cli_channel_id: str | None, settings: dict) -> str:
     """
@@ -23,7 +47,7 @@ def _resolve_channel_id(cli_channel_id: str | None, settings: dict) -> str:
     """
     return cli_channel_id or settings["CHANNEL_ID"]
 
-def ingest_channel_daily(channel_id: str, env: Dict[str, str]) -> None:
+def ingest_channel_daily(channel_id: str, env: Dict[str, str], conn: Optional[Connection] = None) -> None:
     """
     執行 channel × day 指標抓取並寫入 fact_yta_channel_daily。
     範圍：上次抓取日+1 或 頻道建立日 或 env.START_DATE 三者最大，到 today-0
@@ -34,71 +58,125 @@ def ingest_channel_daily(channel_id: str, env: Dict[str, str]) -> None:
         - DB_URL: 資料庫連線字串
         - START_DATE: 預設開始日期（YYYY-MM-DD），作為視窗回退選項之一
         - 其他給 YA client 用的鍵值（例：YAAO_* 或 GOOGLE_*）
+    - conn: 可選的共用 Connection（run_all 借出）；提供時沿用此連線，不另建 Engine
 
     流程：
     1) 確保 dim_channel 存在（可再擴充補齊標題、建立日等欄位）。
     2) 計算抓取視窗（由上次成功抓取點、頻道建立日、指定起始日三者決定）。
-    3) 建立 YA client 並抓取日級資料。
-    4) 轉換欄位型別、計算衍生值（如 subscribers_net）。
-    5) upsert 到 fact_yta_channel_daily。
+    3) 建立 YA client 並以分頁串流抓取日級資料。
+    4) 組成事實表列（指標原樣帶入；subscribers_net 由資料庫生成欄位計算）。
+    5) 分批 upsert 到 fact_yta_channel_daily（與 3、4 交錯進行）。
     """
-    # 建立資料庫 Engine（依據 env["DB_URL"]）
-    engine = make_engine(env["DB_URL"])
+    # 建立資料庫 Engine（依據 env["DB_URL"]）；若上層已借出共用連線則直接沿用
+    engine = conn if conn is not None else make_engine(env["DB_URL"], env)
 
-    # 1) 確保 dim_channel 存在（必要維度資料先就位；未來可延伸更新 title、started_on 等）
-    ensure_dim_channel(engine, channel_id)
-
-    # 2) 計算抓取窗口（start_date, end_date）
-    # compute_window 會依據資料庫既有資料與 START_DATE 等規則返回實際要抓的區間
-    start_date, end_date = compute_window(engine, channel_id, env["START_DATE"])
+    # 1) + 2) 確保 dim_channel 存在並計算抓取窗口（start_date, end_date）
+    # compute_window 會依據資料庫既有資料與 START_DATE 等規則返回實際要抓的區間；
+    # ensure_channel=True 時同一次查詢順帶檢查 dim_channel，僅在頻道不存在時才補插入
+    start_date, end_date = compute_window(engine, channel_id, env["START_DATE"], ensure_channel=True)
     if not start_date or not end_date:
         # 若計算無新日期，則直接結束（例如資料已最新）
-        print("[ingest_channel_daily] 沒有新的日期需要匯入。完成。")
+        logger.info("[ingest_channel_daily] 沒有新的日期需要匯入。完成。")
         return
 
-    print(f"[ingest_channel_daily] 正在擷取日期範圍: {start_date} ~ {end_date}")
+    logger.info("[ingest_channel_daily] 正在擷取日期範圍: %s ~ %s", start_date, end_date)
 
-    # 3) 建立 YT Analytics client 並查詢日級資料（維度 day）
+    # 3) 建立 YT Analytics client，以分頁 generator 串流查詢日級資料（維度 day）
     analytics = build_ya_client(env)
-    records = query_channel_daily(analytics, channel_id, start_date, end_date)
+    fetched = 0
+
+    # 4) 邊讀邊轉：將回傳欄位轉為事實表欄位，缺值保留 None
+    def _rows():
+        nonlocal fetched
+        for r in iter_channel_daily(analytics, channel_id, start_date, end_date):
+            fetched += 1
+            yield _to_fact_row(channel_id, r)
+
+    # 5) 寫入 DB（upsert 以避免重複，並更新既有紀錄；依 FACT_CHANNEL_DAILY_CHUNK_SIZE 分批 executemany、每批提交）
+    #    API 分頁與 DB 分批交錯進行，記憶體僅保留一頁與一批
+    upsert_fact_channel_daily(engine, _rows(), chunk_size=FACT_CHANNEL_DAILY_CHUNK_SIZE)
 
     # 若 API 無回傳資料，則記錄訊息並結束
-    if not records:
-        print("[ingest_channel_daily] YouTube Analytics 未回傳任何資料。")
+    if not fetched:
+        logger.info("[ingest_channel_daily] YouTube Analytics 未回傳任何資料。")
         return
+    logger.info("[ingest_channel_daily] 已寫入 %d 筆資料至 fact_yta_channel_daily。", fetched)
+
+def _fetch_channel_rows(channel_id: str, start_date: str, end_date: str, env: Dict[str, str]) -> List[dict]:
+    """
+    （執行於工作執行緒）查詢單一頻道的 YA 日資料並轉為事實表列。
+    - build_ya_client 於每個執行緒各自快取 client（底層 HTTP 連線非執行緒安全），憑證則跨執行緒共用。
+    """
+    analytics = build_ya_client(env)
+    records = query_channel_daily(analytics, channel_id, start_date, end_date)
+    logger.info("[ingest_channels_daily] %s: %s ~ %s 取得 %d 筆", channel_id, start_date, end_date, len(records))
+    return [_to_fact_row(channel_id, r) for r in records]
+
+def _fetch_channels_rows_batched(content_owner_id: str, windows: List[Tuple[str, str, str]], env: Dict[str, str]) -> List[List[dict]]:
+    """
+    內容擁有者模式：以 query_channels_daily 單一查詢取回所有頻道的 YA 日資料並轉為事實表列。
+    - 查詢區間取各頻道視窗的聯集（最早起日 ~ 最晚迄日），再依各頻道自己的視窗過濾，寫入範圍與逐頻道查詢一致。
+    - 回傳順序與 windows 相同。
+    """
+    start = min(w[1] for w in windows)
+    end = max(w[2] for w in windows)
+    analytics = build_ya_client(env)
+    grouped = query_channels_daily(analytics, content_owner_id, [w[0] for w in windows], start, end)
+
+    out: List[List[dict]] = []
+    for cid, start_date, end_date in windows:
+        rows = [_to_fact_row(cid, r) for r in grouped.get(cid, []) if start_date <= r["day"] <= end_date]
+        logger.info("[ingest_channels_daily] %s: %s ~ %s 取得 %d 筆", cid, start_date, end_date, len(rows))
+        out.append(rows)
+    return out
+
+def ingest_channels_daily(channel_ids: List[str], env: Dict[str, str]) -> int:
+    """
+    多頻道版本的 ingest_channel_daily：YA 查詢以執行緒池並行，DB 讀寫維持單執行緒。
+
+    流程：
+    1) 共用一個 Engine，逐一確保 dim_channel 存在並計算各頻道抓取視窗（DB 查詢，輕量）。
+    2) 以 ThreadPoolExecutor（最多 YA_MAX_WORKERS）並行查詢各頻道的 YA 日資料並轉為事實表列，
+       重疊各請求的網路等待時間，總耗時由 N × RTT 降為約 N / workers × RTT。
+       設定 YAAO_CONTENT_OWNER_ID（內容擁有者）時改以單一 channel,day 查詢一次取回所有頻道。
+    3) 由呼叫端執行緒單一消費者，將所有列以 upsert_fact_channel_daily 分批寫入。
+
+    回傳：
+    - int：寫入（送出 upsert）的總列數
+    """
+    engine = make_engine(env["DB_URL"], env)
+
+    # 1) 確保維度存在並計算視窗；無新日期的頻道略過
+    windows: List[Tuple[str, str, str]] = []
+    for cid in channel_ids:
+        start_date, end_date = compute_window(engine, cid, env["START_DATE"], ensure_channel=True)
+        if start_date and end_date:
+            windows.append((cid, start_date, end_date))
+        else:
+            logger.info("[ingest_channels_daily] %s: 沒有新的日期需要匯入。", cid)
+
+    if not windows:
+        return 0
+
+    # 2) 查詢 YA：內容擁有者可一次查多頻道；否則各頻道並行查詢（I/O bound）
+    content_owner_id = env.get("YAAO_CONTENT_OWNER_ID")
+    if content_owner_id and len(windows) > 1:
+        per_channel_rows = _fetch_channels_rows_batched(content_owner_id, windows, env)
+    else:
+        workers = min(YA_MAX_WORKERS, len(windows))
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            per_channel_rows = list(ex.map(lambda w: _fetch_channel_rows(w[0], w[1], w[2], env), windows))
 
-    # 4) 準備 upsert rows：將回傳欄位轉為事實表欄位，並處理型別與缺值
-    rows: List[dict] = []
-    for r in records:
-        # 個別先轉為 int，避免 None 或空字串造成錯誤
-        subscribers_gained = int(r.get("subscribersGained") or 0)
-        subscribers_lost = int(r.get("subscribersLost") or 0)
-        rows.append({
-            "channel_id": channel_id,
-            "day": r["day"],
-            "views": int(r.get("views") or 0),
-            "estimatedMinutesWatched": int(r.get("estimatedMinutesWatched") or 0),
-            "averageViewDuration": int(r.get("averageViewDuration") or 0),
-            "averageViewPercentage": float(r.get("averageViewPercentage") or 0.0),
-            "likes": int(r.get("likes") or 0),
-            "dislikes": int(r.get("dislikes") or 0),
-            "comments": int(r.get("comments") or 0),
-            "shares": int(r.get("shares") or 0),
-            "playlistStarts": int(r.get("playlistStarts") or 0),
-            "viewsPerPlaylistStart": float(r.get("viewsPerPlaylistStart") or 0.0),
-            "cardClicks": int(r.get("cardClicks") or 0),
-            "cardTeaserClicks": int(r.get("cardTeaserClicks") or 0),
-            "subscribersGained": subscribers_gained,
-            "subscribersLost": subscribers_lost,
-            # 衍生欄位：淨訂閱數
-            "subscribers_net": subscribers_gained - subscribers_lost,
-        })
-
-    # 5) 寫入 DB（upsert 以避免重複，並更新既有紀錄）
-    upsert_fact_channel_daily(engine, rows)
-    print(f"[ingest_channel_daily] 已寫入 {len(rows)} 筆資料至 fact_yta_channel_daily。")
+    # 3) 單一消費者批次寫入
+    total = sum(len(rows) for rows in per_channel_rows)
+    if total:
+        upsert_fact_channel_daily(engine, chain.from_iterable(per_channel_rows), chunk_size=FACT_CHANNEL_DAILY_CHUNK_SIZE)
+    logger.info("[ingest_channels_daily] 已寫入 %d 筆資料至 fact_yta_channel_daily（%d 個頻道）。", total, len(windows))
+    return total
 
 # 本程式作用摘要：
 # - _resolve_channel_id：決定使用的頻道 ID（優先 CLI/參數，其次設定）。
-# - ingest_channel_daily：端到端流程，確保維度存在、計算抓取視窗、呼叫 YA、整形與 upsert。
-# - 相依組件：make_engine/compute_window/build_ya_client/query_channel_daily/upsert_fact_channel_daily。
\ No newline at end of file
+# - _to_fact_row：依 METRIC_COLS 將 YA 日資料原樣帶入為事實表列（缺值保留 NULL）。
+# - ingest_channel_daily：端到端流程，確保維度存在、計算抓取視窗、以分頁串流呼叫 YA，邊整形邊分批 upsert。
+# - ingest_channels_daily：多頻道版本，YA 查詢以執行緒池並行（YA_MAX_WORKERS）或內容擁有者單一批次查詢，DB 寫入單一消費者批次 upsert。
+# - 相依組件：make_engine/compute_window/build_ya_client/iter_channel_daily/query_channel_daily/upsert_fact_channel_daily。
\ No newline at end of file
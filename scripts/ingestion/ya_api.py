@@ -4,11 +4,26 @@
 # - 以低階通用方法（get_analytics_client、query_reports）支援高階便捷查詢（query_channel_daily）。
 # - 與現有環境變數相容（build_ya_client），避免重複 OAuth 流程設定與參數分叉。
 # - 回傳的欄位對應 fact_yta_channel_daily 等事實表的欄位，便於後續 ETL 寫入。
+# - 憑證與 client 於程序內快取，多個步驟共用，不再每次重讀 token 檔與刷新 access token。
 
-from typing import Iterable, Dict, Any, List, Optional
+import threading
+from typing import Iterable, Iterator, Dict, Any, List, Optional, Tuple
+import httplib2
+import google_auth_httplib2
 from googleapiclient.discovery import build
+from scripts.models.fact_yta_channel_daily import METRIC_COLS
 from scripts.run_probe import get_oauth_credentials  # 重用你已寫好的 OAuth 取得函式
 
+# OAuth 憑證快取：key = (token_path, client_secret_path, scopes)；僅在失效時才重新取得/刷新
+_CREDS_CACHE: Dict[Tuple, Any] = {}
+_cache_lock = threading.Lock()
+# client（Resource）快取：底層 httplib2 非執行緒安全，存於 threading.local，各執行緒各自持有一份，
+# 執行緒結束時隨之釋放（不會累積，也不會被重用相同 ident 的新執行緒拿到）
+_client_local = threading.local()
+
+# 每個 client 專屬 httplib2.Http 的逾時秒數（連線於同一 client 的多次 reports.query 間保持 keep-alive）
+YA_HTTP_TIMEOUT = 30
+
 # =========================
 # 低階工廠與通用查詢接口
 # =========================
@@ -31,6 +46,13 @@ def get_analytics_client(
 
     回傳：
     - googleapiclient.discovery.Resource：已授權的 youtubeAnalytics v2 客戶端
+
+    快取：
+    - 同一組 (token_path, client_secret_path, scopes) 的憑證於程序內共用；仍有效時直接重用，
+      失效（過期）時才重新呼叫 get_oauth_credentials 刷新。
+    - 同一執行緒內重用已建立的 client，省去重複 build。
+    - client 綁定專屬的 AuthorizedHttp（底層一個 httplib2.Http），後續查詢沿用同一條 keep-alive 連線，
+      不再每次重做 TCP/TLS 握手；Http 依執行緒各自一份，Credentials 則跨執行緒共用。
     """
     # scopes 可為 None（走預設），或使用者自定義的 List[str]
     if scopes is None:
@@ -38,14 +60,38 @@ def get_analytics_client(
             "https://www.googleapis.com/auth/yt-analytics.readonly",
             "https://www.googleapis.com/auth/yt-analytics-monetary.readonly",
         ]
-    # 透過既有的工具函式取得 OAuth 憑證，並使用 discovery.build 建立 client
-    creds = get_oauth_credentials(
-        scopes,
-        token_path=token_path or "credentials/analytics_oauth_token.json",
-        client_secret_path=client_secret_path or "credentials/analytics_oauth_client_secret.json",
-        port=oauth_port or 0,
-    )
-    return build("youtubeAnalytics", "v2", credentials=creds)
+    token_path = token_path or "credentials/analytics_oauth_token.json"
+    client_secret_path = client_secret_path or "credentials/analytics_oauth_client_secret.json"
+    key = (token_path, client_secret_path, tuple(scopes))
+
+    # 本執行緒的 client：{key: (建立時使用的 creds, client)}
+    clients: Dict[Tuple, Tuple[Any, Any]] = getattr(_client_local, "clients", None)
+    if clients is None:
+        clients = _client_local.clients = {}
+
+    with _cache_lock:
+        creds = _CREDS_CACHE.get(key)
+    cached = clients.get(key)
+    # 憑證仍有效且 client 以同一份憑證建立（未被其他執行緒刷新替換）時直接重用
+    if creds is not None and creds.valid and cached is not None and cached[0] is creds:
+        return cached[1]
+
+    # 快取不存在或憑證已失效：透過既有的工具函式取得 OAuth 憑證，並使用 discovery.build 建立 client
+    if creds is None or not creds.valid:
+        creds = get_oauth_credentials(
+            scopes,
+            token_path=token_path,
+            client_secret_path=client_secret_path,
+            port=oauth_port or 0,
+        )
+    http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=YA_HTTP_TIMEOUT))
+    # static_discovery=True：使用 googleapiclient 內建的 discovery 文件，啟動時不再以 HTTPS 抓取
+    client = build("youtubeAnalytics", "v2", http=http, static_discovery=True)
+
+    with _cache_lock:
+        _CREDS_CACHE[key] = creds
+    clients[key] = (creds, client)
+    return client
 
 def query_reports(
     analytics_client,
@@ -57,8 +103,10 @@ def query_reports(
     dimensions: List[str] | str,
     sort: Optional[str] = None,
     max_results: Optional[int] = None,
+    start_index: Optional[int] = None,
     include_historical_channel_data: Optional[bool] = None,
     currency: Optional[str] = None,
+    filters: Optional[str] = None,
 ) -> Dict[str, Any]:
     """
     通用的 reports 查詢封裝（對應 youtubeAnalytics.reports.query）。
@@ -73,8 +121,10 @@ def query_reports(
     - dimensions: 維度（list 或逗號字串），如 ["day"] 或 ["day","country"]
     - sort: 排序欄位（通常為維度或指標），例如 "day"
     - max_results: 最大返回筆數
+    - start_index: 分頁起點（1-based，官方參數名為 startIndex）
     - include_historical_channel_data: 是否包含歷史頻道資料（官方參數名為 includeHistoricalChannelData）
     - currency: 貨幣代碼（若查詢營收相關指標）
+    - filters: 篩選條件（官方參數名 filters），如 "channel==UC1,UC2"；多個條件以分號分隔
 
     回傳：
     - dict：API 原始回傳（包含 columnHeaders、rows 等）
@@ -101,11 +151,15 @@ def query_reports(
         params["sort"] = sort
     if max_results is not None:
         params["maxResults"] = int(max_results)
+    if start_index is not None:
+        params["startIndex"] = int(start_index)
     if include_historical_channel_data is not None:
         # 官方參數名稱使用駝峰：includeHistoricalChannelData
         params["includeHistoricalChannelData"] = bool(include_historical_channel_data)
     if currency:
         params["currency"] = currency
+    if filters:
+        params["filters"] = filters
 
     # 直接呼叫官方 client 執行查詢
     return analytics_client.reports().query(**params).execute()
@@ -146,81 +200,125 @@ def build_ya_client(env: dict):
         oauth_port=port,
     )
 
-def query_channel_daily(analytics, channel_id: str, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+# query_channel_daily 分頁大小（每次 reports.query 的 maxResults）
+CHANNEL_DAILY_PAGE_SIZE = 1000
+
+# 日次頻道指標：直接取自事實表模型的指標欄位（YA 指標名與表欄位同名）
+CHANNEL_DAILY_METRICS = METRIC_COLS
+# 預先串好的 metrics 參數字串：每頁查詢直接傳入，不必每次重新 join
+_CHANNEL_DAILY_METRICS_CSV = ",".join(CHANNEL_DAILY_METRICS)
+
+def _iter_report_rows(analytics, fields: List[str], **query) -> Iterator[Dict[str, Any]]:
     """
-    拉取日次層級的頻道指標（維度：day），並整理為易於寫入 fact_yta_channel_daily 的結構。
+    以 startIndex 分頁逐頁呼叫 query_reports，將每列依 fields 組成 dict 逐筆 yield。
+    - 每頁 CHANNEL_DAILY_PAGE_SIZE 筆；取回筆數不足一頁或無資料即結束。
+    - query：直接轉給 query_reports 的其餘參數（ids/metrics/dimensions/filters/sort 等）。
+    """
+    start_index = 1
+    positions = None
+
+    while True:
+        resp = query_reports(
+            analytics_client=analytics,
+            max_results=CHANNEL_DAILY_PAGE_SIZE,
+            start_index=start_index,
+            **query,
+        )
+        rows = resp.get("rows", []) or []
+        if not rows:
+            return
+
+        # 只在第一頁解析一次欄位位置：(輸出欄位名, rows 內索引)；API 未回傳的欄位索引為 None，輸出 None
+        if positions is None:
+            cols = [h["name"] for h in resp.get("columnHeaders", [])]
+            idx = {name: i for i, name in enumerate(cols)}
+            positions = [(name, idx.get(name)) for name in fields]
+
+        # 依位置直接取值組成輸出列，不為每列建立中介 dict
+        for r in rows:
+            yield {name: (r[i] if i is not None else None) for name, i in positions}
+
+        if len(rows) < CHANNEL_DAILY_PAGE_SIZE:
+            return
+        start_index += len(rows)
+
+def iter_channel_daily(analytics, channel_id: str, start_date: str, end_date: str) -> Iterator[Dict[str, Any]]:
+    """
+    以 startIndex 分頁逐頁拉取日次層級的頻道指標（維度：day），逐筆 yield。
+    - 每頁 CHANNEL_DAILY_PAGE_SIZE 筆；取回筆數不足一頁或無資料即結束，不會因固定上限而截斷長區間。
+    - 呼叫端可邊讀邊寫（例如直接餵給 upsert_fact_channel_daily 分批寫入），記憶體用量以單頁為上限。
 
     參數：
     - analytics: YA 客戶端（由 get_analytics_client/build_ya_client 取得）
     - channel_id: 目標頻道 ID
     - start_date, end_date: 查詢日期區間（YYYY-MM-DD）
 
-    指標對應（部分與 fact_yta_channel_daily 欄位一一對應）：
-    - views, estimatedMinutesWatched, averageViewDuration, averageViewPercentage,
-      likes, dislikes, comments, shares, playlistStarts, viewsPerPlaylistStart,
-      cardClicks, cardTeaserClicks, subscribersGained, subscribersLost
-
-    回傳：
-    - List[Dict[str, Any]]：每筆包含 day 與上述指標欄位的紀錄（欄位名與表欄位一致）
+    產出：
+    - Dict[str, Any]：包含 day 與 CHANNEL_DAILY_METRICS 欄位的紀錄（欄位名與表欄位一致）
     """
-    # 定義欲拉取的 metrics 清單，與事實表欄位對齊，便於後續直接 upsert
-    metrics = [
-        "views",
-        "estimatedMinutesWatched",
-        "averageViewDuration",
-        "averageViewPercentage",
-        "likes",
-        "dislikes",
-        "comments",
-        "shares",
-        "playlistStarts",
-        "viewsPerPlaylistStart",
-        "cardClicks",
-        "cardTeaserClicks",
-        "subscribersGained",
-        "subscribersLost",
-    ]
-    # 呼叫通用查詢接口，維度為 day，按日排序，限制最大筆數（2000）
-    resp = query_reports(
-        analytics_client=analytics,
+    # 維度為 day，按日排序
+    return _iter_report_rows(
+        analytics,
+        ["day", *CHANNEL_DAILY_METRICS],
         ids=f"channel=={channel_id}",
         start_date=start_date,
         end_date=end_date,
-        metrics=metrics,
-        dimensions=["day"],
+        metrics=_CHANNEL_DAILY_METRICS_CSV,
+        dimensions="day",
         sort="day",
-        max_results=2000,
     )
 
-    # 解析回傳表頭（columnHeaders）為欄位名稱，對應 rows 的順序
-    cols = [h["name"] for h in resp.get("columnHeaders", [])]
-    rows = resp.get("rows", []) or []
-
-    # 將每一列轉為 dict，並且挑出與事實表對應的欄位，加入 day
-    out: List[Dict[str, Any]] = []
-    for r in rows:
-        rec = dict(zip(cols, r))
-        out.append({
-            "day": rec.get("day"),
-            "views": rec.get("views"),
-            "estimatedMinutesWatched": rec.get("estimatedMinutesWatched"),
-            "averageViewDuration": rec.get("averageViewDuration"),
-            "averageViewPercentage": rec.get("averageViewPercentage"),
-            "likes": rec.get("likes"),
-            "dislikes": rec.get("dislikes"),
-            "comments": rec.get("comments"),
-            "shares": rec.get("shares"),
-            "playlistStarts": rec.get("playlistStarts"),
-            "viewsPerPlaylistStart": rec.get("viewsPerPlaylistStart"),
-            "cardClicks": rec.get("cardClicks"),
-            "cardTeaserClicks": rec.get("cardTeaserClicks"),
-            "subscribersGained": rec.get("subscribersGained"),
-            "subscribersLost": rec.get("subscribersLost"),
-        })
+def query_channels_daily(
+    analytics,
+    content_owner_id: str,
+    channel_ids: List[str],
+    start_date: str,
+    end_date: str,
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    以單一查詢（維度 channel,day；filters=channel==A,B,C）拉取多個頻道的日次指標，依頻道分組回傳。
+    - 僅適用內容擁有者（CMS）報表：ids 必須為 contentOwner==...，channel 維度/篩選在一般頻道報表不可用。
+    - N 個頻道由 N 次 API 呼叫（與配額）降為 1 次（加上分頁）。
+
+    參數：
+    - analytics: YA 客戶端（需具該內容擁有者權限）
+    - content_owner_id: 內容擁有者 ID
+    - channel_ids: 目標頻道 ID 清單
+    - start_date, end_date: 查詢日期區間（YYYY-MM-DD）
+
+    回傳：
+    - Dict[channel_id, List[Dict[str, Any]]]：各頻道的紀錄（欄位同 iter_channel_daily）
+    """
+    out: Dict[str, List[Dict[str, Any]]] = {cid: [] for cid in channel_ids}
+    for r in _iter_report_rows(
+        analytics,
+        ["channel", "day", *CHANNEL_DAILY_METRICS],
+        ids=f"contentOwner=={content_owner_id}",
+        start_date=start_date,
+        end_date=end_date,
+        metrics=_CHANNEL_DAILY_METRICS_CSV,
+        dimensions="channel,day",
+        filters="channel==" + ",".join(channel_ids),
+        sort="channel,day",
+    ):
+        out.setdefault(r.pop("channel"), []).append(r)
     return out
 
+def query_channel_daily(analytics, channel_id: str, start_date: str, end_date: str) -> List[Dict[str, Any]]:
+    """
+    拉取日次層級的頻道指標（維度：day），並整理為易於寫入 fact_yta_channel_daily 的結構。
+    - 為 iter_channel_daily 的 list 版本（一次取回全部分頁）；大量資料建議直接使用 iter_channel_daily 串流處理。
+
+    指標對應（與 fact_yta_channel_daily 欄位一一對應）：見 CHANNEL_DAILY_METRICS。
+
+    回傳：
+    - List[Dict[str, Any]]：每筆包含 day 與上述指標欄位的紀錄（欄位名與表欄位一致）
+    """
+    return list(iter_channel_daily(analytics, channel_id, start_date, end_date))
+
 # 本程式作用摘要：
-# - get_analytics_client：以顯式參數建立 YA v2 client，統一 OAuth 與 build 流程。
+# - get_analytics_client：以顯式參數建立 YA v2 client，統一 OAuth 與 build 流程；每執行緒一個 keep-alive 的 AuthorizedHttp。
 # - query_reports：通用封裝 reports.query，處理參數轉換與選填項。
 # - build_ya_client：從環境變數解析設定，向下呼叫 get_analytics_client（相容舊介面）。
-# - query_channel_daily：拉取頻道日次指標（維度 day），輸出貼合事實表寫入的結構。
\ No newline at end of file
+# - iter_channel_daily / query_channel_daily：以 startIndex 分頁拉取頻道日次指標（維度 day），串流或一次回傳貼合事實表寫入的結構。
+# - query_channels_daily：內容擁有者報表以單一查詢（channel,day）取多頻道日次指標，依頻道分組回傳。
\ No newline at end of file
@@ -7,6 +7,7 @@
 
 from sqlalchemy.orm import declarative_base, Mapped, mapped_column
 from sqlalchemy import String, Date, BigInteger, Integer, Numeric, TIMESTAMP, text
+from sqlalchemy.schema import Computed
 
 # 建立 Declarative Base，作為所有 ORM 模型的基底
 Base = declarative_base()
@@ -15,6 +16,8 @@ class FactYtaChannelDaily(Base):
     """
     FactYtaChannelDaily：YouTube 頻道的每日彙總事實表
     - 主鍵：channel_id + day（複合主鍵），唯一標識某頻道某一天的統計。
+      InnoDB 以主鍵為叢集索引，compute_window 的 MAX(day) WHERE channel_id = ? 直接走主鍵前綴
+      取該頻道最後一筆（EXPLAIN 為 Select tables optimized away），不需另建 (channel_id, day DESC) 次索引。
     - 欄位：包含觀看數、觀看時長、互動（讚、踩、留言、分享）、播放清單互動、卡片互動、訂閱增減等。
     - 時戳：created_at/updated_at 由資料庫端以 CURRENT_TIMESTAMP 自動設定與更新。
     - 用途：ETL 寫入每日聚合結果，下游用於 KPI 趨勢分析與報表。
@@ -69,8 +72,10 @@ class FactYtaChannelDaily(Base):
     # 訂閱者流失數（整數），可能為 None
     subscribersLost: Mapped[int | None] = mapped_column(BigInteger)
 
-    # 訂閱者淨變動（整數），預設為 0；可在 ETL 端以 gained - lost 計算後寫入
-    subscribers_net: Mapped[int] = mapped_column(BigInteger, server_default=text("0"))
+    # 訂閱者淨變動（整數）：資料庫端 STORED 生成欄位（subscribersGained - subscribersLost），ETL 不寫入
+    subscribers_net: Mapped[int | None] = mapped_column(
+        BigInteger, Computed("subscribersGained - subscribersLost", persisted=True)
+    )
 
     # 建立時間（由資料庫自動填入 CURRENT_TIMESTAMP）
     created_at: Mapped[str] = mapped_column(TIMESTAMP, server_default=text("CURRENT_TIMESTAMP"))
@@ -78,8 +83,16 @@ class FactYtaChannelDaily(Base):
     # 更新時間（由資料庫在更新時自動設定 CURRENT_TIMESTAMP）
     updated_at: Mapped[str] = mapped_column(TIMESTAMP, server_default=text("CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP"))
 
+# 指標欄位（不含主鍵、生成欄位與時戳）：模組載入時由表定義推導一次，
+# 作為 YA metrics 清單、ETL 列組裝與 upsert 欄位清單的單一來源，避免三處各自維護而不同步
+METRIC_COLS = tuple(
+    c.name for c in FactYtaChannelDaily.__table__.columns
+    if c.name not in {"channel_id", "day", "created_at", "updated_at", "subscribers_net"}
+)
+
 # 本程式作用摘要：
 # - 宣告 SQLAlchemy 的 Base，並定義 FactYtaChannelDaily ORM 模型與其欄位與型別。
 # - 以 (channel_id, day) 為複合主鍵，承載每日彙總的觀看、互動與訂閱指標。
-# - 時戳欄位由資料庫端維護，方便審計與增量同步。
+# - METRIC_COLS：由表定義推導的指標欄位 tuple，供 YA 查詢、列組裝與 upsert SQL 共用。
+# - 時戳欄位與 subscribers_net（生成欄位）由資料庫端維護，方便審計與增量同步。
 # - 作為 ETL 寫入與 BI 報表查詢的核心事實表結構。
\ No newline at end of file
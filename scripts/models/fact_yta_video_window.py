@@ -17,7 +17,9 @@
 #       * 直屬欄位（如 views、likes、estimatedRevenue 等）以新值覆寫舊值。
 #       * ext_metrics 以 JSON_MERGE_PATCH 做淺層鍵合併：新值為 NULL 時保留舊值；舊值為 NULL 時採用新值；
 #         兩者皆不為 NULL 時，使用 JSON_MERGE_PATCH(ext_metrics, VALUES(ext_metrics)) 合併鍵值。
-#       * updated_at = CURRENT_TIMESTAMP 以標記最後更新時間（需在資料表存在該欄位）。
+#       * updated_at 只在任一欄位值實際改變時才設為 CURRENT_TIMESTAMP（需在資料表存在該欄位）；
+#         內容完全相同的重跑（冪等回補）不改寫資料列，MySQL 直接略過該列，省下 redo/binlog 與索引寫入。
+#         此指派必須放在 UPDATE 子句第一個：MySQL 依序套用指派，後面的欄位引用的是已更新後的值。
 #    - 適合在每日/每小時的滾動視窗聚合後寫回，確保歷史與最新資料一致。
 # 後續可擴充與應用建議：
 # - 欄位擴充：
@@ -38,13 +40,14 @@
 # - 數據品質：
 #   * 在 ETL 注入前做欄位型別驗證與邊界檢查（日期格式、非負值、NULL 規則），並可用 KNOWN_FACT_WINDOW_COLS 過濾輸入。
 
-KNOWN_FACT_WINDOW_COLS = {
+# 以 frozenset 定義：不可變、可跨執行緒共用，並可直接與 dict.keys() 做 C 層級的集合運算
+KNOWN_FACT_WINDOW_COLS = frozenset({
     "channel_id","video_id","start_date","end_date",
     "video_title","video_published_at",
     "views","estimatedMinutesWatched","likes","comments","shares",
     "subscribersGained","subscribersLost","estimatedRevenue","watchTime",
     "ext_metrics",
-}
+})
 
 UPSERT_SQL_FACT_WINDOW = """
 INSERT INTO fact_yta_video_window (
@@ -61,6 +64,20 @@ INSERT INTO fact_yta_video_window (
   %(ext_metrics)s
 )
 ON DUPLICATE KEY UPDATE
+  updated_at = IF(
+      NOT (video_title <=> VALUES(video_title))
+      OR NOT (video_published_at <=> VALUES(video_published_at))
+      OR NOT (views <=> VALUES(views))
+      OR NOT (estimatedMinutesWatched <=> VALUES(estimatedMinutesWatched))
+      OR NOT (likes <=> VALUES(likes))
+      OR NOT (comments <=> VALUES(comments))
+      OR NOT (shares <=> VALUES(shares))
+      OR NOT (subscribersGained <=> VALUES(subscribersGained))
+      OR NOT (subscribersLost <=> VALUES(subscribersLost))
+      OR NOT (estimatedRevenue <=> VALUES(estimatedRevenue))
+      OR NOT (watchTime <=> VALUES(watchTime))
+      OR (VALUES(ext_metrics) IS NOT NULL AND NOT (JSON_CONTAINS(ext_metrics, VALUES(ext_metrics)) <=> 1)),
+      CURRENT_TIMESTAMP, updated_at),
   video_title = VALUES(video_title),
   video_published_at = VALUES(video_published_at),
   views = VALUES(views),
@@ -76,6 +93,5 @@ ON DUPLICATE KEY UPDATE
       WHEN VALUES(ext_metrics) IS NULL THEN ext_metrics
       WHEN ext_metrics IS NULL THEN VALUES(ext_metrics)
       ELSE JSON_MERGE_PATCH(ext_metrics, VALUES(ext_metrics))
-  END,
-  updated_at = CURRENT_TIMESTAMP
+  END
 """
\ No newline at end of file
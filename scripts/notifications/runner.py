@@ -1,7 +1,7 @@
 # scripts/notifications/runner.py
 # 總覽：
 # - run_step_with_retry：以統一重試機制執行單一步驟，回傳成功/失敗與耗時等資訊。
-# - run_pipeline_and_notify：依步驟規格順序執行整個 Pipeline，產出摘要、寫入日誌並觸發通知。
+# - run_pipeline_and_notify：依步驟規格逐階段執行整個 Pipeline（同一階段內的步驟以執行緒並行），產出摘要、寫入日誌並觸發通知。
 # - format_summary_text/notify_all：由 senders 模組提供，這裡負責組裝摘要與呼叫多通道通知。
 # - 其餘輔助：參數淨化（避免保留鍵衝突）、建立 logs 目錄、寫入結果檔案。
 
@@ -9,38 +9,56 @@ import os
 import time
 import traceback
 import sys
-import io
-from typing import Callable, Dict, Any, List
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, List, Union
 
 from .senders import notify_all, format_summary_text
 
 # 保留鍵：steps_spec 的 kwargs 中不應傳遞這些鍵到實際步驟函式，避免與 runner 控制參數衝突
 RESERVED_KW_KEYS = {"name", "fn", "should_retry", "sleep_for_retry", "max_retries", "console"}
 
+# 每個步驟最多保留的捕捉輸出字元數（只留最後這麼多，避免冗長步驟吃光記憶體）
+CAPTURE_MAX_CHARS = 64 * 1024
+
 # --- [新增] 1. 用於同時顯示並捕捉輸出的工具類別 ---
 class StreamTee:
     """
     一個類似 Tee 的串流工具，會將寫入的內容同時送到：
     1. 原始串流 (例如螢幕/終端機)
-    2. 內部的 StringIO (用於捕捉字串)
+    2. 內部的有界緩衝區 (用於捕捉字串，只保留最後 CAPTURE_MAX_CHARS 字元)
     """
-    def __init__(self, original_stream):
+    def __init__(self, original_stream, max_chars: int = CAPTURE_MAX_CHARS):
         self.original_stream = original_stream
-        self.capture_buffer = io.StringIO()
+        self.max_chars = max_chars
+        self.capture_buffer = deque()
+        self.captured_chars = 0
+        self.truncated = False
 
     def write(self, data):
         # 1. 寫入原始位置 (只有當原始串流存在時才寫入，避免 NoneType 錯誤)
         if self.original_stream:
             try:
                 self.original_stream.write(data)
-                # 確保即時刷新，讓 Log 在終端機即時顯示
-                self.original_stream.flush()
+                # 行緩衝：只有寫到換行時才刷新，終端機仍逐行即時顯示，但不必每次 write 都 flush
+                if "\n" in data:
+                    self.original_stream.flush()
             except Exception:
                 # 萬一原始串流寫入失敗 (例如 pipe 斷裂)，忽略錯誤以保證程式繼續執行
                 pass
-        
+
         # 2. 寫入緩衝區 (存起來發報告用，這部分一定要執行)
-        self.capture_buffer.write(data)
+        self.capture(data)
+
+    def capture(self, data):
+        """只寫入緩衝區、不輸出到原始串流；超過上限時從最舊的片段丟起。"""
+        self.capture_buffer.append(data)
+        self.captured_chars += len(data)
+        while self.captured_chars > self.max_chars and len(self.capture_buffer) > 1:
+            self.captured_chars -= len(self.capture_buffer.popleft())
+            self.truncated = True
 
     def flush(self):
         if self.original_stream:
@@ -48,10 +66,73 @@ class StreamTee:
                 self.original_stream.flush()
             except Exception:
                 pass
-        self.capture_buffer.flush()
 
     def get_captured_text(self):
-        return self.capture_buffer.getvalue()
+        text = "".join(self.capture_buffer)
+        if len(text) > self.max_chars:
+            text = text[-self.max_chars:]
+            self.truncated = True
+        if self.truncated:
+            return f"...(輸出過長，僅保留最後 {self.max_chars} 字元)\n" + text
+        return text
+
+class _ThreadRoutedStdout:
+    """
+    依執行緒分派的 stdout：已登記 StreamTee 的執行緒寫入各自的 Tee。
+    - 讓並行執行的步驟各自捕捉自己的 print 輸出，不會互相覆蓋 sys.stdout。
+    - 未登記的執行緒（例如步驟內部 ThreadPoolExecutor 的工作執行緒）在有步驟執行時，
+      照常輸出到原始串流一次，並寫入所有執行中步驟的緩衝區（同階段並行時無法分辨歸屬，寧可重複也不遺漏）。
+    """
+    def __init__(self, original_stream):
+        self.original_stream = original_stream
+        self.tees: Dict[int, StreamTee] = {}
+
+    def write(self, data):
+        tee = self.tees.get(threading.get_ident())
+        if tee is not None:
+            tee.write(data)
+            return
+        if self.original_stream:
+            try:
+                self.original_stream.write(data)
+                if "\n" in data:
+                    self.original_stream.flush()
+            except Exception:
+                pass
+        with _stdout_lock:
+            active = list(self.tees.values())
+        for other in active:
+            other.capture(data)
+
+    def flush(self):
+        if self.original_stream:
+            try:
+                self.original_stream.flush()
+            except Exception:
+                pass
+
+_stdout_lock = threading.Lock()
+
+@contextmanager
+def _capture_stdout():
+    """
+    於目前執行緒開始捕捉 stdout，yield 對應的 StreamTee。
+    - 第一個進入者把 sys.stdout 換成 _ThreadRoutedStdout；最後一個離開者還原。
+    """
+    ident = threading.get_ident()
+    with _stdout_lock:
+        if not isinstance(sys.stdout, _ThreadRoutedStdout):
+            sys.stdout = _ThreadRoutedStdout(sys.stdout)
+        router = sys.stdout
+        tee = StreamTee(router.original_stream)
+        router.tees[ident] = tee
+    try:
+        yield tee
+    finally:
+        with _stdout_lock:
+            router.tees.pop(ident, None)
+            if not router.tees and sys.stdout is router:
+                sys.stdout = router.original_stream
 
 # ------------------------------------------------
 
@@ -86,9 +167,6 @@ def run_step_with_retry(
     attempt = 0
     start_ts = time.time()
 
-    # 準備捕捉器
-    stdout_tee = StreamTee(sys.stdout)
-
     step_info: Dict[str, Any] = {
         "name": name,
         "ok": False,
@@ -99,11 +177,9 @@ def run_step_with_retry(
         "logs": ""  # [新增] 用來存放捕捉到的 Log
     }
 
-    # 暫時替換系統 stdout，這樣 fn 裡面的 print 就會經過 StreamTee
-    original_stdout = sys.stdout
-    sys.stdout = stdout_tee
-
-    try:
+    # 暫時以執行緒專屬的 StreamTee 捕捉 stdout，這樣 fn 裡面的 print 就會經過 StreamTee
+    # （並行步驟各自捕捉，互不干擾；離開時自動還原）
+    with _capture_stdout() as stdout_tee:
         while True:
             attempt += 1
             step_info["attempts"] = attempt
@@ -139,10 +215,6 @@ def run_step_with_retry(
                 next_attempt = attempt + 1
                 wait = sleep_for_retry(attempt_idx=attempt)
                 console.print(f"[yellow].. Retried {name} after {wait:.1f}s (next attempt {next_attempt}/{1+max_retries})[/yellow]")
-    
-    finally:
-        # [重要] 務必將 stdout 還原，避免影響後續程式
-        sys.stdout = original_stdout
 
 def _sanitize_kwargs(kwargs: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -178,50 +250,77 @@ def _write_summary_log(text: str, status: str) -> str:
         f.write(text)
     return path
 
+def _run_spec(spec: Dict[str, Any], should_retry, sleep_for_retry, max_retries: int, console) -> Dict[str, Any]:
+    """
+    執行單一步驟規格：取出 args/kwargs（kwargs 先過濾保留鍵）後交給 run_step_with_retry。
+    """
+    args = (spec.get("args", []) or [])
+    kwargs = _sanitize_kwargs(spec.get("kwargs", {}) or {})
+
+    # 以固定位置參數傳入 run_step_with_retry 的控制參數
+    return run_step_with_retry(
+        spec["name"],         # name
+        spec["fn"],           # fn
+        should_retry,         # should_retry
+        sleep_for_retry,      # sleep_for_retry
+        max_retries,          # max_retries
+        console,              # console
+        *args,                # positional args for fn
+        **kwargs,             # keyword args for fn
+    )
+
 def run_pipeline_and_notify(
     cfg: Dict[str, str],
     console,
-    steps_spec: List[Dict[str, Any]],
+    steps_spec: List[Union[Dict[str, Any], List[Dict[str, Any]]]],
     should_retry,
     sleep_for_retry,
     max_retries: int
 ) -> int:
     """
-    依 steps_spec 描述的步驟順序執行整個 Pipeline，並於結束時輸出摘要、寫入 log。
+    依 steps_spec 描述的階段順序執行整個 Pipeline，並於結束時輸出摘要、寫入 log。
     若執行失敗，則額外發送通知。
+    - steps_spec 每個元素為一個階段：單一步驟 dict，或互不相依的步驟 list。
+    - 同一階段內的多個步驟以 ThreadPoolExecutor 並行（適合 I/O 為主的 API 呼叫），
+      各自保有重試與 Log 捕捉；整個階段結束後才進入下一階段，任一步驟失敗即停止後續階段。
+    - cfg["PIPELINE_CAPTURE_LOGS"]="on_failure" 時，只把失敗步驟的捕捉輸出併入摘要（預設 always：全部併入）。
     """
     started = time.time()
     steps_result: List[Dict[str, Any]] = []
     status = "成功"
     extra_details: List[str] = []
+    logs_on_failure_only = (cfg.get("PIPELINE_CAPTURE_LOGS") or "").strip().lower() == "on_failure"
 
     try:
-        for spec in steps_spec:
-            # 取得步驟函式的 args/kwargs；kwargs 需先過濾保留鍵
-            args = (spec.get("args", []) or [])
-            kwargs = _sanitize_kwargs(spec.get("kwargs", {}) or {})
-
-            # 以固定位置參數傳入 run_step_with_retry 的控制參數
-            info = run_step_with_retry(
-                spec["name"],         # name
-                spec["fn"],           # fn
-                should_retry,         # should_retry
-                sleep_for_retry,      # sleep_for_retry
-                max_retries,          # max_retries
-                console,              # console
-                *args,                # positional args for fn
-                **kwargs,             # keyword args for fn
-            )
-
-            steps_result.append(info)
-            
-            # 將該步驟捕捉到的 Log 加入到 extra_details 中
-            log_content = info.get("logs", "").strip()
-            if log_content:
-                extra_details.append(f"\n--- [{spec['name']}] 執行紀錄 ---")
-                extra_details.append(log_content)
-                
-            if not info["ok"]:
+        for stage in steps_spec:
+            specs = stage if isinstance(stage, list) else [stage]
+
+            if len(specs) == 1:
+                infos = [_run_spec(specs[0], should_retry, sleep_for_retry, max_retries, console)]
+            else:
+                with ThreadPoolExecutor(max_workers=len(specs)) as pool:
+                    futures = [
+                        pool.submit(_run_spec, spec, should_retry, sleep_for_retry, max_retries, console)
+                        for spec in specs
+                    ]
+                    # 依 steps_spec 順序收集結果，讓摘要與 Log 順序固定
+                    infos = [f.result() for f in futures]
+
+            for spec, info in zip(specs, infos):
+                steps_result.append(info)
+
+                # on_failure 模式：成功步驟的 Log 不需要，直接略過，不再複製/串接
+                if logs_on_failure_only and info["ok"]:
+                    info["logs"] = ""
+                    continue
+
+                # 將該步驟捕捉到的 Log 加入到 extra_details 中
+                log_content = info.get("logs", "").strip()
+                if log_content:
+                    extra_details.append(f"\n--- [{spec['name']}] 執行紀錄 ---")
+                    extra_details.append(log_content)
+
+            if not all(info["ok"] for info in infos):
                 # 任一步驟失敗，標記總狀態為失敗並中斷迴圈
                 status = "失敗"
                 break
@@ -1,14 +1,28 @@
 # 路徑：scripts/run_probe.py
+import io
 import os
 import sys
 import json
+import hashlib
+import threading
+from urllib.parse import quote, urlencode
 import time
-from dataclasses import dataclass
+from collections import defaultdict
+from functools import lru_cache, partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
 from datetime import datetime, timedelta, timezone
-from typing import Optional, Dict, Any, List, Tuple
+from typing import Optional, Dict, Any, Callable, FrozenSet, List, Tuple
 
 import httpx
-from sqlalchemy import create_engine, text
+
+# orjson 為可選相依：有安裝時以其單次編碼輸出摘要，否則退回標準 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+import pymysql
+from sqlalchemy.engine import make_url
 from sqlalchemy.exc import SQLAlchemyError
 
 # OAuth / Google API 客戶端
@@ -23,17 +37,18 @@ from scripts.utils.env import load_settings  # 統一設定讀取
 # =========================
 # 資料類型
 # =========================
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ProbeResult:
     """
     表示單一探針（probe）執行結果的資料結構。
+    - slots + frozen：無 __dict__、建立後不可修改（序列化一律經 dataclasses.asdict）。
     """
     name: str
     ok: bool
     message: str
     extra: Optional[Dict[str, Any]] = None
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ProbeOutputs:
     """
     封裝探針結果：僅包含 Public API(ypkg), DB, Data OAuth(ydao) 與一致性檢查。
@@ -48,14 +63,35 @@ class ProbeOutputs:
 # =========================
 # 工具函式
 # =========================
+# 視為 True 的字串值（比對前先 strip + lower）
+_BOOL_TRUE: FrozenSet[str] = frozenset({"1", "true", "yes", "y", "on"})
+
+@lru_cache(maxsize=32)
 def parse_bool(val: Optional[str], default: bool = False) -> bool:
-    if val is None:
-        return default
-    return str(val).strip().lower() in ("1", "true", "yes", "y", "on")
+    """
+    解析環境變數布林值；輸入種類很少，以 lru_cache 快取結果。
+    """
+    return default if val is None else val.strip().lower() in _BOOL_TRUE
 
+@lru_cache(maxsize=32)
+def _parse_scopes(scopes_str: str) -> Tuple[str, ...]:
+    """
+    解析逗號分隔的 scopes 字串為 tuple（去除空白與空項）；同一字串只解析一次。
+    """
+    return tuple(s for s in (p.strip() for p in scopes_str.split(",")) if s)
+
+@lru_cache(maxsize=8)
+def _parse_port(raw: Optional[str]) -> int:
+    """
+    解析 OAuth 回呼埠號字串；空值回傳 0（由系統挑選可用埠）。
+    """
+    return int(raw) if raw else 0
+
+@lru_cache(maxsize=32)
 def iso_date_boundaries(start_str: str, end_str: str) -> Tuple[str, str]:
     """
     轉換日期為 RFC3339 格式 (用於 Data API Search)。
+    - 以 lru_cache 快取：同一組日期字串（探針重試、verify_all 重複呼叫）只轉換一次。
     """
     try:
         start = datetime.fromisoformat(start_str).replace(tzinfo=timezone.utc)
@@ -73,6 +109,32 @@ def iso_date_boundaries(start_str: str, end_str: str) -> Tuple[str, str]:
     end_rfc3339 = end_eod.isoformat().replace("+00:00", "Z")
     return start_rfc3339, end_rfc3339
 
+def run_probes_concurrently(
+    probes: List[Tuple[str, Callable[[], "ProbeResult"]]],
+    on_result: Optional[Callable[["ProbeResult"], None]] = None,
+) -> List["ProbeResult"]:
+    """
+    以執行緒池同時執行多個互不相依的探針（HTTP / DB / OAuth 皆為 I/O 等待為主），
+    總耗時由各探針耗時總和降為最慢的一個。
+    - probes：(名稱, 無參數呼叫) 清單；回傳結果順序與輸入相同。
+    - on_result：可選回呼；每個探針一完成（as_completed 順序）即呼叫，不必等最慢的探針。
+    - 探針本身拋出的例外（含 SystemExit）包成失敗的 ProbeResult，不中斷其他探針。
+    """
+    def _call(name: str, fn: Callable[[], ProbeResult]) -> ProbeResult:
+        try:
+            return fn()
+        except BaseException as e:
+            return ProbeResult(name, False, f"{name} 檢測失敗: {e.__class__.__name__}: {e}")
+
+    if not probes:
+        return []
+    with ThreadPoolExecutor(max_workers=len(probes)) as pool:
+        futures = [pool.submit(_call, name, fn) for name, fn in probes]
+        if on_result is not None:
+            for f in as_completed(futures):
+                on_result(f.result())
+        return [f.result() for f in futures]
+
 def ensure_dir_for(path: str) -> None:
     d = os.path.dirname(path)
     if d and not os.path.exists(d):
@@ -81,9 +143,32 @@ def ensure_dir_for(path: str) -> None:
 # =========================
 # 驗證：Public(API Key) - Data API v3
 # =========================
-def count_videos_in_range(api_key: str, channel_id: str, start_iso: str, end_iso: str) -> Tuple[int, Optional[str]]:
+# Search 回應中缺 id 欄位時的共用空 dict，避免每個項目各配置一個 {}
+_EMPTY: Dict[str, Any] = {}
+
+@lru_cache(maxsize=1)
+def _get_http_client() -> httpx.Client:
+    """
+    程序內共用的 httpx.Client（執行緒安全）：跨探測重用連線池與 TLS session，不必每次重新握手。
+    """
+    return httpx.Client(timeout=20.0)
+
+def count_videos_in_range(
+    api_key: str,
+    channel_id: str,
+    start_iso: str,
+    end_iso: str,
+    count_only: bool = True,
+) -> Tuple[int, Optional[str]]:
     """
     使用 YouTube Search API 計算特定頻道於時間範圍內發佈的影片數量。
+    - nextPageToken 只能逐頁取得（下一頁的 token 在上一頁回應中），無法預先並行抓取；
+      因此改以 fields 只索取計數需要的欄位（id.kind 與 nextPageToken），縮小每頁回應，
+      並沿用共用 httpx.Client 的 keep-alive 連線逐頁走訪。
+    - 固定不變的查詢字串於迴圈前編碼一次，每頁只附加 pageToken。
+    - count_only=True（預設）：直接採用第一頁的 pageInfo.totalResults，單次請求即回傳；
+      此值為 API 估計值（可能略為高估，上限約 1,000,000），僅適合探測/概估。
+      需要精確數量時傳 count_only=False，逐頁走訪計數（每頁耗用搜尋配額）。
     """
     base_url = "https://www.googleapis.com/youtube/v3/search"
     params = {
@@ -95,41 +180,49 @@ def count_videos_in_range(api_key: str, channel_id: str, start_iso: str, end_iso
         "publishedAfter": start_iso,
         "publishedBefore": end_iso,
         "maxResults": 50,
+        # 部分回應：只取計數需要的欄位，省下 etag/snippet 等傳輸與 JSON 解析
+        "fields": "nextPageToken,pageInfo(totalResults),items(id(kind))",
     }
 
     total = 0
     next_page: Optional[str] = None
     last_video_channel: Optional[str] = None
 
-    with httpx.Client(timeout=20.0) as client:
-        while True:
-            if next_page:
-                params["pageToken"] = next_page
-            else:
-                params.pop("pageToken", None)
+    first_url = f"{base_url}?{urlencode(params)}"
+    client = _get_http_client()
+    while True:
+        url = f"{first_url}&pageToken={quote(next_page, safe='')}" if next_page else first_url
 
-            try:
-                resp = client.get(base_url, params=params)
-            except httpx.RequestError as e:
-                raise SystemExit(f"[錯誤] 網路錯誤: {e}")
-
-            if resp.status_code == 429:
-                raise SystemExit("[錯誤] 配額超限 (429)。請稍後再試或縮小查詢範圍。")
-            if resp.status_code >= 500:
-                raise SystemExit(f"[錯誤] 伺服器錯誤 {resp.status_code}: {resp.text[:200]}")
-            if resp.status_code != 200:
-                raise SystemExit(f"[錯誤] API 錯誤 {resp.status_code}: {resp.text[:200]}")
-
-            data = resp.json()
-            items: List[Dict[str, Any]] = data.get("items", [])
-
-            for it in items:
-                kind = it.get("id", {}).get("kind")
-                if kind == "youtube#video":
-                    total += 1
-            next_page = data.get("nextPageToken")
-            if not next_page:
-                break
+        try:
+            resp = client.get(url)
+        except httpx.RequestError as e:
+            raise SystemExit(f"[錯誤] 網路錯誤: {e}")
+
+        if resp.status_code == 429:
+            raise SystemExit("[錯誤] 配額超限 (429)。請稍後再試或縮小查詢範圍。")
+        if resp.status_code >= 500:
+            raise SystemExit(f"[錯誤] 伺服器錯誤 {resp.status_code}: {resp.text[:200]}")
+        if resp.status_code != 200:
+            raise SystemExit(f"[錯誤] API 錯誤 {resp.status_code}: {resp.text[:200]}")
+
+        data = resp.json()
+
+        # 只需數量時：第一頁即以 totalResults 回傳，不走訪其餘頁面
+        if count_only and next_page is None:
+            total_results = (data.get("pageInfo") or {}).get("totalResults")
+            if total_results is not None:
+                return int(total_results), None
+
+        items: List[Dict[str, Any]] = data.get("items", [])
+
+        try:
+            # Search API 保證每個項目都有 id.kind：直接索引，每頁只付一次 try 的成本
+            total += sum(1 for it in items if it["id"]["kind"] == "youtube#video")
+        except KeyError:
+            total += sum(1 for it in items if it.get("id", _EMPTY).get("kind") == "youtube#video")
+        next_page = data.get("nextPageToken")
+        if not next_page:
+            break
 
     return total, last_video_channel
 
@@ -149,8 +242,8 @@ def probe_ypkg(channel_id: str, start_iso: str, end_iso: str, env: Dict[str, str
         return ProbeResult("ypkg", False, "公開 API 檢測失敗: 未提供 YPKG_API_KEY。")
 
     try:
-        total, _ = count_videos_in_range(api_key, channel_id, start_iso, end_iso)
-        return ProbeResult("ypkg", True, f"公開 API Key 正常。區間內影片總數={total}")
+        total, _ = count_videos_in_range(api_key, channel_id, start_iso, end_iso, count_only=True)
+        return ProbeResult("ypkg", True, f"公開 API Key 正常。區間內影片總數（估計）={total}")
     except SystemExit as e:
         return ProbeResult("ypkg", False, f"{e}")
     except Exception as e:
@@ -160,31 +253,110 @@ def probe_ypkg(channel_id: str, start_iso: str, end_iso: str, env: Dict[str, str
 # =========================
 # 驗證：DB
 # =========================
+# 探針用的原生 DB-API 連線快取：key = db_url；以鎖保護，連線失敗時整批丟棄、下次重新連線
+_DB_CONNS: Dict[str, Any] = {}
+_db_conn_lock = threading.Lock()
+
+def _connect_mysql(db_url: str):
+    """
+    依 SQLAlchemy 格式的 db_url（mysql+pymysql://...）直接建立 PyMySQL 連線；
+    make_url 僅用於解析 URL，不載入方言或建立 Engine。
+    """
+    url = make_url(db_url)
+    return pymysql.connect(
+        host=url.host or "localhost",
+        port=url.port or 3306,
+        user=url.username,
+        password=url.password or "",
+        database=url.database,
+        charset=url.query.get("charset", "utf8mb4"),
+        connect_timeout=5,
+    )
+
+def reset_db_connections() -> None:
+    """
+    關閉並清除所有快取的探針連線；下次探測會重新連線。
+    """
+    with _db_conn_lock:
+        conns = list(_DB_CONNS.values())
+        _DB_CONNS.clear()
+    for conn in conns:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
 def test_mysql_connection(db_url: str) -> "ProbeResult":
     """
     測試 MySQL 連線是否正常。
+    - 以 PyMySQL 連線的 ping（MySQL 原生 COM_PING，無結果集）取代 SQLAlchemy Engine + SELECT 1。
+    - 連線依 db_url 快取重用；ping(reconnect=True) 會在連線中斷時自動重連。
+    - 失敗時丟棄快取連線，下次探測重新建立。
     """
     try:
-        engine = create_engine(db_url, pool_pre_ping=True, pool_recycle=3600)
-        with engine.connect() as conn:
-            result = conn.execute(text("SELECT 1")).scalar()
-            if result == 1:
-                return ProbeResult("db", True, "MySQL 連線正常 (SELECT 1 回傳 1)")
-            else:
-                return ProbeResult("db", False, f"MySQL 連線結果異常: {result}")
-    except SQLAlchemyError as e:
+        with _db_conn_lock:
+            conn = _DB_CONNS.get(db_url)
+            if conn is None:
+                conn = _DB_CONNS[db_url] = _connect_mysql(db_url)
+            conn.ping(reconnect=True)
+        return ProbeResult("db", True, "MySQL 連線正常 (COM_PING 成功)")
+    except (pymysql.MySQLError, SQLAlchemyError) as e:
+        reset_db_connections()
         return ProbeResult("db", False, f"MySQL 連線失敗: {e.__class__.__name__}: {e}")
 
 
 # =========================
 # OAuth 共用
 # =========================
+# 互動授權等待上限（秒）；可由 OAUTH_TIMEOUT_SEC 覆寫
+OAUTH_TIMEOUT_SEC = 120.0
+
+# 每個 token 檔一把鎖：並行探針同時刷新同一 token 時，寫檔依序進行
+_TOKEN_LOCKS: Dict[str, threading.Lock] = defaultdict(threading.Lock)
+
+def _write_token_atomic(token_path: str, creds: Credentials) -> None:
+    """
+    以「寫暫存檔 + fsync + os.replace」原子寫入 token，讀取端不會讀到寫到一半的檔案。
+    """
+    tmp_path = token_path + ".tmp"
+    with _TOKEN_LOCKS[token_path]:
+        with open(tmp_path, "w", encoding="utf-8") as token:
+            token.write(creds.to_json())
+            token.flush()
+            os.fsync(token.fileno())
+        os.replace(tmp_path, token_path)
+
+def _run_local_server_with_timeout(flow: InstalledAppFlow, port: int, timeout_sec: float) -> Credentials:
+    """
+    在背景 daemon 執行緒中跑 flow.run_local_server，呼叫端以完成事件等待最多 timeout_sec 秒。
+    - 逾時：拋出 SystemExit("OAuth 授權逾時")；回呼伺服器執行緒為 daemon，不會阻擋程式結束。
+    - 授權流程本身的例外原樣拋回呼叫端。
+    """
+    done = threading.Event()
+    outcome: Dict[str, Any] = {}
+
+    def _target() -> None:
+        try:
+            outcome["creds"] = flow.run_local_server(port=port)
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            done.set()
+
+    threading.Thread(target=_target, name="oauth-local-server", daemon=True).start()
+    if not done.wait(timeout_sec):
+        raise SystemExit("OAuth 授權逾時")
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["creds"]
+
 def get_oauth_credentials(
     scopes: List[str],
     token_path: Optional[str] = None,
     client_secret_path: Optional[str] = None,
     port: Optional[int] = None,
     interactive: bool = False,
+    timeout_sec: Optional[float] = None,
 ) -> Credentials:
     """
     取得或建立 OAuth 憑證。
@@ -192,6 +364,7 @@ def get_oauth_credentials(
     :param interactive: 
         True: 當 Token 失效且無法刷新時，允許跳出瀏覽器進行人工授權。
         False: 自動化模式。若 Token 失效，直接拋出錯誤，不卡住程式。
+    :param timeout_sec: 互動授權的等待上限（秒），預設 OAUTH_TIMEOUT_SEC；逾時拋出 SystemExit。
     """
     token_path = token_path or "token.json"
     client_secret_path = client_secret_path or "client_secret.json"
@@ -257,21 +430,38 @@ def get_oauth_credentials(
                 print("[資訊] 啟動互動式授權流程 (將開啟瀏覽器)...")
                 flow = InstalledAppFlow.from_client_secrets_file(client_secret_path, scopes)
                 print("請訪問下方網址以授權此應用程式：")
-                creds = flow.run_local_server(port=port or 0)
+                creds = _run_local_server_with_timeout(flow, port or 0, timeout_sec or OAUTH_TIMEOUT_SEC)
+            except SystemExit:
+                raise
             except Exception as e:
                 raise SystemExit(f"[錯誤] OAuth 互動授權失敗: {e}")
 
         # 4. 寫回 Token 檔案
         if creds and creds.valid:
             try:
-                with open(token_path, "w", encoding="utf-8") as token:
-                    token.write(creds.to_json())
+                _write_token_atomic(token_path, creds)
             except Exception as e:
                 print(f"[警告] 寫入 Token 檔案失敗: {e}", file=sys.stderr)
 
     return creds
 
 
+# 已建立的 Google API service 快取：key = (api 名稱, 版本, access token 摘要)；token 刷新後自然換新 key
+_SERVICE_CACHE: Dict[Tuple[str, str, bytes], Any] = {}
+
+def _build_service(name: str, version: str, creds: Credentials):
+    """
+    以快取方式建立 googleapiclient service：同一組憑證（同一 access token）重複探測時直接重用，
+    不再每次解析 discovery 文件與建立 Resource。
+    - static_discovery=True：使用套件內建 discovery 文件，不經 HTTPS 抓取。
+    """
+    key = (name, version, hashlib.blake2b((creds.token or "").encode(), digest_size=8).digest())
+    service = _SERVICE_CACHE.get(key)
+    if service is None:
+        service = build(name, version, credentials=creds, cache_discovery=False, static_discovery=True)
+        _SERVICE_CACHE[key] = service
+    return service
+
 # =========================
 # 驗證：YDAO（Data API via OAuth）
 # =========================
@@ -280,12 +470,13 @@ def probe_ydao(channel_env_id: str, env: Dict[str, str], interactive: bool = Tru
     驗證 YouTube Data API（OAuth）可用性。
     """
     scopes_str = env.get("YDAO_OAUTH_SCOPES", "https://www.googleapis.com/auth/youtube,https://www.googleapis.com/auth/youtube.force-ssl")
-    scopes = [s.strip() for s in scopes_str.split(",") if s.strip()]
+    scopes = list(_parse_scopes(scopes_str))
     
     # 使用 YDAO 開頭的變數
     token_path = env.get("YDAO_TOKEN_PATH") 
     client_path = env.get("YDAO_CREDENTIALS_PATH") 
-    port = int(env.get("YDAO_OAUTH_PORT", "0"))
+    port = _parse_port(env.get("YDAO_OAUTH_PORT"))
+    timeout_sec = float(env.get("OAUTH_TIMEOUT_SEC") or OAUTH_TIMEOUT_SEC)
 
     try:
         # 這裡設定 interactive=True，因為 run_probe 是診斷工具，允許使用者登入
@@ -294,9 +485,10 @@ def probe_ydao(channel_env_id: str, env: Dict[str, str], interactive: bool = Tru
             token_path=token_path, 
             client_secret_path=client_path, 
             port=port,
-            interactive=interactive 
+            interactive=interactive,
+            timeout_sec=timeout_sec,
         )
-        yt = build("youtube", "v3", credentials=creds)
+        yt = _build_service("youtube", "v3", creds)
 
         # 取得我的頻道資料，驗證 OAuth 與 Data API 可用
         me = yt.channels().list(part="id,snippet", mine=True, maxResults=1).execute()
@@ -307,7 +499,8 @@ def probe_ydao(channel_env_id: str, env: Dict[str, str], interactive: bool = Tru
         ok = (my_channel_id == channel_env_id)
         msg = f"Data OAuth 正常。我的頻道 ID={my_channel_id}。與環境變數 CHANNEL_ID 符合={ok}"
         return ProbeResult("ydao", ok, msg, extra={"mine_channel_id": my_channel_id})
-    except Exception as e:
+    except (Exception, SystemExit) as e:
+        # SystemExit 來自互動授權逾時/失敗：轉為失敗結果，不讓單一探針中斷整批檢測
         return ProbeResult("ydao", False, f"Data OAuth 失敗: {e.__class__.__name__}: {e}")
 
 
@@ -317,22 +510,19 @@ def probe_ydao(channel_env_id: str, env: Dict[str, str], interactive: bool = Tru
 def verify_consistency(env_channel_id: str, ydao_result: ProbeResult) -> ProbeResult:
     """
     比對 YDAO 回傳的 mine_channel_id 與環境 CHANNEL_ID 是否一致。
+    - probe_ydao 已以 mine == env 判定 ok 並寫入訊息，此處僅轉為 consistency 檢視（無 I/O、無重算），
+      維持 ProbeOutputs 的欄位結構。
     """
-    try:
-        mine = (ydao_result.extra or {}).get("mine_channel_id")
-        ok = bool(mine) and (mine == env_channel_id)
-        msg = f"CHANNEL_ID 一致性 (YDAO mine vs ENV): {ok} (mine={mine}, env={env_channel_id})"
-        return ProbeResult("consistency", ok, msg, extra={"mine": mine, "env": env_channel_id})
-    except Exception as e:
-        return ProbeResult("consistency", False, f"一致性檢查失敗: {e.__class__.__name__}: {e}")
+    return ProbeResult("consistency", ydao_result.ok, ydao_result.message, extra=ydao_result.extra)
 
 
 # =========================
 # 封裝：對外可呼叫 API
 # =========================
-def run_verifications(env: Optional[Dict[str, str]] = None) -> ProbeOutputs:
+def run_verifications(env: Optional[Dict[str, str]] = None, interactive: bool = False) -> ProbeOutputs:
     """
     執行 DB 與 Data API 驗證並回傳結構化結果。
+    - interactive：預設 False（供程式呼叫）；Token 失效時 YDAO 直接回報失敗，不開啟瀏覽器等待授權。
     """
     # 使用 scripts.utils.env.load_settings 統一載入
     local_env = env or load_settings()
@@ -344,10 +534,12 @@ def run_verifications(env: Optional[Dict[str, str]] = None) -> ProbeOutputs:
 
     start_iso, end_iso = iso_date_boundaries(start_date, end_date)
 
-    # 執行 Probe
-    r_ypkg = probe_ypkg(channel_id, start_iso, end_iso, local_env)
-    r_db = test_mysql_connection(db_url)
-    r_ydao = probe_ydao(channel_id, local_env)
+    # 執行 Probe：三個互不相依的 I/O 探針同時進行；一致性檢查依賴 YDAO 結果，待全部完成後再做
+    r_ypkg, r_db, r_ydao = run_probes_concurrently([
+        ("ypkg", lambda: probe_ypkg(channel_id, start_iso, end_iso, local_env)),
+        ("db", lambda: test_mysql_connection(db_url)),
+        ("ydao", lambda: probe_ydao(channel_id, local_env, interactive=interactive)),
+    ])
     r_consistency = verify_consistency(channel_id, r_ydao)
 
     return ProbeOutputs(
@@ -358,12 +550,12 @@ def run_verifications(env: Optional[Dict[str, str]] = None) -> ProbeOutputs:
     )
 
 
-def verify_all(env: Optional[Dict[str, str]] = None) -> Tuple[bool, List[bool]]:
+def verify_all(env: Optional[Dict[str, str]] = None, interactive: bool = False) -> Tuple[bool, List[bool]]:
     """
     提供簡潔的布林結果給其他程式呼叫。
     回傳 flags 順序: [ypkg, db, ydao, consistency]
     """
-    outputs = run_verifications(env)
+    outputs = run_verifications(env, interactive=interactive)
     flags = [
         outputs.ypkg.ok,
         outputs.db.ok,
@@ -380,23 +572,42 @@ def verify_all(env: Optional[Dict[str, str]] = None) -> Tuple[bool, List[bool]]:
 def run_probe(interactive_mode: bool = True) -> None:
     """
     命令列進入點：執行 DB 與 Data API 探針。
+    - 互動模式：逐行即時輸出，使用者可看到進度。
+    - 非互動模式（服務/排程呼叫）：輸出先累積於記憶體，結束時（含失敗拋例外時）單次寫出 stdout。
+    """
+    if interactive_mode:
+        _run_probe(interactive_mode, print)
+        return
+    buf = io.StringIO()
+    try:
+        _run_probe(interactive_mode, partial(print, file=buf))
+    finally:
+        sys.stdout.write(buf.getvalue())
+        sys.stdout.flush()
+
+def _run_probe(interactive_mode: bool, echo: Callable[..., None]) -> None:
+    """
+    run_probe 的主流程；一般輸出經由 echo（print 或寫入緩衝區），警告仍直接寫 stderr。
     """
     import argparse
     if interactive_mode:
         clear_terminal()
     call_mode = "自動模式" if not interactive_mode else "手動模式"
-    print(f"目前互動模式：{call_mode}")
+    echo(f"目前互動模式：{call_mode}")
     # 只有在直接執行此腳本時，才解析 argparse
     # 如果是被 import 呼叫，我們通常希望執行所有檢查
     args_check = "all"
+    pretty = False
     
     # 簡單判斷：如果是從 command line 執行且有參數，才跑 argparse
     # 這樣避免 track_velocity 的參數干擾到這裡
     if __name__ == "__main__":
         parser = argparse.ArgumentParser(description="Run probes for YouTube Data API and DB connectivity.")
         parser.add_argument("--check", choices=["all", "public", "oauth", "db"], default="all")
+        parser.add_argument("--pretty", action="store_true", help="摘要 JSON 以縮排格式輸出（預設緊湊格式）")
         args = parser.parse_args()
         args_check = args.check
+        pretty = args.pretty
 
     # 1. 載入設定 (包含 .env 與系統環境變數)
     env = load_settings()
@@ -413,68 +624,70 @@ def run_probe(interactive_mode: bool = True) -> None:
 
     start_iso, end_iso = iso_date_boundaries(start_date, end_date)
 
-    results: List[ProbeResult] = []
+    # 探針結果：以各自的 name 為鍵（dict 保留插入順序，摘要輸出順序不變）
+    results_map: Dict[str, ProbeResult] = {}
 
-    print("===========================================================================")
-    print("=== 探針設定 (Probes Configuration: DB & Data API) ===")
-    print(f"- 頻道 ID (Channel ID)  : {channel_id}")
-    print(f"- 日期範圍 (Date Range) : {start_date} ~ {end_date}")
-    print(f"- 資料庫主機 (DB Host)  : {db_url.split('@')[-1] if '@' in db_url else db_url}")
-    print(f"- 啟用 YPKG (Public)    : {env.get('YPKG_ENABLE', 'true')}")
-    print(f"- YDAO 權限範圍         : {env.get('YDAO_OAUTH_SCOPES', '(default)')}")
-    print("")
+    echo("===========================================================================")
+    echo("=== 探針設定 (Probes Configuration: DB & Data API) ===")
+    echo(f"- 頻道 ID (Channel ID)  : {channel_id}")
+    echo(f"- 日期範圍 (Date Range) : {start_date} ~ {end_date}")
+    echo(f"- 資料庫主機 (DB Host)  : {db_url.split('@')[-1] if '@' in db_url else db_url}")
+    echo(f"- 啟用 YPKG (Public)    : {env.get('YPKG_ENABLE', 'true')}")
+    echo(f"- YDAO 權限範圍         : {env.get('YDAO_OAUTH_SCOPES', '(default)')}")
+    echo("")
 
-    # 依指令執行
+    # 依指令挑選探針，再同時執行（各探針互不相依）
+    probes: List[Tuple[str, Callable[[], ProbeResult]]] = []
     if args_check in ("all", "public"):
-        print("[1/?] 正在檢測公開 API (YPKG)...")
-        results.append(probe_ypkg(channel_id, start_iso, end_iso, env))
-    
+        echo("[1/?] 正在檢測公開 API (YPKG)...")
+        probes.append(("ypkg", lambda: probe_ypkg(channel_id, start_iso, end_iso, env)))
+
     if args_check in ("all", "db"):
-        print("[?/ ?] 正在測試 MySQL 連線...")
-        results.append(test_mysql_connection(db_url))
-    
+        echo("[?/ ?] 正在測試 MySQL 連線...")
+        probes.append(("db", lambda: test_mysql_connection(db_url)))
+
     if args_check in ("all", "oauth"):
-        print("[?/ ?] 正在檢測 Data API OAuth (YDAO)...")
-        results.append(probe_ydao(channel_id, env, interactive=interactive_mode))
-
-    # 一致性檢查彙整
-    consistency_notes: List[str] = []
-    ydao_res = next((r for r in results if r.name == "ydao"), None)
-    if ydao_res and ydao_res.ok and ydao_res.extra and ydao_res.extra.get("mine_channel_id"):
-        mine_id = ydao_res.extra["mine_channel_id"]
-        consistency_notes.append(f"CHANNEL_ID 一致性 (YDAO mine vs ENV): {mine_id == channel_id} (mine={mine_id}, env={channel_id})")
-    
-    # 摘要輸出
-    print("\n=== 執行摘要 (Summary) ===")
-    for r in results:
-        status = "OK" if r.ok else "FAILED"
-        print(f"- {r.name:>12}: {status} - {r.message}")
+        echo("[?/ ?] 正在檢測 Data API OAuth (YDAO)...")
+        probes.append(("ydao", lambda: probe_ydao(channel_id, env, interactive=interactive_mode)))
+
+    def _on_done(r: ProbeResult) -> None:
+        echo(f"  完成 {r.name:>12}: {'OK' if r.ok else 'FAILED'}")
 
-    for note in consistency_notes:
-        print(f"- Consistency: {note}")
+    for r in run_probes_concurrently(probes, on_result=_on_done):
+        results_map[r.name] = r
 
-    # 將結果輸出到檔案
+    # 摘要輸出（CHANNEL_ID 一致性已包含在 ydao 的結果與訊息中）
+    echo("\n=== 執行摘要 (Summary) ===")
+    for r in results_map.values():
+        status = "OK" if r.ok else "FAILED"
+        echo(f"- {r.name:>12}: {status} - {r.message}")
+
+    # 將結果輸出到檔案：一次序列化成 bytes 後單次寫入暫存檔，再以 os.replace 原子替換，
+    # 讀取端不會看到寫到一半的檔案；預設緊湊格式（--pretty 才縮排）
     summary_path = os.path.join(output_dir, "probe_summary.json")
+    payload = {
+        "results": [asdict(r) for r in results_map.values()],
+        "channel_id_env": channel_id,
+        "date_range": {"start": start_date, "end": end_date},
+    }
     try:
-        with open(summary_path, "w", encoding="utf-8") as f:
-            json.dump(
-                {
-                    "results": [r.__dict__ for r in results],
-                    "consistency": consistency_notes,
-                    "channel_id_env": channel_id,
-                    "date_range": {"start": start_date, "end": end_date},
-                },
-                f,
-                ensure_ascii=False,
-                indent=2,
-            )
-        print(f"\n摘要已儲存至: {summary_path}")
+        if orjson is not None:
+            data = orjson.dumps(payload, option=orjson.OPT_INDENT_2 if pretty else 0)
+        elif pretty:
+            data = json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
+        else:
+            data = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        tmp_path = summary_path + ".tmp"
+        with open(tmp_path, "wb", buffering=256 * 1024) as f:
+            f.write(data)
+        os.replace(tmp_path, summary_path)
+        echo(f"\n摘要已儲存至: {summary_path}")
     except Exception as e:
         print(f"[警告] 寫入摘要檔案失敗: {e}", file=sys.stderr)
     # [新增] 如果是非互動模式，且有任何失敗，應該拋出例外讓外層知道
     # 這樣 track_velocity 才能捕捉到錯誤並決定是否重試
     if not interactive_mode:
-        failures = [r for r in results if not r.ok]
+        failures = [r for r in results_map.values() if not r.ok]
         if failures:
             fail_msg = "; ".join([f"{r.name}: {r.message}" for r in failures])
             raise RuntimeError(f"探針檢測失敗: {fail_msg}")
@@ -512,7 +725,7 @@ def probe_yaao(channel_env_id: str, start_date: str, end_date: str, env: Dict[st
 
     try:
         creds = get_oauth_credentials(scopes, token_path=token_path, client_secret_path=client_path, port=port)
-        analytics = build("youtubeAnalytics", "v2", credentials=creds)
+        analytics = build("youtubeAnalytics", "v2", credentials=creds, static_discovery=True)
 
         # 先用 MINE 查詢一次 views 驗證授權
         analytics.reports().query(
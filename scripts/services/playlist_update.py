@@ -1,20 +1,49 @@
 # scripts/services/playlist_update.py
 # 總覽：
 # - run_update_playlists：一次更新三個播放清單（熱門 Shorts、熱門 VOD、近期熱門），支援 dry-run 與變更限額。
-# - YouTube API 介面：列出、刪除、插入播放清單項目，內建重試與節流。
+# - YouTube API 介面：列出、刪除、插入播放清單項目，內建重試與自適應寫入限速（token bucket，遇 429 降速）；各清單首頁以單一 batch 請求列出，更新以執行緒池並行（client 每執行緒一份）。
 # - 輔助：時間視窗解析、名單差異計算、從設定讀取播放清單 ID、批次操作包裝與指數退避。
 
 from __future__ import annotations
 
+import os
+import json
 import time
+import random
+import threading
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
-from typing import List, Dict, Optional, Tuple, Iterable, Any, Set
+from typing import Callable, List, Dict, Optional, Tuple, Iterable, Any, Set
+from googleapiclient.errors import HttpError
+from sqlalchemy.engine import Connection
 from scripts.db.db import query_top_shorts, query_top_vods, query_poe327, query_new_vods, query_hot_videos
-from scripts.youtube.client import get_youtube_data_client, call_with_retries
+from scripts.youtube.client import get_youtube_data_client, call_with_retries, _retry_after_seconds
 from scripts.ingestion.ya_api import build_ya_client
 from scripts.services.top_videos_query import query_top_videos_from_ya
 
+# 播放清單並行處理的執行緒數（五個清單各一條）
+PLAYLIST_WORKERS = 5
+
+# 寫入（insert/delete）速率上限：平時每秒 8 次、可突發 16 次；遇 429 減半並冷卻 30 秒後逐步回升
+WRITE_RATE_PER_SEC = 8.0
+WRITE_RATE_BURST = 16
+WRITE_RATE_MIN_PER_SEC = 0.5
+WRITE_RATE_COOLDOWN_SEC = 30.0
+
+# 單一 batch HTTP 請求可合併的子請求上限（YouTube Data API 批次上限 50）
+BATCH_MAX_REQUESTS = 50
+
+# 播放清單列表的 ETag 快取檔（位於 OUTPUT_DIR 下）：playlist_id -> {etag, items, fetched_at}
+PLAYLIST_ETAG_CACHE_FILE = "playlist_etag_cache.json"
+
+# playlistItems.list 的 partial response：只取 etag、分頁 token 與 (playlistItemId, videoId)
+PLAYLIST_ITEMS_FIELDS = "etag,nextPageToken,items(id,contentDetails/videoId)"
+
+# batch 子請求遇暫時性錯誤（429/5xx）時，只重送失敗的子請求；最多重送輪數與狀態碼
+BATCH_RETRY_ROUNDS = 5
+BATCH_RETRY_STATUS = {429, 500, 502, 503, 504}
+
 def run_update_playlists(
     channel_id: str,
     dry_run: bool = False,
@@ -22,6 +51,7 @@ def run_update_playlists(
     window_end: Optional[str] = None,
     max_changes_per_playlist: Optional[int] = None,
     settings: Optional[Dict[str, Any]] = None,
+    conn: Optional[Connection] = None,
 ) -> Dict[str, Any]:
     """
     一次更新三個播放清單：
@@ -34,7 +64,8 @@ def run_update_playlists(
       window_start/window_end：指定視窗（YYYY-MM-DD），未提供則預設 D-9~D-2（台北時區）
       max_changes_per_playlist：每個播放清單最大允許新增/刪除數量（None 表示不限制）
       settings：配置來源，需含三個播放清單 ID 與 API 憑證設定
-    - 回傳：包含各清單的 before/target/add/remove 與操作耗時、API 計數等
+      conn：可選的共用 Connection（run_all 借出）；未提供時各查詢使用 get_engine()
+    - 回傳：包含各清單的 before/target/add/remove、changed（各清單是否有變更）、no_change（全部無變更時提前返回）與操作耗時、API 計數等
     """
     started_at = time.time()
 
@@ -62,27 +93,30 @@ def run_update_playlists(
     # - 來自資料庫彙總的 Top shorts / Top VOD 名單（回傳已排序的 video_id 列表）
     # 每日更新組：只在特定時段查詢 DB
     if do_daily_update:
-        target_shorts = query_top_shorts(channel_id, limit=20)
-        target_vods   = query_top_vods(channel_id, limit=10)
-        target_recent = query_hot_videos(channel_id, limit=10)
+        target_shorts = query_top_shorts(channel_id, limit=20, engine=conn)
+        target_vods   = query_top_vods(channel_id, limit=10, engine=conn)
+        target_recent = query_hot_videos(channel_id, limit=10, engine=conn)
     
     # 常態更新組：總是查詢
-    target_new_vods = query_new_vods(channel_id, limit=10)
-    target_poe327   = query_poe327(channel_id)
-
-    # 3) 取得現有播放清單內容（YouTube Data API）
-    # 初始化變數
-    current_shorts, current_vods, current_recent = [], [], []
+    target_new_vods = query_new_vods(channel_id, limit=10, engine=conn)
+    target_poe327   = query_poe327(channel_id, engine=conn)
 
+    # 3) 取得現有播放清單內容（YouTube Data API）；各清單首頁合併為單一 batch 請求列出
+    # 常態更新組：總是呼叫 API
+    to_list = {"poe327": p1_poe327, "new_vods": pl_new_vods}
     # 每日更新組：只在特定時段呼叫 API
     if do_daily_update:
-        current_shorts = yt_list_playlist_video_ids(pl_shorts, settings=settings)
-        current_vods   = yt_list_playlist_video_ids(pl_vods, settings=settings)
-        current_recent = yt_list_playlist_video_ids(pl_recent, settings=settings)
-    
-    # 常態更新組：總是呼叫 API
-    current_poe327   = yt_list_playlist_video_ids(p1_poe327, settings=settings)
-    current_new_vods = yt_list_playlist_video_ids(pl_new_vods, settings=settings)
+        to_list.update(shorts=pl_shorts, vods=pl_vods, recent=pl_recent)
+
+    # 列出時一併取得 playlistItemId，刪除階段直接使用，不必再翻頁查對應
+    current_items = _list_playlists_batched(to_list, settings)
+    current = {label: [vid for vid, _ in items] for label, items in current_items.items()}
+    item_maps = {label: _item_id_map(items) for label, items in current_items.items()}
+    current_shorts = current.get("shorts", [])
+    current_vods   = current.get("vods", [])
+    current_recent = current.get("recent", [])
+    current_poe327   = current["poe327"]
+    current_new_vods = current["new_vods"]
 
     # 4) 計算差異
     add_shorts, del_shorts = [], []
@@ -153,6 +187,17 @@ def run_update_playlists(
         },
     }
 
+    # 各清單是否有變更；無變更的清單不排入執行工作（省下刪除/新增路徑的 API 呼叫）
+    changed = {
+        "shorts": bool(add_shorts or del_shorts),
+        "vods": bool(add_vods or del_vods),
+        "recent": recent_needs_update,
+        "poe327": bool(add_poe327 or del_poe327),
+        "new_vods": bool(add_new_vods or del_new_vods),
+    }
+    result["changed"] = changed
+    result["no_change"] = not any(changed.values())
+
     # Log 輸出
     if do_daily_update:
         print(f"[計畫] shorts 新增={len(add_shorts)} 移除={len(del_shorts)}")
@@ -167,35 +212,41 @@ def run_update_playlists(
     print(f"[計畫] poe327 新增={len(add_poe327)} 移除={len(del_poe327)}")
     print(f"[計畫] new_vods 新增={len(add_new_vods)} 移除={len(del_new_vods)}")
 
-    if dry_run:
+    if dry_run or result["no_change"]:
         result["metrics"]["duration_sec"] = round(time.time() - started_at, 3)
+        if result["no_change"]:
+            print(f"[執行] 所有清單皆無變更，略過更新。")
         return result
 
-    # 7) 執行更新
-    
+    # 7) 執行更新：每個清單一個工作（清單內維持先刪除、後新增），不同清單並行
+    jobs: List[Callable[[], None]] = []
+
     # --- 每日更新組 ---
     if do_daily_update:
         # Shorts
-        _yt_delete_many(pl_shorts, del_shorts, settings, label="shorts")
-        _yt_insert_many(pl_shorts, add_shorts, settings, label="shorts")
+        if changed["shorts"]:
+            jobs.append(lambda: _sync_playlist(pl_shorts, del_shorts, add_shorts, settings, label="shorts", item_id_map=item_maps["shorts"]))
 
         # Vods
-        _yt_delete_many(pl_vods, del_vods, settings, label="vods")
-        _yt_insert_many(pl_vods, add_vods, settings, label="vods")
+        if changed["vods"]:
+            jobs.append(lambda: _sync_playlist(pl_vods, del_vods, add_vods, settings, label="vods", item_id_map=item_maps["vods"]))
 
         # Recent
         if recent_needs_update:
-            _yt_delete_many(pl_recent, current_recent, settings, label="recent-clear")
-            _yt_insert_in_order(pl_recent, target_recent, settings, label="recent-rebuild")
+            def _rebuild_recent() -> None:
+                _yt_delete_many(pl_recent, current_recent, settings, label="recent-clear", item_id_map=item_maps["recent"])
+                _yt_insert_in_order(pl_recent, target_recent, settings, label="recent-rebuild")
+            jobs.append(_rebuild_recent)
         else:
             print(f"[執行] recent 內容一致，跳過更新。")
 
     # --- 常態更新組 (不受時間限制) ---
-    _yt_delete_many(p1_poe327, del_poe327, settings, label="poe327")
-    _yt_insert_many(p1_poe327, add_poe327, settings, label="poe327")
+    if changed["poe327"]:
+        jobs.append(lambda: _sync_playlist(p1_poe327, del_poe327, add_poe327, settings, label="poe327", item_id_map=item_maps["poe327"]))
+    if changed["new_vods"]:
+        jobs.append(lambda: _sync_playlist(pl_new_vods, del_new_vods, add_new_vods, settings, label="new_vods", item_id_map=item_maps["new_vods"]))
 
-    _yt_delete_many(pl_new_vods, del_new_vods, settings, label="new_vods")
-    _yt_insert_many(pl_new_vods, add_new_vods, settings, label="new_vods")
+    _run_concurrently(jobs)
 
     # 8) 回填耗時
     result["metrics"]["duration_sec"] = round(time.time() - started_at, 3)
@@ -222,16 +273,17 @@ def _resolve_window(window_start: Optional[str], window_end: Optional[str], tz:
     return start.isoformat(), end.isoformat()
 
 
-def _diff_sets(target: List[str], current: List[str]) -> Tuple[Set[str], Set[str]]:
+def _diff_sets(target: List[str], current: List[str]) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
     """
-    計算播放清單目標值與目前狀態的集合差異：
-    - 回傳：(需新增的 video_id 集合, 需刪除的 video_id 集合)
+    計算播放清單目標值與目前狀態的差異：
+    - 回傳：(需新增的 video_id, 需刪除的 video_id)；皆為 tuple 並保留輸入順序
+      （新增依目標排名、刪除依清單現況），日誌與結果 JSON 輸出穩定
     """
     tset, cset = set(target), set(current)
-    return tset - cset, cset - tset
+    return tuple(v for v in target if v not in cset), tuple(v for v in current if v not in tset)
 
 
-def _get_playlists_from_settings(settings: Optional[Dict[str, Any]]) -> Tuple[str, str, str]:
+def _get_playlists_from_settings(settings: Optional[Dict[str, Any]]) -> Tuple[str, str, str, str, str]:
     """
     從 settings 讀取三個播放清單 ID，缺一不可。
     需要的 key：
@@ -250,69 +302,382 @@ def _get_playlists_from_settings(settings: Optional[Dict[str, Any]]) -> Tuple[st
         "YT_PLAYLIST_POE327",
         "YT_PLAYLIST_NEWPOST",
     ]
-    missing = [k for k in keys if not str(settings.get(k, "")).strip()]
+    # 單次走訪：取值並去除空白，缺值檢查與回傳共用同一份結果
+    vals = {k: str(settings.get(k, "")).strip() for k in keys}
+    missing = [k for k, v in vals.items() if not v]
     if missing:
         raise ValueError(f"[playlist_update] 缺少必要播放清單 ID：{', '.join(missing)}。請在 .env 或系統環境中設定。")
 
-    pl_shorts = settings["YT_PLAYLIST_SHORTS_TOP"].strip()
-    pl_vods   = settings["YT_PLAYLIST_VODS_TOP"].strip()
-    pl_recent = settings["YT_PLAYLIST_RECENT_HOT"].strip()
-    pl_poe327 = settings["YT_PLAYLIST_POE327"].strip()
-    pl_new_vods = settings["YT_PLAYLIST_NEWPOST"].strip()
-    return pl_shorts, pl_vods, pl_recent, pl_poe327, pl_new_vods
+    # 順序：shorts, vods, recent, poe327, new_vods
+    return tuple(vals[k] for k in keys)
+
+# ------------- 並行執行 -------------
+
+def _list_playlists_batched(playlist_ids: Dict[str, str], settings: Optional[Dict[str, Any]]) -> Dict[str, List[Tuple[str, str]]]:
+    """
+    以單一 batch HTTP 請求同時取得多個播放清單的第一頁（一次往返取代每清單一次）。
+    - playlist_ids：{標籤: playlistId}
+    - 各子請求照常帶 If-None-Match；304 直接使用 ETag 快取內容
+    - 超過一頁（有 nextPageToken）或子請求失敗的清單，個別改走 yt_list_playlist_items 完整翻頁（含重試）
+    - 回傳：{標籤: (videoId, playlistItemId) 列表}
+    """
+    yt = _get_yt(settings)
+    cache_path = _etag_cache_path(settings)
+    etag_cache = _load_etag_cache(cache_path)
+    responses: Dict[str, Any] = {}
+    errors: Dict[str, Exception] = {}
+
+    def _on_response(request_id, response, exception) -> None:
+        if exception is not None:
+            errors[request_id] = exception
+        else:
+            responses[request_id] = response
+
+    batch = yt.new_batch_http_request(callback=_on_response)
+    for label, pid in playlist_ids.items():
+        batch.add(_playlist_items_request(yt, pid, None, (etag_cache.get(pid) or {}).get("etag")), request_id=label)
+    call_with_retries(batch.execute, settings)
+
+    out: Dict[str, List[Tuple[str, str]]] = {}
+    for label, pid in playlist_ids.items():
+        cached = etag_cache.get(pid)
+        err = errors.get(label)
+        if err is not None:
+            if cached and getattr(getattr(err, "resp", None), "status", None) == 304:
+                out[label] = [(vid, item_id) for vid, item_id in cached["items"]]
+            else:
+                out[label] = yt_list_playlist_items(pid, settings)
+            continue
+        resp = responses[label]
+        if resp.get("nextPageToken"):
+            out[label] = yt_list_playlist_items(pid, settings)
+            continue
+        out[label] = _parse_playlist_items_page(resp)
+        if resp.get("etag"):
+            try:
+                _store_etag_entry(cache_path, pid, resp["etag"], out[label])
+            except OSError as e:
+                print(f"[警告] 寫入播放清單 ETag 快取失敗: {e}")
+    return out
+
+def _run_concurrently(jobs: List[Callable[[], None]]) -> None:
+    """
+    以執行緒池並行執行各播放清單的更新工作；全部結束後，若有工作失敗則拋出第一個例外。
+    """
+    if not jobs:
+        return
+    with ThreadPoolExecutor(max_workers=PLAYLIST_WORKERS) as pool:
+        futures = [pool.submit(job) for job in jobs]
+    for f in futures:
+        f.result()
+
+def _item_id_map(items: List[Tuple[str, str]]) -> Dict[str, str]:
+    """
+    由 (videoId, playlistItemId) 列表建立 videoId -> playlistItemId 對應；同一影片重複出現時取第一筆。
+    """
+    mapping: Dict[str, str] = {}
+    for vid, pid in items:
+        mapping.setdefault(vid, pid)
+    return mapping
+
+def _sync_playlist(
+    playlist_id: str,
+    to_delete: Iterable[str],
+    to_add: Iterable[str],
+    settings: Optional[Dict[str, Any]],
+    label: str,
+    item_id_map: Optional[Dict[str, str]] = None,
+) -> None:
+    """
+    單一清單的更新工作：先刪除、後新增（順序不可對調，避免清單短暫超出預期內容）。
+    - item_id_map：列出階段取得的 videoId -> playlistItemId，供刪除直接使用
+    """
+    _yt_delete_many(playlist_id, to_delete, settings, label=label, item_id_map=item_id_map)
+    _yt_insert_many(playlist_id, to_add, settings, label=label)
 
 # ------------- YouTube API 介面（請接到你的實作） -------------
 
+# googleapiclient 的 Resource/httplib2 非執行緒安全：每個執行緒建立並重用自己的 client
+_yt_local = threading.local()
+
+def _get_yt(settings: Optional[Dict[str, Any]]):
+    """
+    取得目前執行緒的 YouTube Data API client；同一執行緒內只載入一次 OAuth 憑證與建立 service。
+    """
+    yt = getattr(_yt_local, "client", None)
+    if yt is None:
+        yt = get_youtube_data_client(settings or {})
+        _yt_local.client = yt
+    return yt
+
+class _AdaptiveRateLimiter:
+    """
+    自適應 token bucket（執行緒安全，各清單工作共用）：
+    - acquire：取用一個 token，不足時等待；平時以 rate 補充、最多累積 burst 個
+    - throttled：收到 429 時速率減半（不低於 min_rate），並進入冷卻期
+    - succeeded：冷卻期過後，每連續成功 10 次速率提高 25%，直到回到初始上限
+    """
+
+    def __init__(self, rate: float, burst: int, min_rate: float, cooldown_sec: float):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.cooldown_sec = cooldown_sec
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._cooldown_until = 0.0
+        self._streak = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self) -> None:
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._tokens = 0.0
+            self._cooldown_until = time.monotonic() + self.cooldown_sec
+            self._streak = 0
+
+    def succeeded(self) -> None:
+        with self._lock:
+            if self.rate >= self.max_rate or time.monotonic() < self._cooldown_until:
+                return
+            self._streak += 1
+            if self._streak >= 10:
+                self.rate = min(self.max_rate, self.rate * 1.25)
+                self._streak = 0
+
+_write_limiter = _AdaptiveRateLimiter(WRITE_RATE_PER_SEC, WRITE_RATE_BURST, WRITE_RATE_MIN_PER_SEC, WRITE_RATE_COOLDOWN_SEC)
+
+def _is_rate_limited(err: Exception) -> bool:
+    return isinstance(err, HttpError) and getattr(getattr(err, "resp", None), "status", None) == 429
+
+def _limited_call(fn: Callable[[], Any]) -> Any:
+    """
+    經寫入限速器執行一次 API 寫入呼叫（供 call_with_retries 包裝，每次重試都會取 token）；
+    429 時通知限速器降速後照常拋出，交由外層重試。
+    """
+    _write_limiter.acquire()
+    try:
+        result = fn()
+    except Exception as e:
+        if _is_rate_limited(e):
+            _write_limiter.throttled()
+        raise
+    _write_limiter.succeeded()
+    return result
+
+def _is_transient_write_error(err: Exception) -> bool:
+    return isinstance(err, HttpError) and getattr(getattr(err, "resp", None), "status", None) in BATCH_RETRY_STATUS
+
+def _execute_in_batches(yt, requests: List[Any], settings: Optional[Dict[str, Any]], idempotent: bool = True) -> int:
+    """
+    以 batch HTTP 端點送出多個子請求：每 BATCH_MAX_REQUESTS 個合併為一次往返，每批經寫入限速器取 token。
+    - 子請求以 request_id 標記，結果由 callback 收集；單一子請求失敗不影響其他子請求與後續批次
+    - 暫時性錯誤（429/5xx）的子請求於本輪全部送完後，以 decorrelated jitter 退避（有 Retry-After 時至少等該值）
+      再只重送這些子請求，最多 BATCH_RETRY_ROUNDS 輪；已成功的子請求不會重送（避免重複插入）
+    - 子請求回報 429 時通知限速器降速
+    - idempotent=False（例如 playlistItems.insert）：整批往返層級的錯誤（逾時、連線中斷）不重送整批，
+      因已成功的子請求會再被執行一次而產生重複項目；直接拋出，由上層重新比對清單差異後再處理
+    - 全部處理完後，若仍有失敗（非暫時性錯誤或重送用盡），拋出第一個錯誤
+    回傳：成功的子請求數
+    """
+    succeeded = 0
+    pending: Dict[str, Any] = {str(i): req for i, req in enumerate(requests)}
+    failed: Dict[str, Exception] = {}
+    errors: List[Exception] = []
+
+    def _on_response(request_id, response, exception) -> None:
+        nonlocal succeeded
+        if exception is not None:
+            failed[request_id] = exception
+            if _is_rate_limited(exception):
+                _write_limiter.throttled()
+        else:
+            succeeded += 1
+
+    prev_delay = 1.0
+    for round_no in range(1, BATCH_RETRY_ROUNDS + 1):
+        failed.clear()
+        ids = list(pending)
+        for i in range(0, len(ids), BATCH_MAX_REQUESTS):
+            batch = yt.new_batch_http_request(callback=_on_response)
+            for rid in ids[i:i + BATCH_MAX_REQUESTS]:
+                batch.add(pending[rid], request_id=rid)
+            if idempotent:
+                call_with_retries(lambda: _limited_call(batch.execute), settings)
+            else:
+                _limited_call(batch.execute)
+
+        retryable = {rid: e for rid, e in failed.items() if _is_transient_write_error(e)}
+        errors.extend(e for rid, e in failed.items() if rid not in retryable)
+        if not retryable:
+            break
+        if round_no == BATCH_RETRY_ROUNDS:
+            errors.extend(retryable.values())
+            break
+
+        pending = {rid: pending[rid] for rid in retryable}
+        delay = min(32.0, random.uniform(1.0, prev_delay * 3))
+        retry_after = max((ra for ra in map(_retry_after_seconds, retryable.values()) if ra is not None), default=None)
+        if retry_after is not None:
+            delay = min(32.0, max(delay, retry_after))
+        prev_delay = delay
+        print(f"[警告] batch 子請求 {len(pending)} 筆暫時失敗（第 {round_no} 輪）；將於 {delay:.1f}秒後只重送失敗項目")
+        time.sleep(delay)
+
+    if errors:
+        print(f"[錯誤] batch 子請求共 {len(errors)} 筆失敗（成功 {succeeded} 筆）")
+        raise errors[0]
+    return succeeded
+
+# ETag 快取檔的讀改寫鎖（各清單工作在不同執行緒）
+_etag_cache_lock = threading.Lock()
+
+def _etag_cache_path(settings: Optional[Dict[str, Any]]) -> str:
+    return os.path.join((settings or {}).get("OUTPUT_DIR") or "data", PLAYLIST_ETAG_CACHE_FILE)
+
+def _load_etag_cache(path: str) -> Dict[str, Dict[str, Any]]:
+    """
+    讀取 ETag 快取檔；不存在或內容損毀時視為空快取。
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _store_etag_entry(path: str, playlist_id: str, etag: str, items: List[Tuple[str, str]]) -> None:
+    """
+    更新單一播放清單的 ETag 快取（讀改寫於鎖內，寫暫存檔後 os.replace 原子替換）。
+    """
+    with _etag_cache_lock:
+        cache = _load_etag_cache(path)
+        cache[playlist_id] = {
+            "etag": etag,
+            "items": items,
+            "fetched_at": datetime.now(timezone.utc).isoformat(),
+        }
+        dir_ = os.path.dirname(path)
+        if dir_:
+            os.makedirs(dir_, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
 def yt_list_playlist_video_ids(playlist_id: str, settings: Optional[Dict[str, Any]] = None) -> List[str]:
     """
-    使用 OAuth 的 YouTube Data API v3 列出指定播放清單中的 videoId。
-    - 以 50 筆為一頁分頁抓取，串接所有頁面
-    - 內建輕量節流與 call_with_retries 包裝
-    回傳：video_id 的列表（依清單目前順序）
+    列出指定播放清單中的 videoId（依清單目前順序）；yt_list_playlist_items 的精簡版。
+    """
+    return [vid for vid, _ in yt_list_playlist_items(playlist_id, settings)]
+
+def _playlist_items_request(yt, playlist_id: str, page_token: Optional[str], etag: Optional[str]):
+    """
+    建立 playlistItems.list 請求（尚未執行）；etag 有值時附上 If-None-Match。
+    """
+    req = yt.playlistItems().list(
+        part="id,contentDetails",
+        playlistId=playlist_id,
+        maxResults=50,
+        pageToken=page_token,
+        fields=PLAYLIST_ITEMS_FIELDS,
+    )
+    if etag:
+        req.headers["If-None-Match"] = etag
+    return req
+
+def _parse_playlist_items_page(resp: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """
+    從 playlistItems.list 單頁回應取出 (videoId, playlistItemId)；缺任一欄位的項目略過。
+    """
+    out: List[Tuple[str, str]] = []
+    for it in resp.get("items", []):
+        vid = (it.get("contentDetails") or {}).get("videoId")
+        pid = it.get("id")
+        if vid and pid:
+            out.append((vid, pid))
+    return out
+
+def yt_list_playlist_items(playlist_id: str, settings: Optional[Dict[str, Any]] = None) -> List[Tuple[str, str]]:
+    """
+    使用 OAuth 的 YouTube Data API v3 列出指定播放清單中的項目 (videoId, playlistItemId)。
+    - 以 50 筆為一頁分頁抓取，串接所有頁面；下一頁依賴本頁 nextPageToken，無法並行預抓，
+      改以 fields 只取所需欄位縮小每頁回應，並移除頁間固定等待（限流由 call_with_retries 的 429 退避處理）
+    - ETag 快取：單頁即可列完的清單會記錄回應 etag；下次以 If-None-Match 請求，
+      收到 304（清單未變動）直接回傳快取內容，不再重抓。多頁清單不快取（只比對第一頁無法確認後續頁未變）。
+    回傳：(video_id, playlist_item_id) 的列表（依清單目前順序）
     """
-    yt = get_youtube_data_client(settings or {})
-    out: List[str] = []
+    yt = _get_yt(settings)
+    cache_path = _etag_cache_path(settings)
+    cached = _load_etag_cache(cache_path).get(playlist_id)
+    out: List[Tuple[str, str]] = []
     page_token: Optional[str] = None
+    first_etag: Optional[str] = None
+    pages = 0
 
     while True:
         def _call():
-            return yt.playlistItems().list(
-                part="contentDetails",
-                playlistId=playlist_id,
-                maxResults=50,
-                pageToken=page_token
-            ).execute()
+            etag = cached["etag"] if page_token is None and cached else None
+            return _playlist_items_request(yt, playlist_id, page_token, etag).execute()
 
-        resp = call_with_retries(_call, settings)
-        for it in resp.get("items", []):
-            vid = (it.get("contentDetails") or {}).get("videoId")
-            if vid:
-                out.append(vid)
+        try:
+            resp = call_with_retries(_call, settings)
+        except HttpError as e:
+            if page_token is None and cached and getattr(getattr(e, "resp", None), "status", None) == 304:
+                return [(vid, pid) for vid, pid in cached["items"]]
+            raise
+        pages += 1
+        if page_token is None:
+            first_etag = resp.get("etag")
+        out.extend(_parse_playlist_items_page(resp))
 
         page_token = resp.get("nextPageToken")
         if not page_token:
             break
-        time.sleep(0.05)  # 輕量節流，降低 QPS 波動
+
+    if pages == 1 and first_etag:
+        try:
+            _store_etag_entry(cache_path, playlist_id, first_etag, out)
+        except OSError as e:
+            print(f"[警告] 寫入播放清單 ETag 快取失敗: {e}")
 
     return out
 
 
-def yt_delete_playlist_items(playlist_id: str, video_ids: Iterable[str], settings: Optional[Dict[str, Any]] = None) -> int:
+def yt_delete_playlist_items(
+    playlist_id: str,
+    video_ids: Iterable[str],
+    settings: Optional[Dict[str, Any]] = None,
+    item_id_map: Optional[Dict[str, str]] = None,
+) -> int:
     """
     依據 videoId 找到對應的 playlistItemId，逐一刪除。
     - 先建立 videoId -> playlistItemId 的對應表，再呼叫 delete
+    - item_id_map：呼叫端已有的對應表（例如列出清單時取得）；提供時略過翻頁查詢
     - 針對找不到對應項目的 videoId 會略過
     回傳：刪除成功的筆數
     """
-    yt = get_youtube_data_client(settings or {})
+    yt = _get_yt(settings)
     targets: Set[str] = set(video_ids)
     if not targets:
         return 0
 
-    # 先建立 videoId -> playlistItemId 對應
-    video_to_item: Dict[str, str] = {}
+    # 先建立 videoId -> playlistItemId 對應（未提供對應表時才翻頁查詢）
+    video_to_item: Dict[str, str] = dict(item_id_map) if item_id_map is not None else {}
     page_token: Optional[str] = None
-    while True:
+    while item_id_map is None:
         def _call():
             return yt.playlistItems().list(
                 part="id,contentDetails",
@@ -335,21 +700,9 @@ def yt_delete_playlist_items(playlist_id: str, video_ids: Iterable[str], setting
         if not page_token or len(video_to_item) == len(targets):
             break
 
-    # 執行刪除
-    deleted = 0
-    for vid in targets:
-        pid = video_to_item.get(vid)
-        if not pid:
-            continue
-
-        def _call_del():
-            return yt.playlistItems().delete(id=pid).execute()
-
-        call_with_retries(_call_del, settings)
-        deleted += 1
-        time.sleep(0.3)  # 溫和節流，避免 QPS 突刺
-
-    return deleted
+    # 執行刪除：合併為 batch 請求（每批最多 50 筆）
+    requests = [yt.playlistItems().delete(id=pid) for vid in targets if (pid := video_to_item.get(vid))]
+    return _execute_in_batches(yt, requests, settings)
 
 
 def yt_insert_playlist_items(playlist_id: str, video_ids: Iterable[str], settings: Optional[Dict[str, Any]] = None, ordered: bool = False) -> int:
@@ -357,10 +710,21 @@ def yt_insert_playlist_items(playlist_id: str, video_ids: Iterable[str], setting
     插入指定 videoIds 到播放清單。
     - ordered=False：維持 YouTube 預設插入至清單尾端
     - ordered=True：依傳入順序以 position 指定插入順序（index 0 開頭）
-    - 逐一插入並於每次呼叫之間加入節流
+    - unordered：合併為 batch 請求（每批最多 50 筆）；ordered：batch 內子請求的執行順序不保證，
+      故仍逐一插入（經寫入限速器，只在遇到 429 時降速）
     回傳：新增成功的筆數
     """
-    yt = get_youtube_data_client(settings or {})
+    yt = _get_yt(settings)
+    if not ordered:
+        requests = [
+            yt.playlistItems().insert(
+                part="snippet",
+                body={"snippet": {"playlistId": playlist_id, "resourceId": {"kind": "youtube#video", "videoId": vid}}},
+            )
+            for vid in video_ids
+        ]
+        return _execute_in_batches(yt, requests, settings, idempotent=False)
+
     count = 0
 
     for idx, vid in enumerate(video_ids):
@@ -368,46 +732,58 @@ def yt_insert_playlist_items(playlist_id: str, video_ids: Iterable[str], setting
             "snippet": {
                 "playlistId": playlist_id,
                 "resourceId": {"kind": "youtube#video", "videoId": vid},
+                "position": idx,  # 指定插入位置，維持與輸入順序一致
             }
         }
-        if ordered:
-            body["snippet"]["position"] = idx  # 指定插入位置，維持與輸入順序一致
 
         def _call_ins():
-            return yt.playlistItems().insert(part="snippet", body=body).execute()
+            return _limited_call(yt.playlistItems().insert(part="snippet", body=body).execute)
 
         call_with_retries(_call_ins, settings)
         count += 1
-        time.sleep(0.3)  # 溫和節流，降低 API 壓力
 
     return count
 
 
 # ------------- YouTube API 包裝（重試/計數） -------------
 
-def _yt_delete_many(playlist_id: str, video_ids: Iterable[str], settings: Optional[Dict[str, Any]], label: str) -> None:
+def _yt_delete_many(
+    playlist_id: str,
+    video_ids: Iterable[str],
+    settings: Optional[Dict[str, Any]],
+    label: str,
+    item_id_map: Optional[Dict[str, str]] = None,
+) -> None:
     """
     批次刪除封裝：打印摘要、空集合快速返回、失敗採指數退避重試。
     - label：用於日誌區分清單種類
+    - item_id_map：只用於第一次嘗試；重試時部分項目可能已刪除，改為重新查詢對應
     """
     video_ids = list(video_ids)
     if not video_ids:
         print(f"[{label}] 無須刪除")
         return
     print(f"[{label}] 刪除數量={len(video_ids)}")
-    _retry(lambda: yt_delete_playlist_items(playlist_id, video_ids, settings), op=f"{label}-delete")
+    maps = [item_id_map]
+
+    def _attempt() -> int:
+        return yt_delete_playlist_items(playlist_id, video_ids, settings, item_id_map=maps.pop() if maps else None)
+
+    _retry(_attempt, op=f"{label}-delete")
 
 def _yt_insert_many(playlist_id: str, video_ids: Iterable[str], settings: Optional[Dict[str, Any]], label: str) -> None:
     """
-    批次新增封裝：打印摘要、空集合快速返回、失敗採指數退避重試。
+    批次新增封裝：打印摘要、空集合快速返回。
     - 以預設 unordered 模式插入（清單尾端）
+    - 不以 _retry 整批重試：插入非冪等，整批重送會讓已成功的影片重複加入；
+      暫時性錯誤已由 _execute_in_batches 只針對失敗的子請求重送
     """
     video_ids = list(video_ids)
     if not video_ids:
         print(f"[{label}] 無須新增")
         return
     print(f"[{label}] 新增數量={len(video_ids)}")
-    _retry(lambda: yt_insert_playlist_items(playlist_id, video_ids, settings, ordered=False), op=f"{label}-insert")
+    yt_insert_playlist_items(playlist_id, video_ids, settings, ordered=False)
 
 def _yt_insert_in_order(playlist_id: str, ordered_video_ids: List[str], settings: Optional[Dict[str, Any]], label: str) -> None:
     """
@@ -420,19 +796,22 @@ def _yt_insert_in_order(playlist_id: str, ordered_video_ids: List[str], settings
     print(f"[{label}] 重建寫入數量={len(ordered_video_ids)} (已排序)")
     _retry(lambda: yt_insert_playlist_items(playlist_id, ordered_video_ids, settings, ordered=True), op=f"{label}-rebuild-insert")
 
-def _retry(fn, op: str, max_attempts: int = 5, base_delay: float = 1.0):
+def _retry(fn, op: str, max_attempts: int = 5, base_delay: float = 1.0, max_delay: float = 32.0):
     """
-    對 API 操作做指數退避重試：等待序列 1s, 2s, 4s, 8s, 16s。
+    對 API 操作做退避重試，採 decorrelated jitter：delay = min(max_delay, uniform(base_delay, prev * 3))。
     - fn：要執行的可呼叫物件
     - op：操作名稱（用於日誌）
     - max_attempts：最大嘗試次數（預設 5）
-    - base_delay：初始等待秒數（預設 1.0）
+    - base_delay：最短等待秒數（預設 1.0）
+    - max_delay：單次等待上限秒數（預設 32.0）
     行為：
       1) 立即嘗試執行
-      2) 失敗則打印警告並等待 2^(n-1) 倍的 base_delay
-      3) 直至成功或達到最大次數，最後一次失敗會拋出例外
+      2) 失敗則打印警告並等待隨機化的退避時間；多個清單工作同時遇到 429/5xx 時不會同步重試、反覆碰撞
+      3) 若回應帶有 Retry-After，等待時間至少為該值（仍受 max_delay 限制）
+      4) 直至成功或達到最大次數，最後一次失敗會拋出例外
     """
     attempt = 0
+    prev = base_delay
     while True:
         try:
             return fn()
@@ -441,6 +820,10 @@ def _retry(fn, op: str, max_attempts: int = 5, base_delay: float = 1.0):
             if attempt >= max_attempts:
                 print(f"[錯誤] {op} 在嘗試 {attempt} 次後失敗: {e}")
                 raise
-            delay = base_delay * (2 ** (attempt - 1))
+            delay = min(max_delay, random.uniform(base_delay, prev * 3))
+            retry_after = _retry_after_seconds(e)
+            if retry_after is not None:
+                delay = min(max_delay, max(delay, retry_after))
+            prev = delay
             print(f"[警告] {op} 第 {attempt} 次嘗試失敗: {e}; 將於 {delay:.1f}秒後重試")
-            time.sleep(delay)
\ No newline at end of file
+            time.sleep(delay)
@@ -1,43 +1,63 @@
 import requests
 import pymysql
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from datetime import datetime, timedelta, date, timezone
+from functools import lru_cache
 from dateutil.relativedelta import relativedelta
 from scripts.db.db import get_engine
-from sqlalchemy import text, bindparam
+from sqlalchemy import text
+
+# Discord Webhook 共用連線：Keep-Alive + 連線池，各分類看板更新重用同一條 TLS 連線
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=0))
+# (連線逾時, 讀取逾時) 秒數，避免連線卡住
+DISCORD_TIMEOUT = (3.05, 10)
+
+# 各次更新共用的 SQL 於模組載入時建立一次，不在每次呼叫時重新組字串與建立 text()
+_SQL_GET_DASHBOARD_STATUS = text("SELECT message_id FROM discord_ranking_dashboard WHERE category = :category")
+
+_SQL_UPSERT_DASHBOARD_STATUS = text("""
+    INSERT INTO discord_ranking_dashboard (category, message_id)
+    VALUES (:category, :msg_id)
+    ON DUPLICATE KEY UPDATE message_id = VALUES(message_id)
+""")
+
+# 以 captured_at 為首欄的索引（idx_fvv_captured_video）由大到小走索引分組，讀到兩個相異值即停止，不需全表掃描與排序
+_SQL_LATEST_CAPTURES = text("SELECT captured_at FROM fact_video_velocity GROUP BY captured_at ORDER BY captured_at DESC LIMIT 2")
 
 def get_dashboard_status(conn, category):
     """查詢特定榜單目前的 Message ID"""
-    sql = text("SELECT message_id FROM discord_ranking_dashboard WHERE category = :category")
-    result = conn.execute(sql, {"category": category}).fetchone()
+    result = conn.execute(_SQL_GET_DASHBOARD_STATUS, {"category": category}).fetchone()
     if result and result[0]:
         return result[0]
     return None
 
+def _read_dashboard_status(engine, category):
+    """以獨立連線查詢 Message ID（Connection 不可跨執行緒共用），供與排行榜查詢並行"""
+    with engine.connect() as conn:
+        return get_dashboard_status(conn, category)
+
 def update_dashboard_status(conn, category, msg_id):
     """
-    更新資料庫中的 Message ID。
+    寫入資料庫中的 Message ID（單一 upsert：分類列不存在時新增，存在時更新）。
     last_updated_at 會由 MySQL 的 ON UPDATE CURRENT_TIMESTAMP 自動維護，
     所以這裡不需要寫入時間。
     """
-    sql = text("""
-        UPDATE discord_ranking_dashboard 
-        SET message_id = :msg_id
-        WHERE category = :category
-    """)
-    conn.execute(sql, {"msg_id": msg_id, "category": category})
+    conn.execute(_SQL_UPSERT_DASHBOARD_STATUS, {"msg_id": msg_id, "category": category})
     conn.commit()
 
 def get_time_ranges(conn, category):
     """
     根據分類計算「本期」與「上期」的時間範圍
+    - 15min 依資料庫最新時間點，每次查詢；其餘分類交由 _compute_ranges（依期間快取）
     回傳: (curr_start, curr_end, prev_start, prev_end, period_name)
     """
     now = datetime.now(timezone.utc).replace(tzinfo=None)
     
     if category == '15min':
-        # 15min: 直接抓取資料庫中最新的兩個 captured_at 時間點
-        sql = text("SELECT DISTINCT captured_at FROM fact_video_velocity ORDER BY captured_at DESC LIMIT 2")
-        rows = conn.execute(sql).fetchall()
+        # 15min: 直接抓取資料庫中最新的兩個 captured_at 時間點（走索引，見 _SQL_LATEST_CAPTURES）
+        rows = conn.execute(_SQL_LATEST_CAPTURES).fetchall()
         
         if not rows:
             raise ValueError("資料庫中沒有任何數據")
@@ -62,9 +82,36 @@ def get_time_ranges(conn, category):
         return curr_time, curr_time, prev_time, prev_time, f"最新數據 ({display_time})"
 
     elif category == 'hourly':
+        # 小時榜: 以本小時整點為快取鍵
+        anchor = now.replace(minute=0, second=0, microsecond=0)
+    elif category == 'daily':
+        # 日榜: 以今天 00:00 為快取鍵
+        anchor = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    elif category == 'weekly':
+        # 周榜: 以本周一為快取鍵
+        today = now.today()
+        anchor = (today - timedelta(days=today.weekday())).date()
+    elif category == 'monthly':
+        # 月榜: 以本月 1 號為快取鍵
+        today = now.today()
+        anchor = date(today.year, today.month, 1)
+    else:
+        raise ValueError(f"未知的分類: {category}")
+
+    return _compute_ranges(category, anchor)
+
+@lru_cache(maxsize=64)
+def _compute_ranges(category, anchor):
+    """
+    依分類與期間起點 (anchor) 計算「本期」與「上期」的時間範圍；結果只在跨小時/日/周/月時改變，以 lru_cache 快取。
+    - anchor 由 get_time_ranges 依目前時間截斷而得（同一期間內的每次呼叫鍵值相同）
+    - 時區設定改變需重新啟動程序才會使快取失效
+    回傳: (curr_start, curr_end, prev_start, prev_end, period_name)
+    """
+    if category == 'hourly':
         # 小時榜: 本小時 (XX:00:00 ~ XX:59:59) vs 上一小時完整區間
         # 例如現在 07:34，curr 就是 07:00:00 ~ 07:59:59
-        curr_start = now.replace(minute=0, second=0, microsecond=0)
+        curr_start = anchor
         # 設定為本小時的最後一秒 (例如 07:59:59)
         curr_end = curr_start + timedelta(hours=1) - timedelta(seconds=1)
         
@@ -76,7 +123,7 @@ def get_time_ranges(conn, category):
 
     elif category == 'daily':
         # 日榜: 今天 (00:00:00 ~ 23:59:59) vs 昨天整天
-        curr_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        curr_start = anchor
         # 設定為今天的最後一秒
         curr_end = curr_start + timedelta(days=1) - timedelta(seconds=1)
         
@@ -86,9 +133,7 @@ def get_time_ranges(conn, category):
 
     elif category == 'weekly':
         # 周榜: 本周 (周一 00:00 ~ 周日 23:59) vs 上周
-        today = now.today()
-        start_of_week = today - timedelta(days=today.weekday()) # Monday
-        curr_start = datetime.combine(start_of_week, datetime.min.time())
+        curr_start = datetime.combine(anchor, datetime.min.time())
         # 設定為本週日的最後一秒 (週一 + 7天 - 1秒)
         curr_end = curr_start + timedelta(weeks=1) - timedelta(seconds=1)
         
@@ -98,15 +143,14 @@ def get_time_ranges(conn, category):
 
     elif category == 'monthly':
         # 月榜: 本月 (1號 ~ 月底) vs 上個月整月
-        today = now.today()
-        curr_start = datetime(today.year, today.month, 1)
+        curr_start = datetime(anchor.year, anchor.month, 1)
         
         # 計算下個月1號，再減1秒即為本月月底
         next_month = curr_start + relativedelta(months=1)
         curr_end = next_month - timedelta(seconds=1)
         
         # 上個月
-        prev_month_date = today - relativedelta(months=1)
+        prev_month_date = anchor - relativedelta(months=1)
         prev_start = datetime(prev_month_date.year, prev_month_date.month, 1)
         # 上個月底 = 本月1號 - 1秒
         prev_end = curr_start - timedelta(seconds=1)
@@ -115,178 +159,140 @@ def get_time_ranges(conn, category):
     else:
         raise ValueError(f"未知的分類: {category}")
 
+# 排行榜查詢：單一查詢同時彙總本期與上期（條件式聚合），取本期 Top 10 (根據 delta_views)
+# 固定字串、只建立一次 TextClause，每次執行重用同一 SQL（不再有依 IN 列表長度變動的展開參數）
+# 使用 SUM 聚合，這樣無論是 15min (單點) 還是 hourly (區間) 都能適用；
+# 掃描範圍為兩期的聯集 (上期起 ~ 本期迄)，各指標以 CASE 分別歸入本期/上期
+_SQL_RANKING_TOP = text("""
+    SELECT 
+        v.video_id, 
+        v.video_title,
+        v.is_short,
+        a.curr_views,
+        a.curr_likes,
+        a.curr_comments,
+        a.prev_views,
+        a.prev_likes,
+        a.prev_comments
+    FROM (
+        SELECT
+            video_id,
+            SUM(CASE WHEN captured_at BETWEEN :curr_start AND :curr_end THEN delta_views ELSE 0 END) AS curr_views,
+            SUM(CASE WHEN captured_at BETWEEN :curr_start AND :curr_end THEN delta_likes ELSE 0 END) AS curr_likes,
+            SUM(CASE WHEN captured_at BETWEEN :curr_start AND :curr_end THEN delta_comments ELSE 0 END) AS curr_comments,
+            SUM(CASE WHEN captured_at BETWEEN :prev_start AND :prev_end THEN delta_views ELSE 0 END) AS prev_views,
+            SUM(CASE WHEN captured_at BETWEEN :prev_start AND :prev_end THEN delta_likes ELSE 0 END) AS prev_likes,
+            SUM(CASE WHEN captured_at BETWEEN :prev_start AND :prev_end THEN delta_comments ELSE 0 END) AS prev_comments
+        FROM fact_video_velocity
+        WHERE captured_at >= :prev_start AND captured_at <= :curr_end
+        GROUP BY video_id
+        HAVING curr_views > 0
+    ) a
+    JOIN dim_video v ON a.video_id = v.video_id
+    ORDER BY a.curr_views DESC
+    LIMIT 10
+""")
+
 def get_ranking_data(conn, category):
     """取得排行榜數據"""
     # 1. 取得時間範圍
     curr_start, curr_end, prev_start, prev_end, period_desc = get_time_ranges(conn, category)
 
-    # 2. Step 1: 抓取本期 Top 10 (根據 delta_views)
-    # 使用 SUM 聚合，這樣無論是 15min (單點) 還是 hourly (區間) 都能適用
-    sql_top = text("""
-        SELECT 
-            v.video_id, 
-            v.video_title,
-            v.is_short,
-            SUM(f.delta_views) as curr_views,
-            SUM(f.delta_likes) as curr_likes,
-            SUM(f.delta_comments) as curr_comments            
-        FROM fact_video_velocity f
-        JOIN dim_video v ON f.video_id = v.video_id
-        WHERE f.captured_at >= :curr_start AND f.captured_at <= :curr_end
-        GROUP BY v.video_id, v.video_title
-        HAVING curr_views > 0
-        ORDER BY curr_views DESC
-        LIMIT 10
-    """)
-    
-    top_rows = conn.execute(sql_top, {
+    # 2. 取本期 Top 10 並帶出上期數據（SQL 見 _SQL_RANKING_TOP）
+    top_rows = conn.execute(_SQL_RANKING_TOP, {
         "curr_start": curr_start, 
-        "curr_end": curr_end
+        "curr_end": curr_end,
+        "prev_start": prev_start,
+        "prev_end": prev_end,
     }).fetchall()
 
     if not top_rows:
         return [], period_desc
 
-    # 3. 整理 Step 1 的結果，並準備 ID 列表給 Step 2
-    video_ids = []
-    ranking_map = {}
-    
-    for row in top_rows:
-        vid = row[0]
-        video_ids.append(vid)
-        ranking_map[vid] = {
-            "video_id": vid,
-            "title": row[1],
-            "is_short": row[2],      # 補上 is_short
-            "curr_views": row[3],
-            "curr_likes": row[4],
-            "curr_comments": row[5],
-            "prev_views": 0,
-            "prev_likes": 0,
-            "prev_comments": 0
-        }
-
-    # 4. Step 2: 根據 ID 抓取上期數據
-    # 使用 bindparam(expanding=True) 來處理 IN 列表
-    sql_prev = text("""
-        SELECT 
-            video_id,
-            SUM(delta_views) as prev_views,
-            SUM(delta_likes) as prev_likes,
-            SUM(delta_comments) as prev_comments
-        FROM fact_video_velocity
-        WHERE captured_at >= :prev_start 
-          AND captured_at <= :prev_end
-          AND video_id IN :vids
-        GROUP BY video_id
-    """).bindparams(bindparam('vids', expanding=True))
-
-    prev_rows = conn.execute(sql_prev, {
-        "prev_start": prev_start,
-        "prev_end": prev_end,
-        "vids": video_ids
-    }).fetchall()
-
-    # 5. Step 3: 合併數據
-    for row in prev_rows:
-        vid = row[0]
-        if vid in ranking_map:
-            ranking_map[vid]["prev_views"] = row[1]
-            ranking_map[vid]["prev_likes"] = row[2]
-            ranking_map[vid]["prev_comments"] = row[3]
+    # 輔助函式：計算 diff 和 pct
+    def calc_metrics(curr, prev):
+        diff = curr - prev
+        if prev == 0:
+            pct = 100.0 if curr > 0 else 0.0
+        else:
+            pct = ((curr - prev) / prev) * 100
+        return {"curr": curr, "diff": diff, "pct": pct}
 
-    # 6. Step 4: 計算差異與百分比，並輸出最終列表
+    # 3. 計算差異與百分比，並輸出最終列表（依查詢排序輸出，確保排名正確）
     final_list = []
-    
-    # 依照 Step 1 的順序 (video_ids) 輸出，確保排名正確
-    for vid in video_ids:
-        data = ranking_map[vid]
-        
-        # 輔助函式：計算 diff 和 pct
-        def calc_metrics(curr, prev):
-            diff = curr - prev
-            if prev == 0:
-                pct = 100.0 if curr > 0 else 0.0
-            else:
-                pct = ((curr - prev) / prev) * 100
-            return {"curr": curr, "diff": diff, "pct": pct}
-
+    for row in top_rows:
         final_list.append({
-            "video_id": data["video_id"],
-            "title": data["title"],
-            "is_short": data["is_short"], 
+            "video_id": row[0],
+            "title": row[1],
+            "is_short": row[2], 
             "metrics": {
-                "views": calc_metrics(data["curr_views"], data["prev_views"]),
-                "likes": calc_metrics(data["curr_likes"], data["prev_likes"]),
-                "comments": calc_metrics(data["curr_comments"], data["prev_comments"])
+                "views": calc_metrics(row[3], row[6]),
+                "likes": calc_metrics(row[4], row[7]),
+                "comments": calc_metrics(row[5], row[8])
             }
         })
 
     return final_list, period_desc
 
+RANK_EMOJIS = ("🥇", "🥈", "🥉", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "🔟")
+
+# 影片連結前綴：Shorts 用 /shorts/，一般影片用 youtu.be
+_VIDEO_URL_PREFIX = {True: "https://youtube.com/shorts/", False: "https://youtu.be/"}
+
+def _fmt_stat(data):
+    """格式化單一指標：本期數值，若與上期有差異再附上趨勢、差異值與百分比"""
+    curr = data['curr']
+    diff = data['diff']
+    pct = data['pct']
+    
+    base_str = f"+{curr:,}"
+    
+    if diff == 0:
+        return base_str
+    
+    trend = "📈" if diff > 0 else "📉"
+    diff_sign = "+" if diff > 0 else ""
+    
+    return f"本期數據：{base_str} (趨勢：{trend}，差異值：{diff_sign}{diff:,}，差異百分比：{diff_sign}{pct:.0f}%)"
+
 def format_discord_message(category, period_desc, top_videos):
     """
     將數據格式化為 Discord 訊息內容
+    - 以片段列表累積、最後一次 join，避免迴圈中反覆串接字串
     """
     if not top_videos:
         return f"**📊 YouTube 流量飆升榜 - {period_desc}**\n目前沒有數據變化。"
         
     # 定義 UTC+8 時區
     tz_taipei = timezone(timedelta(hours=8))
-    msg = f"**📊 YouTube 流量飆升榜 - {period_desc}**\n"
-    msg += f"更新時間: {datetime.now(tz_taipei).strftime('%Y-%m-%d %H:%M')}\n\n"
-    
-    rank_emojis = ["🥇", "🥈", "🥉", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣", "🔟"]
+    parts = [
+        f"**📊 YouTube 流量飆升榜 - {period_desc}**\n",
+        f"更新時間: {datetime.now(tz_taipei).strftime('%Y-%m-%d %H:%M')}\n\n",
+    ]
     
     for i, video in enumerate(top_videos):
-        emoji = rank_emojis[i] if i < len(rank_emojis) else f"{i+1}."
+        emoji = RANK_EMOJIS[i] if i < len(RANK_EMOJIS) else f"{i+1}."
         
         title = video['title']
         vid = video['video_id']
         is_short = video.get('is_short', 0) # 預設為 0 以防萬一
 
         # --- 處理標題與連結 ---
-        if is_short == 1:
-            # Shorts: 網址用 /shorts/，標題只取第一個 # 之前
-            video_url = f"https://youtube.com/shorts/{vid}"
-            if '#' in title:
-                title = title.split('#')[0].strip()
-        else:
-            # 一般影片: 網址用 youtu.be，標題只取第一個 # 之前
-            video_url = f"https://youtu.be/{vid}"
-            if '#' in title:
-                title = title.split('#')[0].strip()
-            
+        # Shorts 網址用 /shorts/，一般影片用 youtu.be；標題皆只取第一個 # 之前
+        video_url = _VIDEO_URL_PREFIX[is_short == 1] + vid
+        if '#' in title:
+            title = title.split('#')[0].strip()
         
         # --- 處理指標數據 ---
         m = video['metrics']
-        
-        def fmt_stat(data):
-            curr = data['curr']
-            diff = data['diff']
-            pct = data['pct']
-            
-            base_str = f"+{curr:,}"
-            
-            if diff == 0:
-                return base_str
-            
-            trend = "📈" if diff > 0 else "📉"
-            diff_sign = "+" if diff > 0 else ""
-            
-            return f"本期數據：{base_str} (趨勢：{trend}，差異值：{diff_sign}{diff:,}，差異百分比：{diff_sign}{pct:.0f}%)"
-
-        view_str = fmt_stat(m['views'])
-        like_str = fmt_stat(m['likes'])
-        comment_str = fmt_stat(m['comments'])
 
-        msg += f"{emoji} **[{title}]({video_url})**\n"
+        parts.append(f"{emoji} **[{title}]({video_url})**\n")
         # 因為字串變長了，建議每個指標換行顯示，不然會太擠
-        msg += f"   👁️ {view_str}\n"
-        msg += f"   👍 {like_str}\n"
-        msg += f"   💬 {comment_str}\n"
+        parts.append(f"   👁️ {_fmt_stat(m['views'])}\n")
+        parts.append(f"   👍 {_fmt_stat(m['likes'])}\n")
+        parts.append(f"   💬 {_fmt_stat(m['comments'])}\n")
         
-    return msg
+    return "".join(parts)
 
 def send_discord_notification(webhook_url, content, message_id=None):
     """發送或編輯 Discord 訊息"""
@@ -297,14 +303,14 @@ def send_discord_notification(webhook_url, content, message_id=None):
     try:
         if message_id:
             url = f"{webhook_url}/messages/{message_id}"
-            response = requests.patch(url, json=data)
+            response = _SESSION.patch(url, json=data, timeout=DISCORD_TIMEOUT)
             if response.status_code == 404:
                 message_id = None
             else:
                 response.raise_for_status()
         
         if not message_id:
-            response = requests.post(webhook_url + "?wait=true", json=data)
+            response = _SESSION.post(webhook_url + "?wait=true", json=data, timeout=DISCORD_TIMEOUT)
             response.raise_for_status()
             return response.json().get('id')
             
@@ -355,13 +361,15 @@ def run_ranking_update(category, settings=None, cfg=None, **kwargs):
         return
 
     engine = get_engine()
-    with engine.connect() as conn:
+    with engine.connect() as conn, ThreadPoolExecutor(max_workers=1) as pool:
         try:
+            # 取得該分類目前紀錄的 message_id：與排行榜查詢互不相依，以另一條連線並行查詢
+            msg_id_future = pool.submit(_read_dashboard_status, engine, category)
+
             top_videos, period_desc = get_ranking_data(conn, category)
             message_content = format_discord_message(category, period_desc, top_videos)
             
-            # 取得該分類目前紀錄的 message_id
-            msg_id = get_dashboard_status(conn, category)
+            msg_id = msg_id_future.result()
             
             # 發送請求
             new_msg_id = send_discord_notification(webhook_url, message_content, msg_id)
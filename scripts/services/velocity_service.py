@@ -1,23 +1,219 @@
-import time
 import json
-import os
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 import requests
+from requests.adapters import HTTPAdapter
 from sqlalchemy import text
 
-from scripts.db.db import get_engine
-from scripts.youtube.playlists import fetch_channel_video_ids
+from scripts.db.db import UPSERT_CHUNK_SIZE, get_engine, get_raw_cursor
+from scripts.youtube.playlists import fetch_channel_video_ids, fetch_latest_upload_id
 from scripts.youtube.videos import fetch_videos_details_batch
 
-# 用來儲存 Discord 訊息 ID 的檔案，實現「編輯」而非「洗版」
-DISCORD_STATE_FILE = "discord_state.json"
+# Discord 訊息 ID 存於 meta_kv 的鍵名，實現「編輯」而非「洗版」（建表見 scripts/db/migrations/004_meta_kv.sql）
+DISCORD_MSG_ID_KEY = "discord_msg_id"
+# 上次成功送出內容的 SHA-256，內容未變時略過 PATCH
+DISCORD_CONTENT_HASH_KEY = "discord_content_sha256"
+# 舊版存放 message_id 的本地檔案；meta_kv 尚無值時由此沿用一次，升級後仍編輯同一則訊息
+LEGACY_DISCORD_STATE_FILE = "discord_state.json"
+
+# Discord Webhook 共用 Session：保持連線（keep-alive），每次更新不必重新 TCP/TLS 握手
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4))
+# 秒數，避免連線卡住而佔用連線池
+DISCORD_TIMEOUT = 10
+
+_SQL_GET_META = text("SELECT value FROM meta_kv WHERE k = :k")
+
+_SQL_SET_META = text("""
+    INSERT INTO meta_kv (k, value) VALUES (:k, :v)
+    ON DUPLICATE KEY UPDATE value = VALUES(value)
+""")
+
+def _get_meta(conn, key: str) -> Optional[str]:
+    """讀取 meta_kv 的單一值；鍵不存在時回傳 None。"""
+    return conn.execute(_SQL_GET_META, {"k": key}).scalar()
+
+def _set_meta(conn, key: str, value: Optional[str]) -> None:
+    """寫入 meta_kv 並提交（單一 upsert，交易內原子完成，不會留下寫一半的狀態）。"""
+    conn.execute(_SQL_SET_META, {"k": key, "v": value})
+    conn.commit()
+
+def _load_legacy_discord_msg_id() -> Optional[str]:
+    """讀取舊版 discord_state.json 的 message_id；檔案不存在或內容損毀時回傳 None。"""
+    try:
+        with open(LEGACY_DISCORD_STATE_FILE, "r", encoding="utf-8") as f:
+            msg_id = json.load(f).get("message_id")
+    except (OSError, ValueError, AttributeError):
+        return None
+    return str(msg_id) if msg_id else None
+
+# 程序內快取的 Discord message_id / 內容雜湊：首次使用時由 meta_kv 載入，之後只在值變更時寫回
+_DISCORD_MSG_ID: Optional[str] = None
+_DISCORD_CONTENT_HASH: Optional[str] = None
+_discord_state_loaded = False
+
+def _load_discord_msg_id(conn) -> Optional[str]:
+    """
+    取得快取的 message_id；僅第一次呼叫時查詢 meta_kv（同時載入內容雜湊）。
+    - meta_kv 尚無 message_id 鍵時，以舊版 discord_state.json 的值寫入 meta_kv（只需一次），
+      避免升級後第一次執行改發新訊息。
+    """
+    global _DISCORD_MSG_ID, _DISCORD_CONTENT_HASH, _discord_state_loaded
+    if not _discord_state_loaded:
+        row = conn.execute(_SQL_GET_META, {"k": DISCORD_MSG_ID_KEY}).first()
+        _DISCORD_CONTENT_HASH = _get_meta(conn, DISCORD_CONTENT_HASH_KEY)
+        if row is not None:
+            _DISCORD_MSG_ID = row[0]
+        else:
+            # meta_kv 尚無此鍵（升級後首次執行）：沿用舊檔的值；之後即使值為 NULL 也不再回頭讀檔
+            _DISCORD_MSG_ID = _load_legacy_discord_msg_id()
+            _set_meta(conn, DISCORD_MSG_ID_KEY, _DISCORD_MSG_ID)
+        _discord_state_loaded = True
+    return _DISCORD_MSG_ID
+
+def _store_discord_content_hash(conn, content_hash: str) -> None:
+    """
+    更新快取的內容雜湊；與現值相同時不寫入，不同時 upsert 至 meta_kv。
+    """
+    global _DISCORD_CONTENT_HASH
+    if content_hash == _DISCORD_CONTENT_HASH:
+        return
+    _set_meta(conn, DISCORD_CONTENT_HASH_KEY, content_hash)
+    _DISCORD_CONTENT_HASH = content_hash
+
+def _store_discord_msg_id(conn, msg_id: Optional[str]) -> None:
+    """
+    更新快取的 message_id；與現值相同時不寫入，不同時 upsert 至 meta_kv。
+    """
+    global _DISCORD_MSG_ID
+    if msg_id == _DISCORD_MSG_ID:
+        return
+    _set_meta(conn, DISCORD_MSG_ID_KEY, msg_id)
+    _DISCORD_MSG_ID = msg_id
+
+# videos.list 併發批次數上限（每批 50 支影片；I/O 等待為主，總耗時約等於最慢的一批）
+VELOCITY_FETCH_WORKERS = 12
+
+# 原生 cursor executemany 用的 SQL（pyformat 佔位符）：VALUES 僅含佔位符，PyMySQL 會改寫為單一多列 INSERT
+# 暫存表：本次抓到的最新數據（TEMPORARY 僅本連線可見，連線結束自動刪除）
+_SQL_CREATE_STAGE = text("""
+    CREATE TEMPORARY TABLE IF NOT EXISTS stg_video_stats (
+        video_id VARCHAR(32) NOT NULL PRIMARY KEY,
+        title VARCHAR(255) NULL,
+        published_at DATETIME NULL,
+        view_count BIGINT NOT NULL,
+        like_count BIGINT NOT NULL,
+        comment_count BIGINT NOT NULL
+    )
+""")
+_SQL_CLEAR_STAGE = text("DELETE FROM stg_video_stats")
+_SQL_DROP_STAGE = text("DROP TEMPORARY TABLE IF EXISTS stg_video_stats")
+
+_SQL_INSERT_STAGE = """
+    INSERT INTO stg_video_stats (video_id, title, published_at, view_count, like_count, comment_count)
+    VALUES (%(video_id)s, %(title)s, %(published_at)s, %(view_count)s, %(like_count)s, %(comment_count)s)
+"""
+
+# 暫存列與 dim_video 的「有變動」條件（新影片 d.* 為 NULL，舊值視為 0）；Delta 寫入與 dim_video 更新共用
+_STAGE_CHANGED_WHERE = """
+    WHERE s.view_count <> COALESCE(d.view_count, 0)
+       OR s.like_count <> COALESCE(d.like_count, 0)
+       OR s.comment_count <> COALESCE(d.comment_count, 0)
+"""
+
+_SQL_INSERT_VELOCITY_FROM_STAGE = text(f"""
+    INSERT INTO fact_video_velocity
+    (video_id, captured_at, delta_views, delta_likes, delta_comments)
+    SELECT s.video_id, :captured_at,
+           s.view_count - COALESCE(d.view_count, 0),
+           s.like_count - COALESCE(d.like_count, 0),
+           s.comment_count - COALESCE(d.comment_count, 0)
+    FROM stg_video_stats s
+    LEFT JOIN dim_video d ON d.video_id = s.video_id
+    {_STAGE_CHANGED_WHERE}
+""")
+
+# 只 upsert 新影片與統計有變動的影片；未變動的長尾影片 dim_video 已是最新值，不必重寫
+# SELECT 端 join 了同名欄位的 s/d，UPDATE 目標需以 dim_video. 限定，否則 MySQL 視為欄位不明確（ERROR 1052）
+_SQL_UPSERT_DIM_VIDEO_FROM_STAGE = text(f"""
+    INSERT INTO dim_video (video_id, title, published_at, view_count, like_count, comment_count, updated_at)
+    SELECT s.video_id, s.title, s.published_at, s.view_count, s.like_count, s.comment_count, :updated_at
+    FROM stg_video_stats s
+    LEFT JOIN dim_video d ON d.video_id = s.video_id
+    {_STAGE_CHANGED_WHERE}
+       OR d.video_id IS NULL
+    ON DUPLICATE KEY UPDATE
+        dim_video.view_count = VALUES(view_count),
+        dim_video.like_count = VALUES(like_count),
+        dim_video.comment_count = VALUES(comment_count),
+        dim_video.updated_at = VALUES(updated_at)
+""")
+
+def _executemany_chunked(cur, sql: str, rows: List[Dict[str, Any]]) -> None:
+    """
+    以原生 cursor 每 UPSERT_CHUNK_SIZE 列 executemany 一次（每批一個多列 INSERT 往返）。
+    """
+    for i in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        cur.executemany(sql, rows[i : i + UPSERT_CHUNK_SIZE])
+
+# 頻道影片 ID 清單快照：存於 meta_kv（鍵名 video_ids:<channel_id>，值為 JSON {fetched_at, ids}；
+# 欄位需 MEDIUMTEXT，見 scripts/db/migrations/005_meta_kv_mediumtext.sql），跨排程執行沿用。
+# TTL 內每次只探測 uploads 最新一筆，與快照相同即沿用，不重新翻頁列舉；逾時仍完整列舉一次，以反映下架/設為私人的影片
+VIDEO_IDS_CACHE_TTL_SEC = 3600
+VIDEO_IDS_META_KEY_PREFIX = "video_ids:"
+
+def _load_video_ids_snapshot(conn, channel_id: str) -> Optional[Tuple[float, List[str]]]:
+    """讀取 meta_kv 中的影片 ID 快照；不存在或內容損毀時回傳 None。"""
+    raw = _get_meta(conn, VIDEO_IDS_META_KEY_PREFIX + channel_id)
+    if not raw:
+        return None
+    try:
+        data = json.loads(raw)
+        return float(data["fetched_at"]), list(data["ids"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def _channel_video_ids_cached(engine, yt_api_key: str, channel_id: str) -> List[str]:
+    """
+    取得頻道全部影片 ID（uploads 清單順序，最新在前）。
+    - meta_kv 快照未過期且最新上傳與快照第一筆相同：直接回傳快照（只花一次單筆探測）
+    - 否則完整列舉並寫回快照
+    """
+    with engine.connect() as conn:
+        snapshot = _load_video_ids_snapshot(conn, channel_id)
+    if snapshot and time.time() - snapshot[0] < VIDEO_IDS_CACHE_TTL_SEC:
+        ids = snapshot[1]
+        if ids and fetch_latest_upload_id(yt_api_key, channel_id) == ids[0]:
+            print("[Velocity] No new uploads, reusing stored video IDs.")
+            return ids
+
+    ids = fetch_channel_video_ids(yt_api_key, channel_id, None, None)
+    with engine.connect() as conn:
+        _set_meta(
+            conn,
+            VIDEO_IDS_META_KEY_PREFIX + channel_id,
+            json.dumps({"fetched_at": time.time(), "ids": ids}, separators=(",", ":")),
+        )
+    return ids
+
+def _fetch_batch(yt_api_key: str, batch_ids: List[str], batch_no: int) -> List[Dict[str, Any]]:
+    """
+    抓取單一批次的影片詳情；失敗時僅記錄並回傳空列表，避免單批錯誤影響其他批次。
+    """
+    try:
+        return fetch_videos_details_batch(yt_api_key, batch_ids)
+    except Exception as e:
+        print(f"[Error] Batch {batch_no} failed: {e}")
+        return []
 
 def run_velocity_track(channel_id: str, settings: Dict[str, str], dry_run: bool = False):
     """
     每 15 分鐘執行：
     1. 抓取最新數據
-    2. 計算 Delta 並寫入 fact_video_velocity
+    2. 寫入暫存表，於資料庫端計算 Delta 並寫入 fact_video_velocity
     3. 更新 dim_video 為最新狀態
     4. 生成排行榜並更新 Discord
     """
@@ -27,173 +223,151 @@ def run_velocity_track(channel_id: str, settings: Dict[str, str], dry_run: bool
 
     # 1. 準備數據：抓取所有影片 ID
     print("[Velocity] Fetching all video IDs...")
-    all_video_ids = fetch_channel_video_ids(yt_api_key, channel_id)
-    
-    # 2. 讀取 DB 現有狀態 (用於比對)
-    # 格式: { 'video_id': {'views': 100, 'likes': 10, 'comments': 5} }
-    print("[Velocity] Loading current DB state...")
-    current_state = {}
-    with engine.connect() as conn:
-        # 假設 dim_video 欄位: video_id, view_count, like_count, comment_count
-        rows = conn.execute(text("SELECT video_id, view_count, like_count, comment_count FROM dim_video"))
-        for r in rows:
-            current_state[r.video_id] = {
-                "views": r.view_count or 0,
-                "likes": r.like_count or 0,
-                "comments": r.comment_count or 0
-            }
-
-    # 3. 批次處理 API 並計算 Delta
+    all_video_ids = _channel_video_ids_cached(engine, yt_api_key, channel_id)
+
+    # 2. 批次處理 API，整理最新數據（Delta 交由資料庫端與 dim_video 比對計算，不必整表載入記憶體）
     print(f"[Velocity] Processing {len(all_video_ids)} videos...")
-    
-    velocity_records = [] # 準備寫入 fact_video_velocity
-    update_records = []   # 準備更新 dim_video
-    
+
     captured_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     batch_size = 50
 
-    for i in range(0, len(all_video_ids), batch_size):
-        batch_ids = all_video_ids[i : i + batch_size]
-        try:
-            api_results = fetch_videos_details_batch(yt_api_key, batch_ids)
-            
-            for item in api_results:
-                vid = item["video_id"]
-                stats = item.get("statistics", {})
-                
-                new_views = int(stats.get("viewCount", 0))
-                new_likes = int(stats.get("likeCount", 0))
-                new_comments = int(stats.get("commentCount", 0))
-                
-                # 取得舊數據 (若為新影片，舊數據預設為 0)
-                old_data = current_state.get(vid, {"views": 0, "likes": 0, "comments": 0})
-                
-                delta_views = new_views - old_data["views"]
-                delta_likes = new_likes - old_data["likes"]
-                delta_comments = new_comments - old_data["comments"]
-                
-                # 只有當數據有變化時才記錄 Delta (或新影片)
-                # 這裡設定：只要有任一數據變動，就記錄
-                if delta_views != 0 or delta_likes != 0 or delta_comments != 0:
-                    velocity_records.append({
-                        "video_id": vid,
-                        "captured_at": captured_at,
-                        "delta_views": delta_views,
-                        "delta_likes": delta_likes,
-                        "delta_comments": delta_comments
-                    })
-                
-                # 無論有無變化，都要準備更新 dim_video 到最新狀態
-                # 這樣下次比對才會正確
-                update_records.append({
-                    "video_id": vid,
-                    "view_count": new_views,
-                    "like_count": new_likes,
-                    "comment_count": new_comments,
-                    # 這裡可以順便更新 title, published_at 等，確保新影片資料完整
-                    "title": item.get("snippet", {}).get("title", "")[:255], 
-                    "published_at": item.get("snippet", {}).get("publishedAt"),
-                    "updated_at": captured_at
-                })
-
-        except Exception as e:
-            print(f"[Error] Batch {i} failed: {e}")
-
-    # 4. 寫入資料庫 (Transaction)
-    if not dry_run:
+    # 各批次以執行緒池併發送出；map 依提交順序回傳，彙整結果與序列版本一致
+    starts = range(0, len(all_video_ids), batch_size)
+    with ThreadPoolExecutor(max_workers=VELOCITY_FETCH_WORKERS) as pool:
+        batch_results = list(pool.map(
+            lambda i: _fetch_batch(yt_api_key, all_video_ids[i : i + batch_size], i), starts
+        ))
+
+    # 每支影片一筆紀錄，寫入暫存表後由資料庫端計算 Delta 與更新 dim_video
+    # 數值直接取 fetch_videos_details_batch 已解析的整數欄位，不再逐列解析原始字串
+    # 全部影片都寫入暫存表；dim_video 只更新新影片與統計有變化者（未變動者已是最新值，下次比對仍正確）
+    update_records = [
+        {
+            "video_id": item["video_id"],
+            "view_count": item["view_count"] or 0,
+            "like_count": item["like_count"] or 0,
+            "comment_count": item["comment_count"] or 0,
+            # 這裡可以順便更新 title, published_at 等，確保新影片資料完整
+            "title": item["video_title"][:255],
+            "published_at": item["published_at"],
+        }
+        for api_results in batch_results
+        for item in api_results
+    ]
+
+    # 3. 寫入資料庫 (Transaction)：暫存 -> 計算 Delta -> 更新有變動的 dim_video，須在同一連線（暫存表僅該連線可見）
+    if not dry_run and update_records:
         with engine.begin() as conn:
-            # A. 寫入 Delta
-            if velocity_records:
-                conn.execute(text("""
-                    INSERT INTO fact_video_velocity 
-                    (video_id, captured_at, delta_views, delta_likes, delta_comments)
-                    VALUES (:video_id, :captured_at, :delta_views, :delta_likes, :delta_comments)
-                """), velocity_records)
-                print(f"[DB] Inserted {len(velocity_records)} velocity records.")
-
-            # B. 更新 dim_video (Upsert: 存在則更新，不存在則插入)
-            # MySQL 的 ON DUPLICATE KEY UPDATE
-            if update_records:
-                # 這裡為了簡化，使用逐筆或小批次 Upsert，或使用 SQLAlchemy 的特定語法
-                # 為了效能，建議使用 INSERT ... ON DUPLICATE KEY UPDATE
-                # 這裡示範概念 SQL
-                stmt = text("""
-                    INSERT INTO dim_video (video_id, title, published_at, view_count, like_count, comment_count, updated_at)
-                    VALUES (:video_id, :title, :published_at, :view_count, :like_count, :comment_count, :updated_at)
-                    ON DUPLICATE KEY UPDATE
-                        view_count = VALUES(view_count),
-                        like_count = VALUES(like_count),
-                        comment_count = VALUES(comment_count),
-                        updated_at = VALUES(updated_at)
-                """)
-                conn.execute(stmt, update_records)
-                print(f"[DB] Updated {len(update_records)} videos in dim_video.")
-
-    # 5. 生成排行榜並發送 Discord
+            # A. 最新數據寫入暫存表
+            conn.execute(_SQL_CREATE_STAGE)
+            conn.execute(_SQL_CLEAR_STAGE)
+            cur = get_raw_cursor(conn)
+            try:
+                _executemany_chunked(cur, _SQL_INSERT_STAGE, update_records)
+            finally:
+                cur.close()
+
+            # B. 於資料庫端計算 Delta 並寫入（新影片舊數據視為 0；只要有任一數據變動就記錄）
+            res = conn.execute(_SQL_INSERT_VELOCITY_FROM_STAGE, {"captured_at": captured_at})
+            print(f"[DB] Inserted {res.rowcount} velocity records.")
+
+            # C. 更新 dim_video (Upsert: 存在則更新，不存在則插入)，僅限新影片或統計有變動者
+            # MySQL 的 ON DUPLICATE KEY UPDATE；須在 B 之後執行，B 才能讀到更新前的舊值
+            res = conn.execute(_SQL_UPSERT_DIM_VIDEO_FROM_STAGE, {"updated_at": captured_at})
+            print(f"[DB] Upserted changed videos in dim_video (affected rows: {res.rowcount}, of {len(update_records)} fetched).")
+            conn.execute(_SQL_DROP_STAGE)
+
+    # 4. 生成排行榜並發送 Discord
+    # 同一條連線完成報表查詢與 message_id 讀寫，整個步驟只借出一次連線
     if webhook_url:
-        report_text = generate_leaderboard_report(engine, captured_at)
-        update_discord_message(webhook_url, report_text)
+        with engine.connect() as conn:
+            report_text = generate_leaderboard_report(conn, captured_at)
+            # 以排行榜本體（不含每次都不同的更新時間標頭）判斷內容是否變動
+            body = report_text[len(_REPORT_HEADER.format(time=captured_at)):]
+            update_discord_message(conn, webhook_url, report_text, fingerprint=body)
+
+# 各時段前 5 名一次取回：每個時段在子查詢內先以 captured_at 區間彙總並 LIMIT 5（走 idx_fvv_captured_video
+# 覆蓋索引，只掃該時段的索引範圍），UNION ALL 後只需對至多 15 列關聯 dim_video 取標題
+_SQL_TOP_BUCKET = """
+        (SELECT '{bucket}' AS bucket, video_id, SUM(delta_views) AS total_delta
+         FROM fact_video_velocity
+         WHERE captured_at >= {since}
+         GROUP BY video_id
+         ORDER BY total_delta DESC
+         LIMIT 5)"""
+
+# (時段代號, 起點 SQL, 標題)：報表各區塊的顯示順序
+_LEADERBOARD_BUCKETS = (
+    ("d15", "NOW() - INTERVAL 15 MINUTE", "🚀 最近 15 分鐘飆升"),
+    ("d1h", "NOW() - INTERVAL 1 HOUR", "🔥 最近 1 小時熱門"),
+    ("dday", "CURDATE()", "📅 今日累計 (00:00~Now)"),
+)
 
-def generate_leaderboard_report(engine, current_time_str) -> str:
+_SQL_TOP_BUCKETS_UNION = " UNION ALL".join(
+    _SQL_TOP_BUCKET.format(bucket=bucket, since=since) for bucket, since, _ in _LEADERBOARD_BUCKETS
+)
+
+_SQL_LEADERBOARD = text(f"""
+    SELECT t.bucket, v.title, t.total_delta
+    FROM ({_SQL_TOP_BUCKETS_UNION}
+    ) t
+    JOIN dim_video v ON v.video_id = t.video_id
+    ORDER BY t.bucket, t.total_delta DESC
+""")
+
+# 報表標頭（含更新時間）
+_REPORT_HEADER = "📊 **YouTube 即時戰情室** (更新: {time})\n\n"
+
+def generate_leaderboard_report(conn, current_time_str) -> str:
     """
     查詢資料庫生成各時段排行榜文字
+    - conn：呼叫端借出的連線（與 message_id 讀寫共用）
+    - 單一查詢（一次往返）取回所有時段的前 5 名，再依時段分組輸出
+    - 注意：要關聯 dim_video 取得影片標題（僅對各時段前 5 名關聯）
     """
-    # 這裡使用 SQL 聚合查詢
-    # 範例：查詢最近 1 小時的觀看增長前 5 名
-    # 注意：要關聯 dim_video 取得影片標題
-    
-    def get_top(interval_sql, label):
-        sql = f"""
-            SELECT v.title, SUM(f.delta_views) as total_delta
-            FROM fact_video_velocity f
-            JOIN dim_video v ON f.video_id = v.video_id
-            WHERE f.captured_at >= {interval_sql}
-            GROUP BY f.video_id
-            ORDER BY total_delta DESC
-            LIMIT 5
-        """
-        with engine.connect() as conn:
-            rows = conn.execute(text(sql)).fetchall()
-        
+    rows = conn.execute(_SQL_LEADERBOARD).fetchall()
+
+    by_bucket: Dict[str, List[Any]] = {}
+    for r in rows:
+        by_bucket.setdefault(r.bucket, []).append(r)
+
+    report = _REPORT_HEADER.format(time=current_time_str)
+    for bucket, _, label in _LEADERBOARD_BUCKETS:
+        top = by_bucket.get(bucket, [])
         txt = f"**{label}**\n"
-        if not rows:
+        if not top:
             txt += "Wait for data...\n"
-        for i, r in enumerate(rows, 1):
+        for i, r in enumerate(top, 1):
             txt += f"{i}. {r.title} (+{r.total_delta})\n"
-        return txt + "\n"
+        report += txt + "\n"
 
-    report = f"📊 **YouTube 即時戰情室** (更新: {current_time_str})\n\n"
-    report += get_top("NOW() - INTERVAL 15 MINUTE", "🚀 最近 15 分鐘飆升")
-    report += get_top("NOW() - INTERVAL 1 HOUR", "🔥 最近 1 小時熱門")
-    report += get_top("CURDATE()", "📅 今日累計 (00:00~Now)")
-    
     # 週與月可以類推
-    
+
     return report
 
-def update_discord_message(webhook_url: str, content: str):
+def update_discord_message(conn, webhook_url: str, content: str, fingerprint: Optional[str] = None):
     """
     使用 Webhook 編輯訊息。
     注意：Discord Webhook 預設只能 '發送'。要 '編輯' 必須知道 message_id。
     策略：
-    1. 讀取本地 discord_state.json 找 message_id。
+    1. 取得程序內快取的 message_id（首次才查詢 meta_kv）。
     2. 嘗試 PATCH 該 message_id。
-    3. 如果失敗 (404/403) 或沒有 ID，則 POST 新訊息並儲存 ID。
+    3. 如果失敗 (404/403) 或沒有 ID，則 POST 新訊息並儲存 ID（ID 變更時才寫入）。
+    - fingerprint：判斷內容是否變動的依據（預設為 content）；其 SHA-256 與上次成功送出者相同時，
+      已有訊息可編輯即直接略過，不發出任何請求。
     """
-    msg_id = None
-    if os.path.exists(DISCORD_STATE_FILE):
-        try:
-            with open(DISCORD_STATE_FILE, "r") as f:
-                data = json.load(f)
-                msg_id = data.get("message_id")
-        except:
-            pass
+    msg_id = _load_discord_msg_id(conn)
+    content_hash = hashlib.sha256((content if fingerprint is None else fingerprint).encode("utf-8")).hexdigest()
+    if msg_id and content_hash == _DISCORD_CONTENT_HASH:
+        print("[Discord] Content unchanged, skip edit.")
+        return
 
     # 嘗試編輯
     if msg_id:
         patch_url = f"{webhook_url}/messages/{msg_id}"
-        resp = requests.patch(patch_url, json={"content": content})
+        resp = _SESSION.patch(patch_url, json={"content": content}, timeout=DISCORD_TIMEOUT)
         if resp.status_code in [200, 204]:
+            _store_discord_content_hash(conn, content_hash)
             print("[Discord] Message updated.")
             return
         else:
@@ -202,9 +376,9 @@ def update_discord_message(webhook_url: str, content: str):
     # 發送新訊息 (當編輯失敗或第一次執行)
     # 必須加上 ?wait=true 才能在回應中拿到 message_id
     post_url = f"{webhook_url}?wait=true"
-    resp = requests.post(post_url, json={"content": content})
+    resp = _SESSION.post(post_url, json={"content": content}, timeout=DISCORD_TIMEOUT)
     if resp.status_code in [200, 201]:
         new_msg_id = resp.json().get("id")
-        with open(DISCORD_STATE_FILE, "w") as f:
-            json.dump({"message_id": new_msg_id}, f)
+        _store_discord_msg_id(conn, new_msg_id)
+        _store_discord_content_hash(conn, content_hash)
         print(f"[Discord] New message sent. ID: {new_msg_id}")
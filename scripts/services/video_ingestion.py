@@ -1,10 +1,12 @@
 # scripts/services/video_ingestion.py
 # 總覽：
-# - dim_video 更新：run_fetch_videos 依頻道與日期抓取影片清單與詳情，分流為完整 upsert 或僅統計更新。
+# - dim_video 更新：run_fetch_videos 依頻道與日期抓取影片清單與詳情，分流為完整 upsert 或僅統計更新（需判定型別者以執行緒池併發判定）。
 # - Analytics 視窗：run_top_videos 取 D-3~D-2 的 Top Videos，解析/補 meta 後批次 upsert 至 fact_yta_video_window。
 # - 輔助與正規化：提供 YA 回傳表格解析、結果列組裝、補中繼資訊、型別正規化與批次 upsert。
 
 import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from typing import Optional, List, Dict, Any, Tuple, Callable
 from datetime import datetime, date, timedelta
 from decimal import Decimal
@@ -14,17 +16,29 @@ from scripts.utils.env import load_settings
 from scripts.db.db import (
     get_engine,
     get_existing_videos,
+    ExistingVideo,
+    NEW_VIDEO_STATE,
     get_raw_cursor,
-    upsert_dim_video_full,
-    upsert_dim_video_stats_only,
-    upsert_dim_video_full_update,
+    upsert_dim_video_smart,
     insert_fact_video_velocity,  # <--- 新增這個
 )
 from scripts.channel.ensure import ensure_dim_channel_exists
-from scripts.youtube.playlists import fetch_channel_video_ids
-from scripts.youtube.videos import fetch_videos_details_batch, _decide_video_type, fetch_video_meta_map
+from scripts.youtube.playlists import iter_channel_video_id_pages
+from scripts.youtube.videos import (
+    VIDEO_PARTS_FULL,
+    VIDEO_PARTS_STATS,
+    fetch_videos_details_batch,
+    _decide_video_type,
+    fetch_video_meta_map,
+)
 from scripts.models.fact_yta_video_window import KNOWN_FACT_WINDOW_COLS, UPSERT_SQL_FACT_WINDOW
 
+# videos.list 併發批次數上限（I/O 等待為主；受 API 配額/速率限制約束，不宜過大）
+FETCH_DETAILS_WORKERS = 8
+
+# 影片型別判定的併發數（短片需對 www.youtube.com 探測 shorts/watch 導向；不耗 API 配額）
+CLASSIFY_WORKERS = 16
+
 # -------------------------------
 # Public: fetch videos into dim_video
 # -------------------------------
@@ -44,9 +58,9 @@ def run_fetch_videos(
     - 流程：
       1) 驗證日期參數格式
       2) 初始化 DB、確保 dim_channel 存在
-      3) 取頻道 uploads 影片 IDs
-      4) 查詢既有影片，判斷是否已做過 shorts_check
-      5) videos.list 分批取詳情
+      3) 逐頁取頻道 uploads 影片 IDs
+      4) 每頁查詢既有影片，判斷是否已做過 shorts_check
+      5) videos.list 分批取詳情（湊滿一批即送出，與後續分頁重疊進行）
       6) 分流 rows_full（完整 upsert）與 rows_stats（僅統計）並寫入
     - 輸出：透過 print 回報進度與摘要
     """
@@ -62,42 +76,56 @@ def run_fetch_videos(
     # 從設定取出 YouTube API Key（若未提供，fetch 將失敗——此處假設外部保證）
     yt_api_key = (settings.get("YPKG_API_KEY") or "").strip()
 
-    # 3) 取得 video_ids（由 uploads 播放清單與日期條件過濾）
-    print("[info] 取得頻道影片清單（uploads 播放清單）…")
-    video_ids: List[str] = fetch_channel_video_ids(
-        yt_api_key=yt_api_key,
-        channel_id=channel_id,
-        published_after=pa,
-        published_before=pb,
-    )
-    print(f"[info] 取得 video_id 數量：{len(video_ids)}")
-    if not video_ids:
-        print("[info] 無影片可處理。")
-        return
-
-    # 4) 查詢既有影片（回傳 map：video_id -> 現存欄位，用於判斷是否只需更新統計）
-    existing_map: Dict[str, Dict[str, Any]] = get_existing_videos(engine, video_ids)
-
-    # 5) videos.list 分批抓詳情（以 max_results 為批次）
-    print("[info] videos.list 分批抓取詳情…")
-
+    # 3)~5) 逐頁取得 video_ids（由 uploads 播放清單與日期條件過濾），每頁查詢既有影片後依 shorts_check 分流；
+    #        各分流湊滿 max_results 即以執行緒池送出 videos.list，詳情抓取與後續分頁重疊進行
+    print("[info] 取得頻道影片清單（uploads 播放清單）並分批抓取詳情…")
+    video_ids: List[str] = []
+    # 既有影片（map：video_id -> 現存欄位，用於判斷是否只需更新統計）
+    existing_map: Dict[str, ExistingVideo] = {}
     # 用來儲存每支影片的詳情資料，key 為 video_id，value 為該影片的詳細資訊字典
     details_map: Dict[str, Dict[str, Any]] = {}
 
-    # 依批次切片呼叫 API，避免超過每次上限
-    for i in range(0, len(video_ids), max_results):
-        batch = video_ids[i : i + max_results]
-
-        # 呼叫批次查詢函式，向 YouTube Data API 的 videos.list 取回影片詳情
-        batch_details = fetch_videos_details_batch(
+    # 已完成 shorts_check 的既有影片只需最新統計（僅要求 statistics part，回應較小）；其餘要求完整 parts
+    stats_ids: List[str] = []
+    full_ids: List[str] = []
+    with ThreadPoolExecutor(max_workers=FETCH_DETAILS_WORKERS) as ex:
+        futures = []
+
+        def _flush(buf: List[str], parts: str, final: bool = False) -> None:
+            # 依批次切片呼叫 API，避免超過每次上限；未湊滿一批的餘數留待下一頁（final 時全數送出）
+            while len(buf) >= max_results or (final and buf):
+                futures.append(ex.submit(
+                    fetch_videos_details_batch, yt_api_key=yt_api_key, video_ids=buf[:max_results], parts=parts,
+                ))
+                del buf[:max_results]
+
+        for page_ids in iter_channel_video_id_pages(
             yt_api_key=yt_api_key,
-            video_ids=batch,
-        )
+            channel_id=channel_id,
+            published_after=pa,
+            published_before=pb,
+        ):
+            video_ids.extend(page_ids)
+            page_existing = get_existing_videos(engine, page_ids)
+            existing_map.update(page_existing)
+            for v in page_ids:
+                existed = page_existing.get(v)
+                (stats_ids if existed and existed.shorts_check == 1 else full_ids).append(v)
+            _flush(full_ids, VIDEO_PARTS_FULL)
+            _flush(stats_ids, VIDEO_PARTS_STATS)
+        _flush(full_ids, VIDEO_PARTS_FULL, final=True)
+        _flush(stats_ids, VIDEO_PARTS_STATS, final=True)
 
         # 將每支影片的詳情寫入 details_map（用 video_id 當 key）
-        for d in batch_details:
-            vid = d["video_id"]     # API 回傳的影片 ID（預期存在）
-            details_map[vid] = d    # 若重複 key，後者覆蓋前者（正常不會發生）
+        for fut in futures:
+            for d in fut.result():
+                vid = d["video_id"]     # API 回傳的影片 ID（預期存在）
+                details_map[vid] = d    # 若重複 key，後者覆蓋前者（正常不會發生）
+
+    print(f"[info] 取得 video_id 數量：{len(video_ids)}")
+    if not video_ids:
+        print("[info] 無影片可處理。")
+        return
 
     # =========================================================================
     # [NEW Step 5.5] 計算 Velocity (Delta) 並寫入 fact_video_velocity
@@ -111,18 +139,14 @@ def run_fetch_videos(
         if not new_data:
             continue # API 沒抓到資料，無法計算
 
-        old_data = existing_map.get(vid)
-        
         # 準備數值 (若無舊資料則視為 0，若 API 回傳 None 則視為 0)
         # New Values
         n_views = int(new_data.get("view_count") or 0)
         n_likes = int(new_data.get("like_count") or 0)
         n_comments = int(new_data.get("comment_count") or 0)
 
-        # Old Values (若 old_data 為 None，代表是新影片，舊值設為 0)
-        o_views = int(old_data.get("view_count") or 0) if old_data else 0
-        o_likes = int(old_data.get("like_count") or 0) if old_data else 0
-        o_comments = int(old_data.get("comment_count") or 0) if old_data else 0
+        # Old Values (查無既有資料代表是新影片，舊值為 0；tuple 直接拆解)
+        _, o_views, o_likes, o_comments = existing_map.get(vid, NEW_VIDEO_STATE)
 
         # 計算 Delta
         d_views = n_views - o_views
@@ -156,6 +180,9 @@ def run_fetch_videos(
     # - rows_full：首次或尚未做 shorts_check 的影片，需寫入完整欄位（meta + 統計）
     # - rows_stats：已做過 shorts_check 的既有影片，僅更新變動的統計欄位
 
+    # 需判定型別的影片（新影片 → rows_full；既有但未做 shorts_check → rows_full_update），先收集後併發判定
+    to_classify: List[Tuple[List[Dict[str, Any]], str, Dict[str, Any]]] = []
+
     for vid in video_ids:
         d = details_map.get(vid)
         if not d:
@@ -163,7 +190,7 @@ def run_fetch_videos(
             continue
 
         existed = existing_map.get(vid)
-        if existed and int(existed.get("shorts_check", 0)) == 1:
+        if existed and existed.shorts_check == 1:
             # 僅更新統計欄位
             rows_stats.append(
                 {
@@ -173,68 +200,50 @@ def run_fetch_videos(
                     "comment_count": d.get("comment_count"),
                 }
             )
-        elif existed and int(existed.get("shorts_check", 0)) == 0:  
-            # 決定 video_type 與 is_short（使用新版邏輯 _decide_video_type）
-            video_type = _decide_video_type(
-                vid=vid,
-                snippet=(d.get("raw") or {}).get("snippet"),
-                live_details=(d.get("raw") or {}).get("liveStreamingDetails"),
-                duration_sec=d.get("duration_sec"),
-                published_at=d.get("published_at"),  # 已是 naive UTC
-            )
-            is_short = 1 if video_type == "shorts" else 0
-            # 完整 upsert 所需欄位（含 meta 與統計）
-            rows_full_update.append(
-                {
-                    "video_id": vid,
-                    "channel_id": d.get("channel_id") or channel_id,
-                    "video_title": d.get("video_title"),
-                    "published_at": d.get("published_at"),
-                    "duration_sec": d.get("duration_sec"),
-                    "is_short": is_short,
-                    "shorts_check": 1,
-                    "video_type": video_type,
-                    "view_count": d.get("view_count"),
-                    "like_count": d.get("like_count"),
-                    "comment_count": d.get("comment_count"),
-                }
-            )             
+        elif existed and existed.shorts_check == 0:
+            to_classify.append((rows_full_update, vid, d))
         else:
-            # 決定 video_type 與 is_short（使用新版邏輯 _decide_video_type）
-            video_type = _decide_video_type(
-                vid=vid,
-                snippet=(d.get("raw") or {}).get("snippet"),
-                live_details=(d.get("raw") or {}).get("liveStreamingDetails"),
-                duration_sec=d.get("duration_sec"),
-                published_at=d.get("published_at"),  # 已是 naive UTC
-            )
-            is_short = 1 if video_type == "shorts" else 0
-            # 完整 upsert 所需欄位（含 meta 與統計）
-            rows_full.append(
-                {
-                    "video_id": vid,
-                    "channel_id": d.get("channel_id") or channel_id,
-                    "video_title": d.get("video_title"),
-                    "published_at": d.get("published_at"),
-                    "duration_sec": d.get("duration_sec"),
-                    "is_short": is_short,
-                    "shorts_check": 1,
-                    "video_type": video_type,
-                    "view_count": d.get("view_count"),
-                    "like_count": d.get("like_count"),
-                    "comment_count": d.get("comment_count"),
-                }
-            )
+            to_classify.append((rows_full, vid, d))
+
+    # 決定 video_type 與 is_short（使用新版邏輯 _decide_video_type）；短片需逐支探測 shorts/watch 導向，
+    # 屬 I/O 等待，以執行緒池併發判定（map 依提交順序回傳，各列表內順序與序列版本一致）
+    def _classify(item: Tuple[List[Dict[str, Any]], str, Dict[str, Any]]) -> str:
+        _, vid, d = item
+        raw = d.get("raw") or {}
+        return _decide_video_type(
+            vid=vid,
+            snippet=raw.get("snippet"),
+            live_details=raw.get("liveStreamingDetails"),
+            duration_sec=d.get("duration_sec"),
+            published_at=d.get("published_at"),  # 已是 naive UTC
+        )
+
+    with ThreadPoolExecutor(max_workers=CLASSIFY_WORKERS) as ex:
+        video_types = list(ex.map(_classify, to_classify))
+
+    for (target, vid, d), video_type in zip(to_classify, video_types):
+        is_short = 1 if video_type == "shorts" else 0
+        # 完整 upsert 所需欄位（含 meta 與統計）
+        target.append(
+            {
+                "video_id": vid,
+                "channel_id": d.get("channel_id") or channel_id,
+                "video_title": d.get("video_title"),
+                "published_at": d.get("published_at"),
+                "duration_sec": d.get("duration_sec"),
+                "is_short": is_short,
+                "shorts_check": 1,
+                "video_type": video_type,
+                "view_count": d.get("view_count"),
+                "like_count": d.get("like_count"),
+                "comment_count": d.get("comment_count"),
+            }
+        )
 
     print(f"[info] 準備 upsert：full={len(rows_full)}, stats-only={len(rows_stats)}")
 
-    # 7) 寫 DB（先 full 再 stats，避免舊資料覆蓋新 meta）
-    if rows_full:
-        upsert_dim_video_full(engine, rows_full)
-    if rows_full_update:
-        upsert_dim_video_full_update(engine, rows_full_update)
-    if rows_stats:
-        upsert_dim_video_stats_only(engine, rows_stats)
+    # 7) 寫 DB：三類列合併為單次 upsert（僅統計列的 meta 欄位以 COALESCE 保留既有值）
+    upsert_dim_video_smart(engine, rows_full + rows_full_update + rows_stats)
 
     print(f"[success] 完成更新：總筆數={len(rows_full) + len(rows_stats) + len(rows_full_update)}")
     print(f"新影片完整寫入數量  = {len(rows_full)}")
@@ -394,8 +403,9 @@ def run_top_videos(
     try:
         # 防呆：禁止非原子型別寫入定義欄位
         for i, row in enumerate(result_rows):
-            for k, v in row.items():
-                if k in KNOWN_FACT_WINDOW_COLS and isinstance(v, (dict, list)):
+            for k in row.keys() & KNOWN_FACT_WINDOW_COLS:
+                v = row[k]
+                if isinstance(v, (dict, list)):
                     raise ValueError(f"Row {i} column {k} is non-atomic type: {type(v).__name__} -> {v}")
         print(f"[top_videos] 寫入 fact_yta_video_window 中，批次筆數={len(result_rows)} ...")
         affected = upsert_fact_yta_video_window_bulk(engine, result_rows)
@@ -482,24 +492,29 @@ def _to_date(v):
     """
     if v is None:
         return None
-    if isinstance(v, date) and not isinstance(v, datetime):
+    if type(v) is date:  # 最常見情況：上游已是 date，直接回傳
         return v
     if isinstance(v, datetime):
         return v.date()
+    if isinstance(v, date):
+        return v
     if isinstance(v, str):
         return date.fromisoformat(v)
     raise ValueError(f"Invalid date: {v!r}")
 
-def _to_int_or_none(v):
+def _to_int_or_none(v, _int=int):
     """
     將輸入轉為 int；None 或空字串回傳 None；失敗回傳 None（容忍不合法數值）。
     - 用於 YA 指標欄位的安全轉換
+    - _int 以預設參數綁定為區域名稱，省去每次呼叫的全域/內建查找
     """
+    if type(v) is int:  # 快速路徑：YA 回傳的整數指標多已是 int，不必進 try/except
+        return v
     if v is None or v == "":
         return None
     try:
-        return int(v)
-    except:
+        return _int(v)
+    except (TypeError, ValueError, OverflowError):
         return None
 
 def _to_decimal_or_none(v):
@@ -507,20 +522,25 @@ def _to_decimal_or_none(v):
     將輸入轉為 Decimal；None 或空字串回傳 None；失敗回傳 None。
     - 用於 estimatedRevenue 等金額類欄位
     """
+    if type(v) is Decimal:  # 快速路徑：已是 Decimal 直接回傳
+        return v
     if v is None or v == "":
         return None
     try:
         return Decimal(str(v))
-    except:
+    except (ArithmeticError, TypeError, ValueError):
         return None
 
+# fact_yta_video_window 的整數型指標欄位
+_FACT_WINDOW_INT_COLS = ("views","estimatedMinutesWatched","likes","comments","shares","subscribersGained","subscribersLost","watchTime")
+
 def _normalize_row_for_fact_window(row: Dict[str, Any]) -> Dict[str, Any]:
     """
     將一列結果正規化為 fact_yta_video_window 可寫入的結構：
     - 必填檢查：channel_id、video_id、start_date、end_date
     - 型別轉換：日期欄位 -> date；published_at -> naive datetime
     - 指標欄位：views/likes/comments/... -> int or None；estimatedRevenue -> Decimal or None
-    - 其餘未定義欄位併入 ext_metrics（保留原始鍵值）
+    - 其餘未定義欄位併入 ext_metrics（保留原始鍵值）；移出後 r 只剩白名單欄位
     """
     r = dict(row)
     if not r.get("channel_id"): raise ValueError("channel_id required")
@@ -541,30 +561,45 @@ def _normalize_row_for_fact_window(row: Dict[str, Any]) -> Dict[str, Any]:
             r["video_published_at"] = None
 
     # 將常見整數型指標轉為 int 或 None
-    for k in ("views","estimatedMinutesWatched","likes","comments","shares","subscribersGained","subscribersLost","watchTime"):
-        r[k] = _to_int_or_none(r.get(k))
+    get = r.get
+    to_int = _to_int_or_none
+    for k in _FACT_WINDOW_INT_COLS:
+        r[k] = to_int(get(k))
     # 金額型
     r["estimatedRevenue"] = _to_decimal_or_none(r.get("estimatedRevenue"))
 
-    # 未定義欄位併入 ext_metrics（避免 schema 變更造成遺漏）
-    ext = {}
-    for k in list(r.keys()):
-        if k not in KNOWN_FACT_WINDOW_COLS:
-            ext[k] = r.pop(k)
+    # 未定義欄位併入 ext_metrics（避免 schema 變更造成遺漏）；以集合差一次取出白名單外的鍵
+    ext = {k: r.pop(k) for k in r.keys() - KNOWN_FACT_WINDOW_COLS}
     r["ext_metrics"] = ext or None
     return r
 
-def upsert_fact_yta_video_window_bulk(engine, rows: List[Dict[str, Any]]) -> int:
+# fact_yta_video_window 每次 executemany 的列數（PyMySQL 會將每批改寫為一條多值 INSERT）
+# 以「列數 × 欄數 < 60000」限制單批參數量（低於 MySQL 65535 佔位符上限），
+# 也讓 ext_metrics 較大時單一語句不易超過 max_allowed_packet
+FACT_WINDOW_MAX_PARAMS = 60_000
+FACT_WINDOW_CHUNK_SIZE = max(1, FACT_WINDOW_MAX_PARAMS // len(KNOWN_FACT_WINDOW_COLS))
+
+def upsert_fact_yta_video_window_bulk(engine, rows: List[Dict[str, Any]], chunk_size: int = FACT_WINDOW_CHUNK_SIZE) -> int:
     """
     將多列結果正規化後批次 upsert 至 fact_yta_video_window。
     - 步驟：
-      1) 先透過 _normalize_row_for_fact_window 做欄位檢查與型別轉換
-      2) 透過原生 cursor executemany 執行 UPSERT_SQL_FACT_WINDOW
-      3) 回傳受影響列數（受資料庫驅動 rowcount 行為影響）
+      1) 先透過 _normalize_row_for_fact_window 做欄位檢查與型別轉換（邊讀邊轉，不先建整份 list）
+      2) 同一交易內重用同一個原生 cursor，每 chunk_size 筆 executemany 一次 UPSERT_SQL_FACT_WINDOW；
+         PyMySQL 會把 VALUES 只含佔位符的 INSERT ... ON DUPLICATE KEY UPDATE 改寫成單一多值 INSERT，
+         SQL 每批只解析一次，而非每列一次
+      3) 回傳受影響列數（各批 rowcount 加總，受資料庫驅動 rowcount 行為影響）
     """
-    norm = [_normalize_row_for_fact_window(r) for r in rows]
+    norm = (_normalize_row_for_fact_window(r) for r in rows)
+    affected = 0
     with engine.begin() as conn:
         cur = get_raw_cursor(conn)
-        cur.executemany(UPSERT_SQL_FACT_WINDOW, norm)
-        affected = cur.rowcount
+        try:
+            while True:
+                chunk = list(islice(norm, chunk_size))
+                if not chunk:
+                    break
+                cur.executemany(UPSERT_SQL_FACT_WINDOW, chunk)
+                affected += cur.rowcount
+        finally:
+            cur.close()
     return affected
\ No newline at end of file
@@ -1,6 +1,7 @@
 # 路徑：scripts/track_velocity.py
 import sys
 import time, random
+from concurrent.futures import ThreadPoolExecutor
 import typer
 from rich.console import Console
 from typing import Optional, Dict, Any
@@ -79,14 +80,19 @@ def cmd_update_rankings():
     all_categories = ['15min', 'hourly', 'daily', 'weekly', 'monthly']
             
     print(f">> 準備更新排行榜: {all_categories}")
-    
-    for cat in all_categories:
+
+    def _update_one(cat: str) -> None:
         try:
             # 將 settings 傳遞給服務函式
             run_ranking_update(cat, cfg)
         except Exception as e:
             print(f"❌ 更新 {cat} 榜單時發生錯誤: {e}")
 
+    # 各榜單互不相依（DB 查詢 + Discord API），並行更新；
+    # 每個榜單各自 engine.connect()，共用 get_engine() 的連線池（預設 pool_size=10，足夠 5 榜單 × 2 條連線）
+    with ThreadPoolExecutor(max_workers=len(all_categories)) as pool:
+        list(pool.map(_update_one, all_categories))
+
 # 子命令：fetch_videos
 # 功能：列出頻道上傳清單並批次抓取影片詳情，更新本地資料（dim_video 等）
 @app.command("fetch_videos")
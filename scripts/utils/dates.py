@@ -1,14 +1,17 @@
 # scripts/utils/dates.py
 # 總覽：
 # - 日期工具：validate_date_str/parse_date/to_date/today_minus 提供日期字串驗證、解析與便捷換算。
-# - 資料庫查詢：get_last_ingested_day/get_channel_started_day 從資料庫取得頻道相關日期。
-# - 視窗計算：compute_window 依既有資料與限制計算抓取區間；default_dates_for_window_by_offset 以相對位移回傳日期區間；valid_date_str 作為 argparse 檢核。
+# - 資料庫查詢：_fetch_date_bounds 以單次查詢同時取得最後匯入日、頻道建立日與頻道是否存在。
+# - 視窗計算：compute_window 依既有資料與限制計算抓取區間（可順帶確保 dim_channel 存在）；default_dates_for_window_by_offset 以相對位移回傳日期區間；valid_date_str 作為 argparse 檢核。
 
 from __future__ import annotations
 from datetime import date, datetime, timedelta
 from typing import Optional, Tuple
 from sqlalchemy import text
 
+from scripts.db.db import use_connection, get_last_ingested_day
+from scripts.ingestion.dim_channel import ensure_dim_channel
+
 # --------- 基礎工具 ----------
 
 def validate_date_str(s: Optional[str]) -> Optional[str]:
@@ -73,34 +76,28 @@ def today_minus(days: int = 2, min_date: Optional[date] = None) -> date:
 
 # --------- DB 讀取工具 ----------
 
-def get_last_ingested_day(engine, channel_id: str) -> Optional[date]:
-    """
-    查詢 fact_yta_channel_daily 中此頻道最後一筆 day。
-    回傳 date 或 None。允許 engine 為 SQLAlchemy Engine。
-    - 用途：決定下一次抓取的起點（通常為最後一筆的隔天）
-    - SQL：SELECT MAX(day) FROM fact_yta_channel_daily WHERE channel_id = :cid
-    - 回傳：將查得的標量轉成 date（容忍 None）
-    """
-    sql = "SELECT MAX(day) FROM fact_yta_channel_daily WHERE channel_id = :cid"
-    with engine.connect() as conn:
-        r = conn.execute(text(sql), {"cid": channel_id}).scalar()
-        return to_date(r)
+_SQL_DATE_BOUNDS = text("""
+SELECT
+  (SELECT MAX(day) FROM fact_yta_channel_daily WHERE channel_id = :cid) AS last_day,
+  (SELECT started_on FROM dim_channel WHERE channel_id = :cid) AS started_on,
+  EXISTS (SELECT 1 FROM dim_channel WHERE channel_id = :cid) AS has_channel
+""")
 
-def get_channel_started_day(engine, channel_id: str) -> Optional[date]:
+def _fetch_date_bounds(engine, channel_id: str) -> Tuple[Optional[date], Optional[date], Optional[bool]]:
     """
-    從 dim_channel 取得頻道建立日（若有此欄位）。
-    若 dim_channel 未存，或欄位不存在/格式異常，回傳 None。
-    - 用途：避免抓取起始時間早於頻道存在時間
-    - SQL：SELECT started_on FROM dim_channel WHERE channel_id = :cid
-    - 錯誤處理：任何例外皆吞掉並回傳 None，以不影響流程
+    以單次查詢取得 (最後匯入日, 頻道建立日, dim_channel 是否已有此頻道)。
+    - SQL：純量子查詢組成一列（last_day, started_on, has_channel）
+    - 查詢失敗（例如 dim_channel.started_on 不存在）時退回 scripts.db.db.get_last_ingested_day
+      僅查最後匯入日，其餘兩者為 None（是否存在未知）。
     """
-    sql = "SELECT started_on FROM dim_channel WHERE channel_id = :cid"
-    with engine.connect() as conn:
-        try:
-            r = conn.execute(text(sql), {"cid": channel_id}).scalar()
-            return to_date(r)
-        except Exception:
-            return None
+    try:
+        with use_connection(engine) as conn:
+            row = conn.execute(_SQL_DATE_BOUNDS, {"cid": channel_id}).first()
+    except Exception:
+        return to_date(get_last_ingested_day(engine, channel_id)), None, None
+    if not row:
+        return None, None, None
+    return to_date(row[0]), to_date(row[1]), bool(row[2])
 
 # --------- 視窗計算 ----------
 
@@ -109,6 +106,8 @@ def compute_window(
     channel_id: str,
     default_start_date: str,
     hard_end_date: Optional[str] = None,
+    *,
+    ensure_channel: bool = False,
 ) -> Tuple[Optional[str], Optional[str]]:
     """
     計算本次抓取的起訖日期（YYYY-MM-DD 字串）。
@@ -119,6 +118,8 @@ def compute_window(
     - default_start_date 需為 YYYY-MM-DD；若格式錯誤將拋 ValueError。
     - 若計算後 start > end，回傳 (None, None) 代表無需抓取。
     - 這裡只回傳字串，以方便直接餵給 API 層或 SQL。
+    - ensure_channel=True 時一併確保 dim_channel 有此頻道：視窗查詢同時回傳頻道是否存在，
+      只有不存在（或無法判斷）時才補發 INSERT IGNORE；常態下整個步驟只需一次 DB 往返。
     """
     # 驗證/解析 default_start_date 與 hard_end_date（硬右界，若提供）
     ds = validate_date_str(default_start_date)
@@ -129,9 +130,10 @@ def compute_window(
     if not default_start:
         raise ValueError("default_start_date 格式錯誤，需為 YYYY-MM-DD")
 
-    # 從資料庫取得此頻道最後一次匯入日期與頻道建立日
-    last = get_last_ingested_day(engine, channel_id)  # e.g., 2025-10-10
-    ch_start = get_channel_started_day(engine, channel_id)
+    # 從資料庫取得此頻道最後一次匯入日期與頻道建立日（單次往返）
+    last, ch_start, has_channel = _fetch_date_bounds(engine, channel_id)  # e.g., (2025-10-10, None, True)
+    if ensure_channel and not has_channel:
+        ensure_dim_channel(engine, channel_id)
 
     # 建立起始候選集合：最後匯入日+1、頻道建立日、預設起點
     start_candidates: list[date] = []
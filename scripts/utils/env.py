@@ -1,12 +1,28 @@
 # scripts/utils/env.py
 # 總覽：
 # - 模組用途：統一載入 .env 與系統環境變數，整理與驗證設定鍵，並提供預設值。
-# - 主要函式：load_settings 讀取環境、去除空白、檢查必填（CHANNEL_ID/START_DATE/END_DATE/DB_URL），套用預設（OUTPUT_DIR/LOG_DIR）。
+# - 主要函式：load_settings 讀取環境、去除空白、檢查必填（CHANNEL_ID/START_DATE/END_DATE/DB_URL），套用預設（OUTPUT_DIR/LOG_DIR），並依 LOG_LEVEL 設定 logging。
+# - 快取：設定於程序內只載入一次，clear_settings_cache 可強制重新載入。
 # - 例外處理：若缺少必填鍵，透過 SystemExit 中止並輸出明確錯誤訊息。
 
 import os
+import threading
 from dotenv import load_dotenv
-from typing import Dict
+from typing import Dict, Optional
+
+from scripts.utils.log import setup_logging
+
+# 程序內設定快取：.env 解析與整理只做一次，之後的 load_settings 直接回傳副本
+_SETTINGS_CACHE: Optional[Dict[str, str]] = None
+_settings_lock = threading.Lock()
+
+def clear_settings_cache() -> None:
+    """
+    清除 load_settings 的快取；下次呼叫會重新讀取 .env 與系統環境（例如執行中修改了環境變數時）。
+    """
+    global _SETTINGS_CACHE
+    with _settings_lock:
+        _SETTINGS_CACHE = None
 
 def load_settings() -> Dict[str, str]:
     """
@@ -14,21 +30,29 @@ def load_settings() -> Dict[str, str]:
     - 必填鍵：CHANNEL_ID、START_DATE、END_DATE、DB_URL（缺少時以 SystemExit 結束並列出缺項）
     - 預設鍵：OUTPUT_DIR="data"、LOG_DIR="logs"（若未提供才套用）
     - 正規化：會將所有字串值去除前後空白，避免因空白造成判斷錯誤
+    - 快取：同一程序內只實際載入一次（多個步驟、探針與重試迴圈共用），每次回傳淺拷貝，
+      呼叫端修改回傳值不會影響快取；需重新載入時呼叫 clear_settings_cache()。
+    """
+    global _SETTINGS_CACHE
+    with _settings_lock:
+        if _SETTINGS_CACHE is None:
+            _SETTINGS_CACHE = _load_settings_uncached()
+        return dict(_SETTINGS_CACHE)
+
+def _load_settings_uncached() -> Dict[str, str]:
+    """
+    load_settings 的實際載入流程（不經快取）。
     """
     # 1) 從專案根目錄或當前工作目錄讀取 .env，載入到 process 環境變數中
     #    設定 override=False 以避免覆蓋已存在的系統環境（例如在部署環境由外部注入的密鑰）
     load_dotenv(override=False)
 
-    # 2) 取得目前所有環境變數（已包含 .env 載入的鍵）
-    #    將其複製為一個普通 dict（鍵/值均為字串）
-    settings: Dict[str, str] = {k: v for k, v in os.environ.items()}
+    # 2) 取得目前所有環境變數（已包含 .env 載入的鍵）的快照，並同時正規化值：
+    #    單次走訪 os.environ，複製為普通 dict 時即去除前後空白（避免「空白字串」造成必填判斷誤判），
+    #    不再先複製再逐鍵回寫
+    settings: Dict[str, str] = {k: v.strip() for k, v in os.environ.items()}
 
-    # 3) 正規化值：去除每個字串值的前後空白，避免「空白字串」造成必填判斷誤判
-    for k, v in list(settings.items()):
-        if isinstance(v, str):
-            settings[k] = v.strip()
-
-    # 4) 檢查必填鍵是否存在且非空
+    # 3) 檢查必填鍵是否存在且非空
     #    - CHANNEL_ID：YouTube 頻道 ID
     #    - START_DATE/END_DATE：日期區間（YYYY-MM-DD）
     #    - DB_URL：資料庫連線字串
@@ -38,11 +62,14 @@ def load_settings() -> Dict[str, str]:
         # 使用 SystemExit 以明確中止程序，並輸出缺少的鍵名，便於在 CI/啟動時立即發現配置問題
         raise SystemExit(f"[ERROR] Missing env: {', '.join(missing)}")
 
-    # 5) 設定可選鍵的預設值（若未提供才套用）
+    # 4) 設定可選鍵的預設值（若未提供才套用）
     #    - OUTPUT_DIR：輸出資料目錄，預設 data
     #    - LOG_DIR：日誌目錄，預設 logs
     settings.setdefault("OUTPUT_DIR", "data")
     settings.setdefault("LOG_DIR", "logs")
 
+    # 5) 依 LOG_LEVEL 設定 logging（預設 INFO），各模組的 logger 輸出由此生效
+    setup_logging(settings.get("LOG_LEVEL"))
+
     # 6) 回傳整理後的設定字典，供應用其餘部分統一使用
     return settings
\ No newline at end of file
@@ -0,0 +1,41 @@
+# scripts/utils/log.py
+# 總覽：
+# - setup_logging：為專案設定 logging（一次性），輸出到「當下的」sys.stdout，
+#   讓 runner 以執行緒分派捕捉的 stdout 也能收到 logger 輸出（併入通知摘要）。
+# - 等級由 LOG_LEVEL（.env）決定，預設 INFO；關閉的等級連字串格式化都會略過（%s 延遲格式化）。
+
+import logging
+import sys
+from typing import Optional
+
+class _CurrentStdoutHandler(logging.StreamHandler):
+    """
+    每次 emit 都寫入當下的 sys.stdout（而非建立時的物件），
+    runner 暫時替換 sys.stdout 捕捉步驟輸出時，log 也會一併被捕捉。
+    """
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+_handler: Optional[logging.Handler] = None
+
+def setup_logging(level: Optional[str] = None) -> None:
+    """
+    設定 logging：handler 掛在 root（輸出格式與 print 相同，僅訊息本身），
+    專案 logger（"scripts" 底下）的等級取自參數（如 "INFO"、"DEBUG"）。
+    - 第三方套件（googleapiclient 等）維持 WARNING 以上才輸出，避免洗版。
+    - 可重複呼叫：handler 只安裝一次，後續呼叫僅更新等級。
+    - 無效的等級字串退回 INFO。
+    """
+    global _handler
+    root = logging.getLogger()
+    if _handler is None:
+        _handler = _CurrentStdoutHandler()
+        _handler.setFormatter(logging.Formatter("%(message)s"))
+        root.addHandler(_handler)
+    lv = logging.getLevelName((level or "INFO").strip().upper())
+    logging.getLogger("scripts").setLevel(lv if isinstance(lv, int) else logging.INFO)
@@ -8,12 +8,15 @@
 # - 自訂輸出檔名：python scripts/utils/tree.py --out docs/TREE.md
 #   → 產出 docs/TREE_YYYYMMDD_HHMMSS.md
 # - 調整排除目錄：python scripts/utils/tree.py --exclude .git .venv __pycache__
+# - 調整並行走訪的執行緒數：python scripts/utils/tree.py --jobs 8（網路檔案系統上可調高）
 
 import os
 import platform
 import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Iterable, Set
+from typing import Iterable, Iterator, List, Set
 from datetime import datetime
 
 def clear_terminal() -> None:
@@ -33,38 +36,88 @@ DEFAULT_EXCLUDE_DIRS = {
 }
 DEFAULT_EXCLUDE_FILES = {'.DS_Store'}
 
-def build_tree(root: Path, prefix: str = '', exclude_dirs: Set[str] = None, exclude_files: Set[str] = None) -> str:
+# 頂層子目錄並行走訪的預設執行緒數（scandir/stat 系統呼叫期間會釋放 GIL）
+DEFAULT_JOBS = min(32, (os.cpu_count() or 1) * 4)
+
+def _scan_sorted(path: str, exclude_dirs: Set[str], exclude_files: Set[str]) -> list:
+    # os.scandir 的 DirEntry 已帶有檔案型別，is_dir/is_file 不需再各自 stat；with 區塊確保目錄 handle 即時關閉
+    # 先排除再排序：大量 __pycache__/.venv 之類的項目不進入排序
+    with os.scandir(path) as it:
+        entries = [e for e in it if e.name not in exclude_files and e.name not in exclude_dirs]
+    entries.sort(key=lambda d: (d.is_file(follow_symlinks=False), d.name.lower()))
+    return entries
+
+def _push_children(stack: list, path: str, prefix: str, exclude_dirs: Set[str], exclude_files: Set[str]) -> None:
+    # 反序入堆疊，pop 時即為排序後的順序；每筆 frame 為 (路徑, 名稱, 是否目錄, 本行前綴, 子層前綴)
+    entries = _scan_sorted(path, exclude_dirs, exclude_files)
+    last = len(entries) - 1
+    for i in range(last, -1, -1):
+        e = entries[i]
+        is_last = (i == last)
+        stack.append((
+            e.path,
+            e.name,
+            e.is_dir(follow_symlinks=False),
+            f"{prefix}{'└─ ' if is_last else '├─ '}",
+            f"{prefix}{'   ' if is_last else '│  '}",
+        ))
+
+def iter_tree(root: str, prefix: str = '', exclude_dirs: Set[str] = None, exclude_files: Set[str] = None) -> Iterator[str]:
+    # 以顯式堆疊做深度優先走訪，每個項目產生一行即 yield（不逐層遞迴/拼接子樹字串；常駐記憶體只有堆疊本身）
     exclude_dirs = exclude_dirs or set()
     exclude_files = exclude_files or set()
-    entries = [
-        e for e in sorted(root.iterdir(), key=lambda p: (p.is_file(), p.name.lower()))
-        if e.name not in exclude_files and e.name not in exclude_dirs
-    ]
-    lines = []
-    for i, e in enumerate(entries):
-        is_last = (i == len(entries) - 1)
-        connector = '└─ ' if is_last else '├─ '
-        if e.is_dir():
-            lines.append(f"{prefix}{connector}{e.name}/")
-            ext_prefix = f"{prefix}{'   ' if is_last else '│  '}"
-            subtree = build_tree(e, ext_prefix, exclude_dirs, exclude_files)
-            if subtree:
-                lines.append(subtree)
+    stack = []
+    _push_children(stack, root, prefix, exclude_dirs, exclude_files)
+    while stack:
+        path, name, is_dir, line_prefix, ext_prefix = stack.pop()
+        if is_dir:
+            yield f"{line_prefix}{name}/"
+            _push_children(stack, path, ext_prefix, exclude_dirs, exclude_files)
         else:
-            lines.append(f"{prefix}{connector}{e.name}")
-    return '\n'.join(lines)
+            yield f"{line_prefix}{name}"
+
+def build_tree(root: str, prefix: str = '', exclude_dirs: Set[str] = None, exclude_files: Set[str] = None) -> str:
+    return '\n'.join(iter_tree(root, prefix, exclude_dirs, exclude_files))
 
-def render_project_tree(exclude_dirs: Set[str], exclude_files: Set[str]) -> str:
+def _collect_tree(root: str, prefix: str, exclude_dirs: Set[str], exclude_files: Set[str]) -> List[str]:
+    return list(iter_tree(root, prefix, exclude_dirs, exclude_files))
+
+def iter_project_tree(exclude_dirs: Set[str], exclude_files: Set[str], jobs: int = DEFAULT_JOBS) -> Iterator[str]:
     root = Path(__file__).resolve().parents[2]  # 專案根目錄
-    return f"{root.name}/\n" + build_tree(root, '', exclude_dirs, exclude_files)
+    entries = _scan_sorted(str(root), exclude_dirs, exclude_files)
+    last = len(entries) - 1
+    # 各頂層子目錄的子樹互相獨立：交給執行緒池並行走訪，再依排序順序與檔案行交錯輸出（前面的子樹一完成即可開始輸出）
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        parts = []
+        for i, e in enumerate(entries):
+            is_last = (i == last)
+            connector = '└─ ' if is_last else '├─ '
+            if e.is_dir(follow_symlinks=False):
+                ext_prefix = '   ' if is_last else '│  '
+                parts.append((f"{connector}{e.name}/", pool.submit(_collect_tree, e.path, ext_prefix, exclude_dirs, exclude_files)))
+            else:
+                parts.append((f"{connector}{e.name}", None))
+        yield f"{root.name}/"
+        for line, fut in parts:
+            yield line
+            if fut is not None:
+                yield from fut.result()
+
+def render_project_tree(exclude_dirs: Set[str], exclude_files: Set[str], jobs: int = DEFAULT_JOBS) -> str:
+    return '\n'.join(iter_project_tree(exclude_dirs, exclude_files, jobs))
 
-def write_docs(doc_path: Path, tree_str: str):
+def write_docs(doc_path: Path, lines: Iterable[str], echo: bool = False):
+    # 逐行寫入文件；echo=True 時同步印到終端（邊走訪邊輸出，不先組出整份字串）
     doc_path.parent.mkdir(parents=True, exist_ok=True)
     with doc_path.open('w', encoding='utf-8') as f:
         f.write("# 專案檔案樹（自動生成）\n\n")
         f.write("```\n")
-        f.write(tree_str)
-        f.write("\n```\n")
+        for line in lines:
+            if echo:
+                print(line)
+            f.write(line)
+            f.write("\n")
+        f.write("```\n")
     print(f"[OK] Wrote tree to {doc_path}")
 
 def make_timestamped_path(out_arg: str) -> Path:
@@ -97,6 +150,7 @@ def main():
     parser = argparse.ArgumentParser(description="輸出專案檔案樹：同步顯示於終端並寫入文件（自動帶入日期時間戳記）")
     parser.add_argument('--out', type=str, default='', help='輸出檔案或目錄（留空則輸出至 docs/PROJECT_TREE_YYYYMMDD_HHMMSS.md）')
     parser.add_argument('--exclude', nargs='*', default=[], help='額外排除的目錄/檔名（以名稱比對）')
+    parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS, help=f'並行走訪頂層子目錄的執行緒數（預設 {DEFAULT_JOBS}）')
     args = parser.parse_args()
 
     # 合併排除清單（目錄與檔案名稱同名時也會被排除）
@@ -106,14 +160,13 @@ def main():
         exclude_dirs.add(name)
         exclude_files.add(name)
 
-    tree_str = render_project_tree(exclude_dirs, exclude_files)
-
-    # 1) 顯示到終端
-    print(tree_str)
+    # 行緩衝：每產生一行就立即顯示在終端
+    if hasattr(sys.stdout, "reconfigure"):
+        sys.stdout.reconfigure(line_buffering=True)
 
-    # 2) 產生帶時間戳記的輸出路徑並輸出成文件
+    # 產生帶時間戳記的輸出路徑，邊走訪邊同步顯示到終端並寫入文件
     out_path = make_timestamped_path(args.out)
-    write_docs(out_path, tree_str)
+    write_docs(out_path, iter_project_tree(exclude_dirs, exclude_files, jobs=args.jobs), echo=True)
 
 if __name__ == '__main__':
     clear_terminal()
@@ -1,7 +1,7 @@
 # scripts/youtube/client.py
 # 總覽：
 # - 憑證/設定輔助：_scopes_from_settings、_get_credentials_path/_get_token_path/_get_port（從 settings 解析 OAuth 參數）
-# - 重試機制：with_retries 裝飾器 + call_with_retries 包裝任意 API 呼叫（對 429/5xx 指數退避）
+# - 重試機制：with_retries 裝飾器 + call_with_retries 包裝任意 API 呼叫（對 429/5xx 指數退避；_retry_runner 依參數快取裝飾結果）
 # - OAuth 流程：_load_credentials 載入/刷新/互動授權，get_youtube_data_client 建立 googleapiclient 服務，get_bearer_token 取 access token
 # - 診斷工具：debug_describe_auth 回傳目前設定與憑證健康狀態摘要（不含敏感內容）
 
@@ -9,6 +9,7 @@ from __future__ import annotations
 
 import json
 import os
+import random
 import time
 import functools
 from typing import Callable, Dict, List, Optional, TypeVar, Any
@@ -75,15 +76,31 @@ def _get_port(settings: Dict[str, str]) -> int:
 # 指數退避重試（可用於包裝 Data API 呼叫）
 # ------------------------------
 
+# Retry-After 等待上限（秒）：避免伺服端給出過大的值讓管線長時間卡住（與 videos.RETRY_AFTER_MAX_SEC 一致）
+RETRY_AFTER_MAX_SEC = 60.0
+
+def _retry_after_seconds(err: Exception) -> Optional[float]:
+    """
+    從 HttpError 回應標頭取出 Retry-After（秒數格式）；非 HttpError 或未提供時回傳 None。
+    """
+    if not isinstance(err, HttpError):
+        return None
+    raw = (getattr(err, "resp", None) or {}).get("retry-after")
+    try:
+        return max(0.0, float(raw)) if raw is not None else None
+    except (TypeError, ValueError):
+        return None
+
 def with_retries(max_retries: int = 5, backoff_base: float = 1.5, retry_on: Optional[List[int]] = None):
     """
     裝飾器：對暫時性錯誤實施退避重試（適用於 googleapiclient 呼叫）。
     - 參數：
       - max_retries：最大重試次數（不含首次呼叫）；實際嘗試最多為 1 + max_retries 次。
-      - backoff_base：退避底數；等待秒數為 backoff_base ** attempt（attempt 從 0 起）。
+      - backoff_base：退避底數；等待秒數為 uniform(0, backoff_base ** attempt)（full jitter，attempt 從 0 起）。
       - retry_on：需重試的 HTTP 狀態碼集合；預設 [429, 500, 502, 503, 504]。
     - 行為：
-      - 捕捉 HttpError，若狀態碼在 retry_on 且尚未超過次數上限，則 sleep 後重試。
+      - 捕捉 HttpError，若狀態碼在 retry_on 且尚未超過次數上限，則 sleep 後重試；
+        回應帶 Retry-After 時，等待時間至少為該值（上限 RETRY_AFTER_MAX_SEC）。
       - 其他錯誤或超過次數上限，直接拋出原例外。
     """
     if retry_on is None:
@@ -103,7 +120,10 @@ def with_retries(max_retries: int = 5, backoff_base: float = 1.5, retry_on: Opti
                     if status is None:
                         status = getattr(e, "status_code", None)
                     if isinstance(status, int) and status in retry_on and attempt < max_retries:
-                        sleep_s = backoff_base ** attempt
+                        sleep_s = random.uniform(0, backoff_base ** attempt)
+                        retry_after = _retry_after_seconds(e)
+                        if retry_after is not None:
+                            sleep_s = min(RETRY_AFTER_MAX_SEC, max(sleep_s, retry_after))
                         time.sleep(sleep_s)
                         attempt += 1
                         continue
@@ -175,9 +195,10 @@ def get_youtube_data_client(settings: Dict[str, str]):
     建立並回傳 YouTube Data API v3 的 googleapiclient 服務物件。
     - 用途：需要 OAuth 的寫入/管理操作（如 playlistItems.insert、videos.update 等）。
     - 關閉 discovery 快取以避免某些部署環境的檔案權限問題。
+    - 使用套件內建的靜態 discovery 文件（static_discovery=True），省去啟動時的 HTTPS 抓取。
     """
     creds = _load_credentials(settings)
-    return build("youtube", "v3", credentials=creds, cache_discovery=False)
+    return build("youtube", "v3", credentials=creds, cache_discovery=False, static_discovery=True)
 
 def get_bearer_token(settings: Dict[str, str]) -> str:
     """
@@ -196,6 +217,17 @@ def get_bearer_token(settings: Dict[str, str]) -> str:
 #   resp = call_with_retries(lambda: yt.playlistItems().insert(...).execute(), settings)
 # ------------------------------
 
+def _invoke(callable_fn: Callable[[], T]) -> T:
+    return callable_fn()
+
+@functools.lru_cache(maxsize=16)
+def _retry_runner(max_retries: int, backoff_base: float) -> Callable[[Callable[[], T]], T]:
+    """
+    依 (max_retries, backoff_base) 快取套好重試的執行器：runner(fn) 會以退避重試呼叫 fn()。
+    - 同一組參數只建立一次裝飾後的函式，call_with_retries 不必每次呼叫都重建閉包。
+    """
+    return with_retries(max_retries=max_retries, backoff_base=backoff_base)(_invoke)
+
 def call_with_retries(callable_fn: Callable[[], T], settings: Optional[Dict[str, str]] = None) -> T:
     """
     以設定檔參數包裝一次性呼叫並套用退避重試。
@@ -217,11 +249,7 @@ def call_with_retries(callable_fn: Callable[[], T], settings: Optional[Dict[str,
         except Exception:
             pass
 
-    @with_retries(max_retries=max_retries, backoff_base=backoff_base)
-    def _wrapped():
-        return callable_fn()
-
-    return _wrapped()
+    return _retry_runner(max_retries, backoff_base)(callable_fn)
 
 # ------------------------------
 # 健康檢查/診斷（可選）
@@ -1,20 +1,56 @@
 # scripts/youtube/playlists.py
 # 總覽：
 # - _get_uploads_playlist_id：查詢頻道的 uploads 播放清單 ID（channels.list -> contentDetails.relatedPlaylists.uploads）
-# - fetch_channel_video_ids：以 uploads 清單遍歷 playlistItems，依日期區間過濾回傳 videoId 列表
-# - 工具函式：_get_with_retry（含退避重試）、_rfc3339_day_start/_end（日界線轉換）、_parse_rfc3339（轉 naive UTC）
+# - iter_channel_video_id_pages：以 uploads 清單遍歷 playlistItems（處理本頁時預先抓取下一頁），依日期區間過濾後逐頁產出 videoId
+# - fetch_channel_video_ids：上者的整份列表版本
+# - fetch_latest_upload_id：只讀 uploads 清單第一頁的第一筆，作為「是否有新上傳」的低成本探測
+# - 工具函式：_get_with_retry（含退避重試與 _throttle 每秒請求上限，經共用 Session 重用連線、共用 _decode_json 解碼）、_rfc3339_day_start/_end（日界線轉換）、_parse_rfc3339（轉 naive UTC）
 
+import random
+import threading
 import time
-from typing import List, Optional, Dict, Any, Iterable
-import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain
+from typing import List, Optional, Dict, Any, Iterable, Iterator, Set
 from datetime import datetime, timezone
 
+from scripts.youtube.videos import (
+    RETRY_AFTER_MAX_SEC,
+    _YT_SESSION,
+    _decode_json,
+    _parse_rfc3339_to_naive_utc,
+    _retry_after_seconds,
+)
+
 # YouTube Data API v3 的 base URL
 YOUTUBE_API_BASE = "https://www.googleapis.com/youtube/v3"
 
 # 視為可重試的狀態碼（429: rate limit, 403: 某些暫時限制, 5xx: 伺服器錯誤）
 RETRY_STATUS = {429, 403, 500, 502, 503, 504}
 
+# 本模組請求的每秒上限（滑動 1 秒視窗，跨執行緒共用）；未達上限時不等待，只有突發超量才延後
+PLAYLISTS_MAX_QPS = 8
+_QPS_WINDOW: deque = deque()
+_QPS_LOCK = threading.Lock()
+
+def _throttle(qps: int = PLAYLISTS_MAX_QPS) -> None:
+    """
+    滑動視窗限速：最近 1 秒內已送出（或已預約）qps 個請求時，等到最早的一個滑出視窗再送。
+    - 於鎖內預約送出時間後即釋放鎖，實際 sleep 在鎖外進行，其他執行緒可同時預約後續時段
+    """
+    with _QPS_LOCK:
+        now = time.monotonic()
+        while _QPS_WINDOW and now - _QPS_WINDOW[0] >= 1.0:
+            _QPS_WINDOW.popleft()
+        wait = 0.0
+        if len(_QPS_WINDOW) >= qps:
+            wait = max(0.0, 1.0 - (now - _QPS_WINDOW[-qps]))
+        _QPS_WINDOW.append(now + wait)
+    if wait > 0:
+        time.sleep(wait)
+
 def _rfc3339_day_start(day_str: str) -> str:
     """
     將 YYYY-MM-DD 轉為該日 UTC 起始時間的 RFC3339 字串：YYYY-MM-DDT00:00:00Z
@@ -42,26 +78,33 @@ def _parse_rfc3339(s: str) -> datetime:
     - 輸入例：'2025-01-31T12:34:56Z' 或 '2025-01-31T12:34:56+00:00'
     - 流程：先解析為 aware，再轉為 UTC，最後去除 tzinfo 成為 naive UTC
     - 好處：便於與其他以 naive UTC 表示的時間做大小比較
+    - 與 videos 共用同一解析器（'...Z' 固定格式走切片快速路徑）
     """
-    dt = datetime.fromisoformat(s.replace("Z", "+00:00"))
-    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return _parse_rfc3339_to_naive_utc(s)
 
 def _get_with_retry(url: str, params: Dict[str, Any], max_retries: int = 5, backoff_base: float = 0.8) -> Dict[str, Any]:
     """
-    封裝 requests.get，於特定狀態碼（RETRY_STATUS）時進行指數退避重試。
+    封裝 GET（經與 videos 共用的 _YT_SESSION 重用連線），於特定狀態碼（RETRY_STATUS）時進行指數退避重試。
+    - 每次送出前經 _throttle 控制每秒請求數（PLAYLISTS_MAX_QPS）
     - max_retries：最大嘗試次數（包含首次），此實作會跑最多 max_retries 次 requests
-    - backoff：等待秒數 = (backoff_base ** i) * 2 + i*0.1（隨 i 遞增）
-    - 成功回傳：resp.json() 字典
+    - backoff：等待秒數 = uniform(0, (backoff_base ** i) * 2)（full jitter：多個執行緒同時遇到 429 時不會同步重試）；
+      回應帶 Retry-After 時改依該值等待（上限 RETRY_AFTER_MAX_SEC）
+    - 成功回傳：JSON 解碼後的字典（經 _decode_json，有 orjson 時優先使用）
     - 失敗策略：遇到非可重試狀態碼直接 raise_for_status；重試用盡則丟 RuntimeError
     """
     last_err = None
     for i in range(max_retries):
-        resp = requests.get(url, params=params, timeout=30)
+        _throttle()
+        resp = _YT_SESSION.get(url, params=params, timeout=30)
         if resp.status_code == 200:
-            return resp.json()
+            return _decode_json(resp)
         if resp.status_code in RETRY_STATUS:
-            # 指數退避：嘗試次數越多，等待越久；外加少量線性項以避免完全一致
-            sleep_s = (backoff_base ** i) * 2 + (i * 0.1)
+            # 伺服端有指定 Retry-After 則依其等待；否則在指數退避上限內隨機等待，打散同時受限的請求
+            retry_after = _retry_after_seconds(resp)
+            if retry_after is not None:
+                sleep_s = min(RETRY_AFTER_MAX_SEC, retry_after)
+            else:
+                sleep_s = random.uniform(0, (backoff_base ** i) * 2)
             time.sleep(sleep_s)
             last_err = (resp.status_code, resp.text)
             continue
@@ -70,9 +113,11 @@ def _get_with_retry(url: str, params: Dict[str, Any], max_retries: int = 5, back
     # 用盡重試仍失敗，將最後一次錯誤資訊納入訊息
     raise RuntimeError(f"GET {url} failed after retries: {last_err}")
 
+@lru_cache(maxsize=64)
 def _get_uploads_playlist_id(yt_api_key: str, channel_id: str) -> str:
     """
     從 channels.list 查詢指定 channel 的 uploads 播放清單 ID（relatedPlaylists.uploads）。
+    - 頻道的 uploads 清單 ID 固定不變，同一程序內以 lru_cache 只查詢一次（例外不會被快取）
     - yt_api_key：API Key
     - channel_id：目標頻道（UC 開頭）
     回傳：
@@ -88,6 +133,7 @@ def _get_uploads_playlist_id(yt_api_key: str, channel_id: str) -> str:
         "id": channel_id,
         "key": yt_api_key,
         "maxResults": 1,
+        "fields": "items/contentDetails/relatedPlaylists/uploads",
     }
     # 執行請求（含重試）
     data: Dict[str, Any] = _get_with_retry(url, params)
@@ -108,16 +154,61 @@ def _get_uploads_playlist_id(yt_api_key: str, channel_id: str) -> str:
 
     return uploads
 
-def fetch_channel_video_ids(
+def _collect_page_ids(
+    data: Dict[str, Any],
+    ids: List[str],
+    after_dt: Optional[datetime],
+    before_dt: Optional[datetime],
+) -> None:
+    """
+    過濾單頁 playlistItems 的項目，將符合日期區間的 videoId 依序加入 ids。
+    """
+    items = data.get("items") or []
+
+    # 未設定任何區間邊界：只需 videoId，不讀 snippet、不解析 publishedAt
+    if after_dt is None and before_dt is None:
+        for it in items:
+            vid = (it.get("contentDetails") or {}).get("videoId")
+            if vid:
+                ids.append(vid)
+        return
+
+    for it in items:
+        cd = it.get("contentDetails") or {}
+        sn = it.get("snippet") or {}
+
+        vid = cd.get("videoId")
+        pub = sn.get("publishedAt")  # RFC3339
+
+        # 缺 videoId 的項目直接跳過（極少見）
+        if not vid:
+            continue
+
+        # 依 publishedAt 做時間過濾（缺 publishedAt 時不過濾）
+        if pub:
+            pub_dt = _parse_rfc3339(pub)
+
+            # 起始邊界：pub_dt < after_dt 則排除
+            if after_dt and pub_dt < after_dt:
+                continue
+            # 結束邊界：pub_dt > before_dt 則排除
+            if before_dt and pub_dt > before_dt:
+                continue
+
+        # 通過過濾，加入結果
+        ids.append(vid)
+
+def iter_channel_video_id_pages(
     yt_api_key: str,
     channel_id: str,
     published_after: Optional[str],
     published_before: Optional[str],
-) -> List[str]:
+) -> Iterator[List[str]]:
     """
-    以頻道的 uploads 播放清單為資料來源，列舉指定日期區間內的所有 videoId。
+    以頻道的 uploads 播放清單為資料來源，逐頁產出指定日期區間內的 videoId（每頁最多 50 筆）。
     - 日期過濾依據：playlistItems.snippet.publishedAt（加入 uploads 的時間，通常等於影片發布時間）
     - 區間策略：after 使用當日 00:00:00Z（含），before 使用當日 23:59:59Z（含）；任一端為 None 表示不限制
+    - 呼叫端可在後續頁面仍在分頁時，先以已產出的頁面開始 videos.list 等下游處理
 
     參數：
     - yt_api_key：API Key
@@ -125,8 +216,8 @@ def fetch_channel_video_ids(
     - published_after：起日（YYYY-MM-DD 或 None）
     - published_before：迄日（YYYY-MM-DD 或 None）
 
-    回傳：
-    - 符合條件的 videoId 字串列表（依分頁完整遍歷）
+    產出：
+    - 每頁通過過濾的 videoId 列表（處理本頁時下一頁已在背景請求中；跨頁去重、保留順序；不產出空頁）
     """
     # 先取得該頻道的 uploads 播放清單 ID
     uploads_id = _get_uploads_playlist_id(yt_api_key, channel_id)
@@ -135,57 +226,79 @@ def fetch_channel_video_ids(
     after_dt = _parse_rfc3339(_rfc3339_day_start(published_after)) if published_after else None
     before_dt = _parse_rfc3339(_rfc3339_day_end(published_before)) if published_before else None
 
-    # playlistItems.list 端點：抓取 videoId 與 publishedAt（過濾用）
+    # playlistItems.list 端點：抓取 videoId 與 publishedAt（過濾用）；不限日期時連 snippet 都不要求
+    # 只回傳分頁 token、videoId 與 publishedAt（略過標題、描述、縮圖等未使用欄位）
     url = f"{YOUTUBE_API_BASE}/playlistItems"
+    if after_dt is None and before_dt is None:
+        part, fields = "contentDetails", "nextPageToken,items/contentDetails/videoId"
+    else:
+        part, fields = "contentDetails,snippet", "nextPageToken,items(contentDetails/videoId,snippet/publishedAt)"
     params = {
-        "part": "contentDetails,snippet",
+        "part": part,
         "playlistId": uploads_id,
         "key": yt_api_key,
         "maxResults": 50,  # 單頁最大值
+        "fields": fields,
     }
 
-    ids: List[str] = []   # 收集通過過濾的 videoId
+    # 翻頁期間若有新上傳，項目會往後位移而在下一頁重複出現：以 seen 跨頁去重
+    seen: Set[str] = set()
     page_count = 0        # 計數翻頁次數（可作為除錯或監控指標）
 
-    # 逐頁拉取 uploads 清單
-    while True:
+    # 逐頁拉取 uploads 清單；拿到本頁後立即以背景執行緒送出下一頁請求，再於主執行緒過濾並產出本頁
+    # （同時最多只有一個請求在途，請求數與序列版本相同；每秒上限由 _throttle 控制）
+    with ThreadPoolExecutor(max_workers=1) as prefetch:
         data = _get_with_retry(url, params)
-        items = data.get("items") or []
-
-        for it in items:
-            cd = it.get("contentDetails") or {}
-            sn = it.get("snippet") or {}
+        while True:
+            page_token = data.get("nextPageToken")
+            next_page = None
+            if page_token:
+                next_params = dict(params, pageToken=page_token)
+                next_page = prefetch.submit(_get_with_retry, url, next_params)
 
-            vid = cd.get("videoId")
-            pub = sn.get("publishedAt")  # RFC3339
+            page_ids: List[str] = []
+            _collect_page_ids(data, page_ids, after_dt, before_dt)
+            fresh = [v for v in page_ids if v not in seen]
+            if fresh:
+                seen.update(fresh)
+                yield fresh
 
-            # 缺 videoId 的項目直接跳過（極少見）
-            if not vid:
-                continue
-
-            # 若有設定區間邊界，則依 publishedAt 做時間過濾
-            if (after_dt or before_dt) and pub:
-                pub_dt = _parse_rfc3339(pub)
-
-                # 起始邊界：pub_dt < after_dt 則排除
-                if after_dt and pub_dt < after_dt:
-                    continue
-                # 結束邊界：pub_dt > before_dt 則排除
-                if before_dt and pub_dt > before_dt:
-                    continue
-
-            # 通過過濾，加入結果
-            ids.append(vid)
+            # 處理分頁：有 nextPageToken 則取用預先抓取的結果，否則結束
+            if next_page is None:
+                break
+            data = next_page.result()
+            page_count += 1
 
-        # 處理分頁：有 nextPageToken 則續抓，否則結束
-        page_token = data.get("nextPageToken")
-        if not page_token:
-            break
-
-        params["pageToken"] = page_token
-        page_count += 1
-
-        # 輕量節流：避免突發高 QPS 觸發限速；如有更嚴 QPS 管理可提高此值
-        time.sleep(0.05)
+def fetch_channel_video_ids(
+    yt_api_key: str,
+    channel_id: str,
+    published_after: Optional[str],
+    published_before: Optional[str],
+) -> List[str]:
+    """
+    列舉指定日期區間內的所有 videoId（iter_channel_video_id_pages 的整份列表版本）。
+    - 回傳：符合條件的 videoId 字串列表（依分頁完整遍歷；已去重、保留順序）
+    """
+    return list(chain.from_iterable(
+        iter_channel_video_id_pages(yt_api_key, channel_id, published_after, published_before)
+    ))
 
-    return ids
\ No newline at end of file
+def fetch_latest_upload_id(yt_api_key: str, channel_id: str) -> Optional[str]:
+    """
+    取得頻道 uploads 播放清單最新一筆的 videoId（清單依加入時間新到舊排列）。
+    - 只取第一頁 1 筆、僅回傳 videoId 欄位，作為「自上次完整列舉後是否有新上傳」的低成本探測
+    - 清單為空時回傳 None
+    """
+    uploads_id = _get_uploads_playlist_id(yt_api_key, channel_id)
+    params = {
+        "part": "contentDetails",
+        "playlistId": uploads_id,
+        "key": yt_api_key,
+        "maxResults": 1,
+        "fields": "items/contentDetails/videoId",
+    }
+    data = _get_with_retry(f"{YOUTUBE_API_BASE}/playlistItems", params)
+    items = data.get("items") or []
+    if not items:
+        return None
+    return (items[0].get("contentDetails") or {}).get("videoId")
@@ -1,25 +1,83 @@
 # scripts/youtube/videos.py
 # 總覽：
-# - fetch_videos_details_batch：批次呼叫 YouTube videos.list，解析常用欄位並回傳含 raw parts 的列表（不在此決定 video_type）。
+# - fetch_videos_details_batch：批次呼叫 YouTube videos.list，解析常用欄位並回傳含 raw parts 的列表（不在此決定 video_type；parts 可選完整或僅統計）。
 # - _decide_video_type + 輔助函式：依直播狀態、時長與發佈時間，以及最終導向 URL（shorts/watch）判定影片型別。
-# - _get_with_retry：對 requests.get 加上簡易重試與退避；_parse_*：處理 RFC3339 時間與 ISO 8601 時長解析；fetch_video_meta_map：從資料庫讀取影片基本資料映射。
+# - _get_with_retry：經共用 Session（_YT_SESSION，連線重用）發送 GET 並加上簡易重試與退避；_decode_json：回應 JSON 解碼（有 orjson 時優先使用）；_parse_*：處理 RFC3339 時間與 ISO 8601 時長解析；fetch_video_meta_map：從資料庫讀取影片基本資料映射。
 
+import random
 import time
+from functools import lru_cache
 from typing import List, Dict, Any, Optional
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timezone
-import re
+from sqlalchemy import bindparam, text
+
+# orjson 為可選相依：有安裝時以其解碼 API 回應（videos.list 完整 part 的單頁可達數百 KB），否則退回 requests 內建的標準 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from scripts.db.db import IN_CLAUSE_CHUNK_SIZE
 
 # YouTube Data API v3 的 base URL
 YOUTUBE_API_BASE = "https://www.googleapis.com/youtube/v3"
 
+# YouTube Data API 共用 Session：保持連線（keep-alive），各批次呼叫不必重新 TCP/TLS 握手；
+# 連線池上限需不小於併發批次數（run_fetch_videos 8、run_velocity_track 12）。Session 可供多執行緒同時 GET。
+# Adapter 層只重試連線/讀取錯誤（例如閒置的 keep-alive 連線被伺服端關閉）；HTTP 狀態碼的重試仍由 _get_with_retry 處理。
+_YT_SESSION = requests.Session()
+_YT_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=3, connect=3, read=2, status=0, backoff_factor=0.5),
+    ),
+)
+
 # 當 response code 在此集合時，視為可重試（429: rate limit, 403: 部分情況, 5xx: 伺服器錯誤）
 RETRY_STATUS = {429, 403, 500, 502, 503, 504}
 
-# ISO 8601 Duration 解析用的正則：支援 PnDTnHnMnS（天、時、分、秒；時間部分以 T 開頭）
-DURATION_RE = re.compile(
-    r"^P(?:(?P<days>\d+)D)?(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:(?P<seconds>\d+)S)?)?$"
-)
+# 回應帶 Retry-After 時，單次等待的上限秒數（避免異常大值卡住整批）
+RETRY_AFTER_MAX_SEC = 60.0
+
+def _retry_after_seconds(resp: requests.Response) -> Optional[float]:
+    """
+    從回應標頭取出 Retry-After（秒數格式）；未提供或非數字（例如 HTTP-date 格式）時回傳 None。
+    """
+    raw = resp.headers.get("Retry-After")
+    try:
+        return max(0.0, float(raw)) if raw is not None else None
+    except (TypeError, ValueError):
+        return None
+
+# videos.list 的 part 組合：完整（新影片/待分類，需判斷型別）與僅統計（已分類影片，只需最新數字，回應較小）
+VIDEO_PARTS_FULL = "snippet,contentDetails,statistics,liveStreamingDetails,status"
+VIDEO_PARTS_STATS = "statistics"
+
+# 各 part 實際會讀取的欄位（fields= 部分回應）：略過縮圖、多語系、tags 等未使用內容，縮小回應與 JSON 解碼量
+_VIDEO_PART_FIELDS = {
+    "snippet": "snippet(channelId,title,publishedAt,liveBroadcastContent)",
+    "contentDetails": "contentDetails/duration",
+    "statistics": "statistics(viewCount,likeCount,commentCount)",
+    "liveStreamingDetails": "liveStreamingDetails(actualStartTime,actualEndTime)",
+}
+
+@lru_cache(maxsize=8)
+def _video_fields(parts: str) -> str:
+    """
+    依 part 組合產生 videos.list 的 fields 參數；未列於 _VIDEO_PART_FIELDS 的 part 整段保留。
+    """
+    selectors = ",".join(_VIDEO_PART_FIELDS.get(p, p) for p in parts.split(","))
+    return f"items(id,{selectors})"
+
+# ISO 8601 Duration 的單位表：支援 PnDTnHnMnS（天、時、分、秒；時間部分以 T 開頭）
+# 值為 (秒數倍率, 出現順序)；順序用來拒絕重複或倒序的單位（如 'PT5S3M'）
+_DURATION_DATE_UNITS = {"D": (86400, 1)}
+_DURATION_TIME_UNITS = {"H": (3600, 2), "M": (60, 3), "S": (1, 4)}
 
 # 你的門檻日期：2024-10-15 00:00:00 UTC（naive UTC）
 # 用途：在該日期前的短片，特定長度範圍（61–180 秒）可被視為 VOD（相容舊規則）
@@ -30,7 +88,30 @@ HEADERS = {
     "User-Agent": "Mozilla/5.0 (compatible; gpt-5/1.0; +https://example.com/bot)"
 }
 
-def _get_with_retry(url: str, params: Dict[str, Any], max_retries: int = 5, backoff_base: float = 0.8) -> Dict[str, Any]:
+# shorts/watch 導向探測共用 Session：併發判定時重用 www.youtube.com 的連線；池上限對應 CLASSIFY_WORKERS
+_PROBE_SESSION = requests.Session()
+_PROBE_SESSION.headers.update(HEADERS)
+_PROBE_SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=16))
+
+# 導向探測結果的程序內快取（video_id → 'shorts'/'vod'）：型別判定後不會改變；'unknown' 不快取以便下次重試。
+# 跨執行的持久層為 dim_video.shorts_check（已判定者只更新統計，不再進入判定流程）
+_URL_CLASS_CACHE: Dict[str, str] = {}
+
+def _decode_json(resp: requests.Response) -> Dict[str, Any]:
+    """
+    將回應內容解碼為字典：有 orjson 時直接解析 bytes（免去 text 解碼），否則使用 resp.json()。
+    """
+    if orjson is not None:
+        return orjson.loads(resp.content)
+    return resp.json()
+
+def _get_with_retry(
+    url: str,
+    params: Dict[str, Any],
+    max_retries: int = 5,
+    backoff_base: float = 0.8,
+    session: Optional[requests.Session] = None,
+) -> Dict[str, Any]:
     """
     發送 GET 並在特定狀態碼時進行重試；以簡易指數退避控制等待時間。
 
@@ -38,7 +119,9 @@ def _get_with_retry(url: str, params: Dict[str, Any], max_retries: int = 5, back
     - url：請求的 URL。
     - params：查詢參數。
     - max_retries：最大重試次數（不含首次），預設 5 次。
-    - backoff_base：退避底數，實際等待為 (backoff_base ** i) * 2 + i*0.1。
+    - backoff_base：退避底數，實際等待為 uniform(0, (backoff_base ** i) * 2)（full jitter，併發批次不會同步重試）；
+      回應帶 Retry-After 時改依該值等待（上限 RETRY_AFTER_MAX_SEC）。
+    - session：使用的 requests.Session；預設為模組共用的 _YT_SESSION。
 
     回傳：
     - 成功時回傳 JSON 解析後的字典。
@@ -47,14 +130,19 @@ def _get_with_retry(url: str, params: Dict[str, Any], max_retries: int = 5, back
     - 遇非可重試狀態碼：直接 raise_for_status。
     - 重試仍失敗：丟出 RuntimeError，內含最後一次錯誤狀態與訊息。
     """
+    http = session or _YT_SESSION
     last_err = None
     for i in range(max_retries):
-        resp = requests.get(url, params=params, timeout=30)
+        resp = http.get(url, params=params, timeout=30)
         if resp.status_code == 200:
-            return resp.json()
+            return _decode_json(resp)
         # 在可重試狀態碼時，等待後再試
         if resp.status_code in RETRY_STATUS:
-            sleep_s = (backoff_base ** i) * 2 + (i * 0.1)  # 簡單的指數退避 + 微抖動
+            retry_after = _retry_after_seconds(resp)
+            if retry_after is not None:
+                sleep_s = min(RETRY_AFTER_MAX_SEC, retry_after)  # 伺服端明確指定的等待時間
+            else:
+                sleep_s = random.uniform(0, (backoff_base ** i) * 2)  # 指數退避上限內隨機等待（full jitter）
             time.sleep(sleep_s)
             last_err = (resp.status_code, resp.text)
             continue
@@ -63,13 +151,18 @@ def _get_with_retry(url: str, params: Dict[str, Any], max_retries: int = 5, back
     # 用盡重試仍失敗
     raise RuntimeError(f"GET {url} failed after retries: {last_err}")
 
+@lru_cache(maxsize=4096)
 def _parse_rfc3339_to_naive_utc(s: Optional[str]) -> Optional[datetime]:
     """
     將 RFC3339（如 '2024-01-01T12:34:56Z'）轉成 naive UTC datetime。
-    - 解析後會先轉為 tz-aware UTC，再去掉 tzinfo，以便與其他 naive UTC 做比較。
+    - API 慣用的固定 20 字元 'YYYY-MM-DDTHH:MM:SSZ' 直接切片建構，不經 fromisoformat/astimezone 的中間物件。
+    - 其他格式（小數秒、非 Z 時區位移）：解析為 tz-aware 後轉 UTC，再去掉 tzinfo，以便與其他 naive UTC 做比較。
+    - datetime 不可變，以 lru_cache 快取：重複出現的時間字串（同日界線、重試重抓的頁面）只解析一次。
     """
     if not s:
         return None
+    if len(s) == 20 and s[19] == "Z" and s[10] == "T":
+        return datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]), int(s[11:13]), int(s[14:16]), int(s[17:19]))
     dt = datetime.fromisoformat(s.replace("Z", "+00:00")).astimezone(timezone.utc)
     return dt.replace(tzinfo=None)
 
@@ -78,17 +171,34 @@ def _parse_iso8601_duration_to_seconds(s: Optional[str]) -> Optional[int]:
     將 ISO 8601 Duration（例如 'PT1H2M30S'、'PT45S'、'P1DT2H'）解析為秒數。
     - 僅支援天/時/分/秒四種單位，未出現的單位視為 0。
     - 無效格式回傳 None。
+    - 單趟掃描字元並累加數字，不經正則與具名群組擷取。
     """
-    if not s:
+    if not s or s[0] != "P":
         return None
-    m = DURATION_RE.match(s)
-    if not m:
+    units = _DURATION_DATE_UNITS
+    total = 0
+    n = 0
+    has_digits = False
+    rank = 0
+    for c in s[1:]:
+        if "0" <= c <= "9":
+            n = n * 10 + (ord(c) - 48)
+            has_digits = True
+            continue
+        if c == "T" and units is _DURATION_DATE_UNITS and not has_digits:
+            units = _DURATION_TIME_UNITS
+            continue
+        unit = units.get(c)
+        if unit is None or not has_digits or unit[1] <= rank:
+            return None
+        total += n * unit[0]
+        rank = unit[1]
+        n = 0
+        has_digits = False
+    # 結尾殘留沒有單位的數字（如 'PT15'）視為無效
+    if has_digits:
         return None
-    days = int(m.group("days") or 0)
-    hours = int(m.group("hours") or 0)
-    minutes = int(m.group("minutes") or 0)
-    seconds = int(m.group("seconds") or 0)
-    return days * 86400 + hours * 3600 + minutes * 60 + seconds
+    return total
 
 def _classify_by_url_simple(vid: str) -> str:
     """
@@ -100,22 +210,34 @@ def _classify_by_url_simple(vid: str) -> str:
     備註：
     - 此法需對 YouTube 發送 HTTP 請求，受網路與平台行為影響。
     - 允許 redirect，並以 requests 自動處理最終 URL。
+    - 經共用的 _PROBE_SESSION 發送（可多執行緒同時呼叫，重用連線）；已判定的結果記在 _URL_CLASS_CACHE，同一程序內不重複探測。
+    - 只需要最終 URL：先以 HEAD 追蹤導向（不下載 HTML 本體）；若 HEAD 不被接受（4xx/5xx），
+      改以 stream=True 的 GET 取得最終 URL 後立即關閉連線，同樣不讀取本體。
     """
     def final_url(url: str) -> str:
         try:
-            r = requests.get(url, headers=HEADERS, timeout=12, allow_redirects=True)
-            return r.url or ""
+            r = _PROBE_SESSION.head(url, timeout=12, allow_redirects=True)
+            if r.status_code < 400:
+                return r.url or ""
+            with _PROBE_SESSION.get(url, timeout=12, allow_redirects=True, stream=True) as r:
+                return r.url or ""
         except Exception:
             # 網路/超時等情況，視為未知
             return ""
+    cached = _URL_CLASS_CACHE.get(vid)
+    if cached is not None:
+        return cached
+
     shorts_url = f"https://www.youtube.com/shorts/{vid}"
     su = final_url(shorts_url)
     if su.startswith("https://www.youtube.com/shorts/"):
+        _URL_CLASS_CACHE[vid] = "shorts"
         return "shorts"
 
     watch_url = f"https://www.youtube.com/watch?v={vid}"
     wu = final_url(watch_url)
     if wu.startswith("https://www.youtube.com/watch"):
+        _URL_CLASS_CACHE[vid] = "vod"
         return "vod"
 
     return "unknown"
@@ -177,6 +299,8 @@ def _decide_video_type(
 def fetch_videos_details_batch(
     yt_api_key: str,
     video_ids: List[str],
+    parts: str = VIDEO_PARTS_FULL,
+    session: Optional[requests.Session] = None,
 ) -> List[Dict[str, Any]]:
     """
     批次呼叫 YouTube videos.list 取得影片詳情，並回傳「已解析的常用欄位 + raw parts」。
@@ -184,7 +308,11 @@ def fetch_videos_details_batch(
 
     參數：
     - yt_api_key：YouTube Data API 的 API Key。
-    - video_ids：影片 ID 清單（建議最多 50 筆，API 限制）。
+    - video_ids：影片 ID 清單（建議最多 50 筆，API 限制）。超過 50 筆時由呼叫端切片，並以執行緒池併發呼叫本函式
+      （run_fetch_videos：FETCH_DETAILS_WORKERS、run_velocity_track：VELOCITY_FETCH_WORKERS）；本函式可安全地多執行緒同時呼叫。
+    - parts：要求的 part 組合；預設 VIDEO_PARTS_FULL。傳 VIDEO_PARTS_STATS 時僅統計欄位有值，
+      其餘欄位為空值/None（raw 內對應 part 為空 dict）。
+    - session：可選的 requests.Session；預設使用模組共用的 _YT_SESSION（連線重用）。
 
     回傳（每支影片一筆 Dict）：
     - video_id：影片 ID
@@ -195,23 +323,25 @@ def fetch_videos_details_batch(
     - view_count / like_count / comment_count：整數或 None
     - raw：原始 parts 的打包字典（snippet/contentDetails/statistics/liveStreamingDetails/status）
     """
-    # 1) 防呆：空清單直接回傳，避免送出空請求
+    # 1) 防呆：去除重複 ID（保留順序，重複的 id= 不必佔用請求名額）；空清單直接回傳，避免送出空請求
+    video_ids = list(dict.fromkeys(video_ids))
     if not video_ids:
         return []
 
     # 2) 端點 URL
     url = f"{YOUTUBE_API_BASE}/videos"
 
-    # 3) 查詢參數：一次要到所有必要 parts，以減少後續判斷再打 API 的需求
+    # 3) 查詢參數：預設一次要到所有必要 parts，以減少後續判斷再打 API 的需求
     params = {
-        "part": "snippet,contentDetails,statistics,liveStreamingDetails,status",
+        "part": parts,
         "id": ",".join(video_ids),  # 以逗號串接，最多 50
         "key": yt_api_key,
         "maxResults": 50,           # 與批次大小一致（雖非 videos.list 必要，但一致性佳）
+        "fields": _video_fields(parts),  # 只回傳會用到的欄位
     }
 
     # 4) 發送請求（含重試）
-    data = _get_with_retry(url, params)
+    data = _get_with_retry(url, params, session=session)
 
     # 5) 準備回傳容器
     rows: List[Dict[str, Any]] = []
@@ -239,16 +369,13 @@ def fetch_videos_details_batch(
         published_at = _parse_rfc3339_to_naive_utc(snippet.get("publishedAt"))
         duration_sec = _parse_iso8601_duration_to_seconds(content.get("duration"))
 
-        # 7.5 數值欄位（穩健轉型，避免 int(None)）
-        view_count: Optional[int] = (
-            int(stats["viewCount"]) if "viewCount" in stats and stats.get("viewCount") is not None else None
-        )
-        like_count: Optional[int] = (
-            int(stats["likeCount"]) if "likeCount" in stats and stats.get("likeCount") is not None else None
-        )
-        comment_count: Optional[int] = (
-            int(stats["commentCount"]) if "commentCount" in stats and stats.get("commentCount") is not None else None
-        )
+        # 7.5 數值欄位（穩健轉型，避免 int(None)；每欄只查一次 dict）
+        vc = stats.get("viewCount")
+        lc = stats.get("likeCount")
+        cc = stats.get("commentCount")
+        view_count: Optional[int] = int(vc) if vc is not None else None
+        like_count: Optional[int] = int(lc) if lc is not None else None
+        comment_count: Optional[int] = int(cc) if cc is not None else None
 
         # 7.6 組裝輸出列（暫不決定 video_type；raw parts 供後續判斷使用）
         row: Dict[str, Any] = {
@@ -274,6 +401,12 @@ def fetch_videos_details_batch(
     # 8) 回傳整批結果
     return rows
 
+_SQL_VIDEO_META = text("""
+    SELECT video_id, video_title, published_at
+    FROM dim_video
+    WHERE video_id IN :vids
+""").bindparams(bindparam("vids", expanding=True))
+
 def fetch_video_meta_map(engine, video_ids: List[str]) -> Dict[str, Dict]:
     """
     從資料庫 dim_video 中查詢指定 video_ids 的部分欄位，並回傳 dict 映射：
@@ -281,26 +414,21 @@ def fetch_video_meta_map(engine, video_ids: List[str]) -> Dict[str, Dict]:
     - value：{ "video_title": str, "published_at": datetime }
 
     備註：
-    - 使用裸 SQL 與 IN (...) 查詢；對大量 ID 時可考慮分批以避免 SQL 長度/執行效率問題。
-    - engine 須為 SQLAlchemy Engine；透過 engine.begin() 取得連線與交易範圍。
+    - 單一 IN (...) 查詢（expanding bindparam 展開參數，避免手動組裝佔位字串與 SQL injection）；
+      超過 IN_CLAUSE_CHUNK_SIZE 筆時分批查詢，同一連線重用同一個已編譯語句，再合併結果。
+    - engine 須為 SQLAlchemy Engine。
     """
+    video_ids = list(dict.fromkeys(video_ids))  # 去重（保留順序），縮短 IN 清單
     if not video_ids:
         return {}
-    # 依 video_ids 數量建立對應的 %s 佔位符，供 DB-API 驅動套入參數（避免 SQL injection）
-    placeholders = ",".join(["%s"] * len(video_ids))
-    sql = f"""
-        SELECT video_id, video_title, published_at
-        FROM dim_video
-        WHERE video_id IN ({placeholders})
-    """
     out: Dict[str, Dict] = {}
-    # 使用 engine.begin() 建立交易範圍；確保資源釋放與錯誤時正確處理
-    with engine.begin() as conn:
-        # 取出 DB-API 游標，以便使用 .execute + fetchall（視驅動而定）
-        cur = conn.connection.cursor()
-        # 傳入 video_ids 作為參數列表，與 %s 佔位符對應
-        cur.execute(sql, video_ids)
-        # 逐筆將查詢結果組裝為 dict
-        for vid, title, published_at in cur.fetchall():
-            out[vid] = {"video_title": title, "published_at": published_at}
-    return out
\ No newline at end of file
+    with engine.connect() as conn:
+        for i in range(0, len(video_ids), IN_CLAUSE_CHUNK_SIZE):
+            chunk = video_ids[i : i + IN_CLAUSE_CHUNK_SIZE]
+            out.update(
+                {
+                    vid: {"video_title": title, "published_at": published_at}
+                    for vid, title, published_at in conn.execute(_SQL_VIDEO_META, {"vids": chunk})
+                }
+            )
+    return out